@@ -1,53 +1,248 @@
 import json
+import os
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import logfire
 from pydantic_ai import (
     Agent,
     DeferredToolRequests,
+    RunContext,
+    RunUsage,
     Tool,
 )
+from pydantic_ai.models import Model, infer_model
+from pydantic_ai.settings import ModelSettings
 
-from prompts import coding_instruction, initializer_instruction, planning_instruction
-from schemas import AgentDeps, Plan
-from tools import BashSession, Tools
+from history import HistoryCompactor
+from prompts import (
+    coding_instruction,
+    draft_instruction,
+    initializer_instruction,
+    local_servers_instruction,
+    planning_instruction,
+    review_instruction,
+    revision_instruction,
+    sandbox_servers_instruction,
+    section_instruction,
+)
+from replay import RecordingModel, ReplayStore, replay_model
+from schemas import AgentDeps, Plan, PlanReview, PlanRevision
+from search import CACHE_DIR
+from spec import SPEC_DATA, SPEC_FILE, load_spec, spec_outline
+from tools import BashSessionPool, Tools
+
+if TYPE_CHECKING:
+    # Only for typing: importing a provider module needs its optional SDK.
+    from pydantic_ai.models.anthropic import AnthropicModelSettings
+    from pydantic_ai.models.openai import OpenAIChatModelSettings
 
 logfire.configure()
 logfire.instrument_pydantic_ai()
 
 model = "openai:gpt-5-mini"
+summary_model = "openai:gpt-5-nano"
+context_window_size = 400_000
+# Docker runtime for coding tools (e.g. "python-datascience"); unset runs them locally.
+sandbox_runtime = os.environ.get("AUTOCODE_SANDBOX") or None
+# "1" drafts plan sections with concurrent sub-agents from a planner-made skeleton.
+plan_fanout = os.environ.get("AUTOCODE_PLAN_FANOUT") == "1"
+
+# "record" stores every model response, "replay" serves them back without network.
+replay_mode = os.environ.get("AUTOCODE_REPLAY")
+replay_store = ReplayStore(
+    Path(os.environ.get("AUTOCODE_REPLAY_DIR", CACHE_DIR / "replay"))
+)
+
+
+def agent_model(name: str, model_name: str = model) -> Model | str:
+    """The model for an agent, wrapped for recording or replaced for replay."""
+    if replay_mode == "record":
+        return RecordingModel(infer_model(model_name), replay_store, name)
+    if replay_mode == "replay":
+        return replay_model(replay_store, name)
+    return model_name
+
+
+pool = BashSessionPool(size=4)
+tools = Tools(pool)
+
+
+def prompt_cache_settings(name: str) -> ModelSettings:
+    """Model settings that turn on provider prompt caching for one agent's requests."""
+    if model.startswith("anthropic:"):
+        anthropic: AnthropicModelSettings = {
+            "anthropic_cache_instructions": True,
+            "anthropic_cache_tool_definitions": True,
+            "anthropic_cache_messages": True,
+        }
+        return anthropic
+    if model.startswith("openai:"):
+        # OpenAI caches long prefixes automatically; the key routes requests that
+        # share a prefix to the same cache.
+        openai: OpenAIChatModelSettings = {
+            "openai_prompt_cache_key": f"autocode-{name}"
+        }
+        return openai
+    return {}
+
+
+def log_cache_usage(name: str, usage: RunUsage):
+    """Report how much of a run's input was served from the provider's prompt cache."""
+    cached = usage.cache_read_tokens
+    logfire.info(
+        "{name} run: {cached} of {input_tokens} input tokens cached ({rate:.0%}), "
+        "{uncached} uncached",
+        name=name,
+        cached=cached,
+        input_tokens=usage.input_tokens,
+        uncached=usage.input_tokens - cached,
+        rate=cached / usage.input_tokens if usage.input_tokens else 0.0,
+    )
 
-session = BashSession()
-tools = Tools(session)
 
 planning_agent = Agent(
-    model=model,
+    model=agent_model("planning"),
+    defer_model_check=True,
     instructions=planning_instruction,
     output_type=Plan | DeferredToolRequests,
+    model_settings=prompt_cache_settings("planning"),
     tools=[
-        Tool(function=tools.approve, requires_approval=True),
         Tool(function=tools.ask_followup, requires_approval=True),
     ],
 )
 
-initializer_agent = Agent(
-    instructions=initializer_instruction,
-    model=model,
-    tools=[tools.read_file, tools.write_file, tools.execute],
-    deps_type=AgentDeps,
+# Re-planning after feedback: pick the affected sections, then rewrite only those.
+revision_agent = Agent(
+    model=agent_model("revision"),
+    defer_model_check=True,
+    instructions=revision_instruction,
+    output_type=PlanRevision,
+    model_settings=prompt_cache_settings("revision"),
 )
 
-coding_agent = Agent(
-    instructions=coding_instruction,
-    model=model,
-    tools=[
-        tools.read_file,
-        tools.write_file,
-        tools.execute,
-        tools.edit_file,
-        tools.list_files,
-        tools.search_files,
-    ],
-    model_settings={"parallel_tool_calls": True},
-    deps_type=AgentDeps,
+# Each run passes an output_type holding just the sections to rewrite.
+section_agent = Agent(
+    model=agent_model("sections"),
+    defer_model_check=True,
+    instructions=section_instruction,
+    model_settings=prompt_cache_settings("sections"),
+)
+
+# Fan-out planning: one run per section, each with that section as output_type.
+drafting_agent = Agent(
+    model=agent_model("drafting"),
+    defer_model_check=True,
+    instructions=draft_instruction,
+    model_settings=prompt_cache_settings("drafting"),
 )
+
+review_agent = Agent(
+    model=agent_model("review"),
+    defer_model_check=True,
+    instructions=review_instruction,
+    output_type=PlanReview,
+    model_settings=prompt_cache_settings("review"),
+)
+
+
+def with_spec(
+    ctx: RunContext[AgentDeps], instructions: str, outline: bool = False
+) -> str:
+    """Append app_spec.md so the spec is part of the stable, cacheable prefix.
+
+    With outline, only the spec's outline is appended when app_spec.json exists, and
+    the agent looks up the sections it needs with read_spec.
+    """
+    if not ctx.deps.cache_friendly:
+        return instructions
+    if outline and Path(SPEC_DATA).exists():
+        return (
+            f"{instructions}\n<app_spec_outline>\n{spec_outline(load_spec())}\n"
+            "</app_spec_outline>\n"
+        )
+    spec = Path(SPEC_FILE)
+    if not spec.exists():
+        return instructions
+    return f"{instructions}\n<app_spec>\n{spec.read_text()}\n</app_spec>\n"
+
+
+def servers_instruction(tools: Tools) -> str:
+    """How to run dev servers with these tools: start_process locally, or
+    backgrounded by init.sh in a sandbox."""
+    if tools.local:
+        return local_servers_instruction
+    return sandbox_servers_instruction
+
+
+def create_initializer_agent(tools: Tools) -> Agent[AgentDeps, str]:
+    servers = servers_instruction(tools)
+
+    def initializer_instructions(ctx: RunContext[AgentDeps]) -> str:
+        return with_spec(ctx, initializer_instruction + servers)
+
+    return Agent(
+        instructions=initializer_instructions,
+        model=agent_model("initializer"),
+        defer_model_check=True,
+        tools=[
+            tools.read_file,
+            tools.write_file,
+            tools.execute,
+            *tools.process_tools(),
+            tools.log_progress,
+            tools.latest_progress,
+            tools.feature_stats,
+        ],
+        model_settings=prompt_cache_settings("initializer"),
+        deps_type=AgentDeps,
+        history_processors=[tools.append_usage],
+    )
+
+
+def create_coding_agent(tools: Tools) -> Agent[AgentDeps, str]:
+    compactor = HistoryCompactor(
+        model=agent_model("summary", summary_model), forget=tools.forget_read
+    )
+    servers = servers_instruction(tools)
+
+    def coding_instructions(ctx: RunContext[AgentDeps]) -> str:
+        return with_spec(
+            ctx,
+            coding_instruction.format(context_window_size=ctx.deps.context_window_size)
+            + servers,
+            outline=True,
+        )
+
+    return Agent(
+        instructions=coding_instructions,
+        model=agent_model("coding"),
+        defer_model_check=True,
+        tools=[
+            tools.read_file,
+            tools.write_file,
+            tools.execute,
+            *tools.process_tools(),
+            tools.edit_file,
+            tools.batch_edit,
+            tools.list_files,
+            tools.search_files,
+            tools.read_output,
+            tools.log_progress,
+            tools.latest_progress,
+            tools.progress_for_feature,
+            tools.next_feature,
+            tools.get_feature,
+            tools.mark_passing,
+            tools.feature_stats,
+            tools.read_spec,
+        ],
+        model_settings=prompt_cache_settings("coding")
+        | ModelSettings(parallel_tool_calls=True),
+        deps_type=AgentDeps,
+        history_processors=[compactor, tools.append_usage],
+    )
+
+
+initializer_agent = create_initializer_agent(tools)
+coding_agent = create_coding_agent(tools)
@@ -0,0 +1,93 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+# Metric name suffix -> whether it is a timing (noisy) or a size (deterministic).
+TIMINGS = ("p50_ms", "p95_ms", "tool_s")
+SIZES = ("bytes", "tokens", "errors")
+
+
+def metrics(results: dict) -> dict[str, float]:
+    """Flatten a results file into "tools.local.read_file.full.p50_ms" style keys."""
+    flat = {}
+    for mode, cases in results.get("tools", {}).items():
+        for case, stats in cases.items():
+            for key in TIMINGS + SIZES:
+                if key in stats:
+                    flat[f"tools.{mode}.{case}.{key}"] = stats[key]
+    for key, value in results.get("sessions", {}).get("per_feature", {}).items():
+        if key.endswith(TIMINGS + SIZES):
+            flat[f"sessions.per_feature.{key}"] = value
+    return flat
+
+
+def regressions(
+    baseline: dict,
+    current: dict,
+    time_threshold: float = 0.2,
+    size_threshold: float = 0.05,
+    min_ms: float = 1.0,
+) -> list[tuple[str, float, float]]:
+    """Metrics that got worse by more than their threshold.
+
+    Timings below min_ms in both runs are ignored; they are all noise.
+    """
+    old, new = metrics(baseline), metrics(current)
+    worse = []
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        is_timing = key.endswith(TIMINGS)
+        if is_timing:
+            scale = 1000 if key.endswith("_s") else 1
+            if max(before, after) * scale < min_ms:
+                continue
+        threshold = time_threshold if is_timing else size_threshold
+        if after > before * (1 + threshold):
+            worse.append((key, before, after))
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare benchmark results against a baseline."
+    )
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("current", type=Path)
+    parser.add_argument(
+        "--time-threshold",
+        type=float,
+        default=0.2,
+        help="allowed relative slowdown of timings (default 0.2)",
+    )
+    parser.add_argument(
+        "--size-threshold",
+        type=float,
+        default=0.05,
+        help="allowed relative growth of bytes, tokens and errors (default 0.05)",
+    )
+    args = parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text())
+    current = json.loads(args.current.read_text())
+    worse = regressions(baseline, current, args.time_threshold, args.size_threshold)
+
+    console = Console()
+    if not worse:
+        console.print("[bold green]No regressions against the baseline[/bold green]")
+        return
+    table = Table(title="Regressions")
+    for column in ["metric", "baseline", "current", "change"]:
+        table.add_column(column, justify="left" if column == "metric" else "right")
+    for key, before, after in worse:
+        change = f"+{(after - before) / before:.0%}" if before else "new"
+        table.add_row(key, f"{before:.2f}", f"{after:.2f}", change)
+    console.print(table)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
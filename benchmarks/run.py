@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+import contextlib
+import inspect
+import json
+import platform
+import random
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import datetime, timezone
+from pathlib import Path
+
+import logfire
+from pydantic_ai import RunContext
+from pydantic_ai.models.test import TestModel
+from pydantic_ai.usage import RunUsage
+from rich.console import Console
+from rich.table import Table
+
+from benchmarks.sessions import run_sessions
+from benchmarks.workspace import Workspace, generate_workspace
+from output import estimate_tokens
+from schemas import AgentDeps
+from tools import BashSessionPool, LazySandbox, Tools
+
+SANDBOX_ROOT = "/workspace"
+
+
+def summarize(times: list[float], outputs: list[str]) -> dict:
+    """Latency percentiles in milliseconds and output size of one benchmark case."""
+    ms = sorted(t * 1000 for t in times)
+    return {
+        "calls": len(ms),
+        "min_ms": ms[0],
+        "p50_ms": statistics.median(ms),
+        "p95_ms": ms[min(len(ms) - 1, round(0.95 * (len(ms) - 1)))],
+        "mean_ms": statistics.fmean(ms),
+        "bytes": sum(len(text.encode()) for text in outputs) // len(outputs),
+        "tokens": sum(estimate_tokens(text) for text in outputs) // len(outputs),
+        "errors": sum("ERROR" in text[:200] for text in outputs),
+    }
+
+
+def tool_cases(
+    tools: Tools, workspace: Workspace, root: str, seed: int
+) -> dict[str, Callable[[RunContext[AgentDeps], int], object]]:
+    """One call per case and repeat, against paths under root."""
+    rng = random.Random(seed)
+    files = [f"{root}/{path}" for path in workspace.files]
+    picks = [rng.randrange(len(files)) for _ in range(1024)]
+
+    def pick(i: int) -> str:
+        return files[picks[i % len(picks)]]
+
+    def symbol(i: int) -> str:
+        return workspace.symbols[workspace.files[picks[i % len(picks)]]]
+
+    def edit(ctx, i):
+        path, marker = pick(i), f'MARKER = "{symbol(i)}"'
+        tools.edit_file(ctx, path, marker, f"{marker}  # edited")
+        return tools.edit_file(ctx, path, f"{marker}  # edited", marker)
+
+    return {
+        "read_file.full": lambda ctx, i: tools.read_file(ctx, pick(i), refresh=True),
+        "read_file.reread": lambda ctx, i: tools.read_file(ctx, files[0]),
+        "read_file.window": lambda ctx, i: tools.read_file(
+            ctx, pick(i), offset=20, limit=40, refresh=True
+        ),
+        "list_files.glob": lambda ctx, i: tools.list_files(ctx, root, "*.py"),
+        "list_files.tree": lambda ctx, i: tools.list_files(
+            ctx, root, max_depth=3, tree=True
+        ),
+        "search_files.literal": lambda ctx, i: tools.search_files(
+            ctx, symbol(i), root, literal=True
+        ),
+        "search_files.regex": lambda ctx, i: tools.search_files(
+            ctx, r"def \w+_m1\d_\d+\(", root, max_results=100
+        ),
+        "edit_file": edit,
+        "execute.echo": lambda ctx, i: tools.execute(ctx, "echo ok"),
+        "execute.find": lambda ctx, i: tools.execute(
+            ctx, f"find {root} -name '*.py' | wc -l"
+        ),
+    }
+
+
+async def bench_tools(
+    tools: Tools, workspace: Workspace, root: str, deps: AgentDeps, repeats: int
+) -> dict:
+    """Time every case repeats times after one untimed warm-up call."""
+    results = {}
+    for name, case in tool_cases(tools, workspace, root, seed=0).items():
+        times, outputs = [], []
+        for i in range(repeats + 1):
+            ctx = RunContext(
+                deps=deps,
+                model=TestModel(),
+                usage=RunUsage(),
+                run_id=f"bench-{name}",
+                run_step=i + 1,
+            )
+            started = time.perf_counter()
+            output = case(ctx, i)
+            if inspect.isawaitable(output):
+                output = await output
+            elapsed = time.perf_counter() - started
+            if i:
+                times.append(elapsed)
+                outputs.append(str(output))
+        results[name] = summarize(times, outputs)
+    return results
+
+
+async def bench_local(workspace: Workspace, deps: AgentDeps, repeats: int) -> dict:
+    pool = BashSessionPool(size=4, cwd=str(workspace.root))
+    try:
+        with contextlib.chdir(workspace.root):
+            return await bench_tools(Tools(pool), workspace, ".", deps, repeats)
+    finally:
+        await pool.close()
+
+
+async def bench_sandbox(workspace: Workspace, deps: AgentDeps, repeats: int) -> dict:
+    """Time the tools against a Docker sandbox with the workspace mounted in it."""
+    sandbox = LazySandbox(volumes={str(workspace.root): SANDBOX_ROOT})
+    pool = BashSessionPool(size=1, cwd=str(workspace.root))
+    try:
+        sandbox.get()  # Fail here, not inside every timed call, if Docker is down.
+        tools = Tools(pool, sandbox=sandbox)
+        return await bench_tools(tools, workspace, SANDBOX_ROOT, deps, repeats)
+    finally:
+        await pool.close()
+        sandbox.stop()
+
+
+async def bench_sessions(workspace: Workspace, deps: AgentDeps, features: int) -> dict:
+    # Imported here so tool-only runs don't build the agents.
+    from agent import create_coding_agent
+
+    pool = BashSessionPool(size=4, cwd=str(workspace.root))
+    tools = Tools(pool)
+    try:
+        with contextlib.chdir(workspace.root):
+            results = await run_sessions(
+                lambda: create_coding_agent(tools), deps, workspace, features
+            )
+        results["tool_metrics"] = tools.metrics.summary()
+        return results
+    finally:
+        await pool.close()
+
+
+def print_results(results: dict):
+    console = Console()
+    for mode, cases in results["tools"].items():
+        table = Table(title=f"Tools ({mode})")
+        for column in ["case", "p50 ms", "p95 ms", "bytes", "tokens", "errors"]:
+            table.add_column(column, justify="left" if column == "case" else "right")
+        for name, stats in cases.items():
+            table.add_row(
+                name,
+                f"{stats['p50_ms']:.2f}",
+                f"{stats['p95_ms']:.2f}",
+                str(stats["bytes"]),
+                str(stats["tokens"]),
+                str(stats["errors"]),
+            )
+        console.print(table)
+    if sessions := results.get("sessions"):
+        average = sessions["per_feature"]
+        console.print(
+            f"[bold]Sessions:[/bold] per feature {average['tool_calls']:.0f} tool calls, "
+            f"{average['tool_s'] * 1000:.0f} ms tool-side, {average['bytes']:.0f} bytes, "
+            f"~{average['tokens']:.0f} tokens"
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the coding tools and scripted sessions."
+    )
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--file-size", type=int, default=4_000)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--node-modules", type=int, default=2_000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--features", type=int, default=5)
+    parser.add_argument("--context-window-size", type=int, default=400_000)
+    parser.add_argument("--sandbox", action="store_true", help="also time the sandbox")
+    parser.add_argument("--no-sessions", action="store_true")
+    parser.add_argument("--workspace", type=Path, default=None)
+    parser.add_argument("--output", type=Path, default=Path("benchmark.json"))
+    args = parser.parse_args()
+
+    deps = AgentDeps(context_window_size=args.context_window_size)
+    shape = {
+        "files": args.files,
+        "file_size": args.file_size,
+        "depth": args.depth,
+        "node_modules_files": args.node_modules,
+    }
+    root = args.workspace or Path(tempfile.mkdtemp(prefix="autocode-bench-"))
+    results = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "workspace": shape,
+        "repeats": args.repeats,
+        "tools": {},
+    }
+
+    workspace = generate_workspace(root / "tools", **shape)
+    results["tools"]["local"] = await bench_local(workspace, deps, args.repeats)
+    if args.sandbox:
+        try:
+            results["tools"]["sandbox"] = await bench_sandbox(
+                generate_workspace(root / "sandbox", **shape), deps, args.repeats
+            )
+        except Exception as e:
+            logfire.warn("Sandbox benchmarks skipped: {error}", error=str(e))
+    if not args.no_sessions:
+        workspace = generate_workspace(root / "sessions", **shape)
+        results["sessions"] = await bench_sessions(workspace, deps, args.features)
+
+    args.output.write_text(json.dumps(results, indent=2))
+    print_results(results)
+    Console().print(f"[bold green]Results written to {args.output}[/bold green]")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
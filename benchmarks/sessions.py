@@ -0,0 +1,136 @@
+import time
+from collections.abc import Callable
+
+from pydantic_ai import (
+    Agent,
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UsageLimits,
+)
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from benchmarks.workspace import Workspace
+from output import estimate_tokens
+from schemas import AgentDeps
+
+
+def feature_script(workspace: Workspace, feature: int) -> list[list[ToolCallPart]]:
+    """The tool calls a typical coding session makes, one list per model turn.
+
+    The session explores the tree, reads two modules, edits one, checks it with a
+    command and re-reads it, the way agents verify their edits.
+    """
+    files = workspace.files
+    target = files[(2 * feature) % len(files)]
+    neighbour = files[(2 * feature + 1) % len(files)]
+    symbol = workspace.symbols[target]
+    return [
+        [
+            ToolCallPart("list_files", {"pattern": "*.py", "max_depth": 2}),
+            ToolCallPart("search_files", {"pattern": symbol, "literal": True}),
+        ],
+        [
+            ToolCallPart("read_file", {"filepath": target}),
+            ToolCallPart("read_file", {"filepath": neighbour}),
+        ],
+        [
+            ToolCallPart(
+                "edit_file",
+                {
+                    "filepath": target,
+                    "old_str": f'MARKER = "{symbol}"',
+                    "new_str": f'MARKER = "{symbol}_feature_{feature}"',
+                },
+            )
+        ],
+        [
+            ToolCallPart(
+                "execute", {"command": f"python -m py_compile {target} && echo ok"}
+            )
+        ],
+        [ToolCallPart("read_file", {"filepath": target})],
+        [
+            ToolCallPart(
+                "search_files", {"pattern": r"def \w+_m1\d_", "max_results": 50}
+            )
+        ],
+    ]
+
+
+def scripted_model(
+    script: list[list[ToolCallPart]], calls: list[float]
+) -> FunctionModel:
+    """A stand-in model that plays back the script, then finishes.
+
+    The time of every model call is appended to calls, so the gaps between them
+    measure the tool side of each turn.
+    """
+
+    def respond(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        calls.append(time.perf_counter())
+        turn = sum(isinstance(m, ModelResponse) for m in messages)
+        if turn < len(script):
+            return ModelResponse(parts=list(script[turn]))
+        return ModelResponse(parts=[TextPart("Feature implemented.")])
+
+    return FunctionModel(respond, model_name="benchmark-script")
+
+
+async def run_feature(
+    agent: Agent[AgentDeps, str],
+    deps: AgentDeps,
+    workspace: Workspace,
+    feature: int,
+) -> dict:
+    """Run one scripted coding session and measure what its tools cost."""
+    calls: list[float] = []
+    started = time.perf_counter()
+    result = await agent.run(
+        f"Implement feature {feature}.",
+        deps=deps,
+        model=scripted_model(feature_script(workspace, feature), calls),
+        usage_limits=UsageLimits(request_limit=None),
+    )
+    wall = time.perf_counter() - started
+
+    returns = [
+        part.model_response_str()
+        for message in result.all_messages()
+        if isinstance(message, ModelRequest)
+        for part in message.parts
+        if isinstance(part, ToolReturnPart)
+    ]
+    return {
+        "feature": feature,
+        "turns": len(calls),
+        "tool_calls": len(returns),
+        "wall_s": wall,
+        "tool_s": calls[-1] - calls[0] if calls else 0.0,
+        "bytes": sum(len(text.encode()) for text in returns),
+        "tokens": sum(estimate_tokens(text) for text in returns),
+        "errors": sum(text.startswith("ERROR") for text in returns),
+    }
+
+
+async def run_sessions(
+    create_agent: Callable[[], Agent[AgentDeps, str]],
+    deps: AgentDeps,
+    workspace: Workspace,
+    features: int,
+) -> dict:
+    """Run one session per feature and total the per-feature measurements."""
+    agent = create_agent()
+    results = [
+        await run_feature(agent, deps, workspace, feature)
+        for feature in range(features)
+    ]
+    keys = ["tool_calls", "wall_s", "tool_s", "bytes", "tokens", "errors"]
+    per_feature = {
+        key: sum(r[key] for r in results) / len(results) if results else 0.0
+        for key in keys
+    }
+    return {"features": results, "per_feature": per_feature}
@@ -0,0 +1,104 @@
+import random
+import shutil
+from dataclasses import dataclass, field
+from pathlib import Path
+
+WORDS = [
+    "account",
+    "buffer",
+    "cache",
+    "config",
+    "event",
+    "handler",
+    "index",
+    "item",
+    "order",
+    "parser",
+    "queue",
+    "record",
+    "request",
+    "session",
+    "token",
+    "user",
+]
+
+
+@dataclass
+class Workspace:
+    """A generated project tree and the facts benchmarks need about it."""
+
+    root: Path
+    files: list[str] = field(default_factory=list)
+    symbols: dict[str, str] = field(default_factory=dict)
+    bytes: int = 0
+
+
+def _module(rng: random.Random, name: str, size: int) -> tuple[str, str]:
+    """Python-looking source of about size bytes, and a symbol unique to it."""
+    symbol = f"{name}_marker"
+    lines = [f'"""Generated module {name}."""', "", f'MARKER = "{symbol}"', ""]
+    length = sum(len(line) + 1 for line in lines)
+    n = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        block = [
+            f"def {word}_{name}_{n}(value, limit={rng.randint(1, 100)}):",
+            f"    # Normalize the {word} before it reaches the {rng.choice(WORDS)}.",
+            "    if value > limit:",
+            f"        return {word}_{name}_{n}(value - limit)",
+            f"    return value * {rng.randint(2, 9)}",
+            "",
+        ]
+        lines.extend(block)
+        length += sum(len(line) + 1 for line in block)
+        n += 1
+    return "\n".join(lines) + "\n", symbol
+
+
+def generate_workspace(
+    root: str | Path,
+    files: int = 500,
+    file_size: int = 4_000,
+    depth: int = 4,
+    node_modules_files: int = 2_000,
+    seed: int = 0,
+) -> Workspace:
+    """Write a synthetic project of the given shape under root, replacing it.
+
+    Source files are spread over a tree depth directories deep. node_modules gets
+    node_modules_files small JavaScript files, which file tools should skip.
+    The same seed always produces the same tree.
+    """
+    rng = random.Random(seed)
+    root = Path(root)
+    shutil.rmtree(root, ignore_errors=True)
+    root.mkdir(parents=True)
+    workspace = Workspace(root=root.resolve())
+
+    directories = [Path("src")]
+    for level in range(1, depth):
+        parents = [d for d in directories if len(d.parts) == level]
+        for parent in parents:
+            for _ in range(rng.randint(2, 3)):
+                directories.append(parent / f"{rng.choice(WORDS)}_{len(directories)}")
+
+    for i in range(files):
+        relative = rng.choice(directories) / f"module_{i}.py"
+        content, symbol = _module(rng, f"m{i}", file_size)
+        path = root / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+        workspace.files.append(relative.as_posix())
+        workspace.symbols[relative.as_posix()] = symbol
+        workspace.bytes += len(content)
+
+    for i in range(node_modules_files):
+        package = root / "node_modules" / f"pkg-{i % 50}" / "lib"
+        package.mkdir(parents=True, exist_ok=True)
+        (package / f"index_{i}.js").write_text(
+            f"module.exports = function {rng.choice(WORDS)}{i}() {{ return {i}; }};\n"
+        )
+
+    (root / ".gitignore").write_text("node_modules/\nbuild/\n")
+    (root / "README.md").write_text("# Benchmark workspace\n")
+    return workspace
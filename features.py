@@ -0,0 +1,166 @@
+import fcntl
+import json
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+from pydantic import TypeAdapter
+
+from files import atomic_write
+from schemas import FeatureSpec
+
+FEATURES_FILE = "features.json"
+LOCK_FILE = Path(".autocode") / "features.lock"
+
+feature_list = TypeAdapter(list[FeatureSpec])
+
+
+class FeatureError(Exception):
+    pass
+
+
+def render_feature(index: int, feature: FeatureSpec) -> str:
+    lines = [
+        f"Feature {index} [{feature.category}] passes={str(feature.passes).lower()}",
+        feature.description,
+    ]
+    lines.extend(f"  {n}. {step}" for n, step in enumerate(feature.steps, start=1))
+    if feature.depends_on:
+        lines.append(f"Depends on: {', '.join(map(str, feature.depends_on))}")
+    return "\n".join(lines)
+
+
+def violations(before: list[FeatureSpec], after: list[FeatureSpec]) -> list[str]:
+    """Changes between two versions of the registry other than passes false -> true."""
+    problems = []
+    if len(after) != len(before):
+        problems.append(f"feature count changed from {len(before)} to {len(after)}")
+    for index, (old, new) in enumerate(zip(before, after)):
+        if old.model_dump(exclude={"passes"}) != new.model_dump(exclude={"passes"}):
+            problems.append(f"feature {index} was rewritten")
+        if old.passes and not new.passes:
+            problems.append(f"feature {index} was marked failing")
+    return problems
+
+
+class FeatureRegistry:
+    """Typed, locked access to a project's features.json.
+
+    Every read validates the file; the only write is mark_passing, which flips one
+    passes flag and leaves every other field, and the order, untouched. Writes hold
+    a thread lock and an flock on .autocode/features.lock and replace the file
+    atomically. Scheduler workers each have their own worktree copy, so the lock
+    only has to cover agents and processes sharing one directory.
+    """
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        self.path = self.directory / FEATURES_FILE
+        self.lock_path = self.directory / LOCK_FILE
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+            with self.lock_path.open("w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                yield
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def load(self) -> list[FeatureSpec]:
+        if not self.path.exists():
+            raise FeatureError(f"{FEATURES_FILE} does not exist yet")
+        return feature_list.validate_json(self.path.read_bytes())
+
+    def get(self, index: int) -> FeatureSpec:
+        features = self.load()
+        if not 0 <= index < len(features):
+            raise FeatureError(
+                f"no feature {index}; valid ids are 0-{len(features) - 1}"
+            )
+        return features[index]
+
+    def next(self) -> tuple[int, FeatureSpec] | None:
+        """The earliest failing feature whose dependencies all pass."""
+        features = self.load()
+        for index, feature in enumerate(features):
+            if not feature.passes and all(
+                0 <= dep < len(features) and features[dep].passes
+                for dep in feature.depends_on
+            ):
+                return index, feature
+        return None
+
+    def mark_passing(self, index: int) -> FeatureSpec:
+        with self._locked():
+            raw = json.loads(self.path.read_text())
+            features = feature_list.validate_python(raw)
+            if not 0 <= index < len(features):
+                raise FeatureError(
+                    f"no feature {index}; valid ids are 0-{len(features) - 1}"
+                )
+            feature = features[index]
+            if feature.passes:
+                raise FeatureError(f"feature {index} already passes")
+            unknown = [d for d in feature.depends_on if not 0 <= d < len(features)]
+            if unknown:
+                raise FeatureError(
+                    f"feature {index} depends on unknown features "
+                    f"{', '.join(map(str, unknown))}; valid ids are "
+                    f"0-{len(features) - 1}"
+                )
+            blocking = [d for d in feature.depends_on if not features[d].passes]
+            if blocking:
+                raise FeatureError(
+                    f"feature {index} depends on failing features "
+                    f"{', '.join(map(str, blocking))}"
+                )
+            raw[index]["passes"] = True
+            atomic_write(str(self.path), json.dumps(raw, indent=2) + "\n")
+            return feature.model_copy(update={"passes": True})
+
+    def stats(self) -> dict:
+        features = self.load()
+        by_category: dict[str, Counter] = {}
+        for feature in features:
+            counts = by_category.setdefault(feature.category, Counter())
+            counts["total"] += 1
+            counts["passing"] += feature.passes
+        return {
+            "total": len(features),
+            "passing": sum(f.passes for f in features),
+            "by_category": {k: dict(v) for k, v in sorted(by_category.items())},
+        }
+
+    def snapshot(self) -> list[dict]:
+        """The raw registry, to pass to restore() later."""
+        return json.loads(self.path.read_text())
+
+    def restore(self, baseline: list[dict]) -> list[str]:
+        """Undo forbidden changes made since baseline, keeping newly passing flags.
+
+        Returns what was wrong; the file is only rewritten if something was.
+        """
+        with self._locked():
+            try:
+                current = self.load()
+            except Exception as e:
+                current, problems = [], [f"{FEATURES_FILE} is unreadable: {e}"]
+            else:
+                problems = violations(feature_list.validate_python(baseline), current)
+            if not problems:
+                return []
+            restored = [
+                {
+                    **raw,
+                    "passes": bool(raw.get("passes"))
+                    or (index < len(current) and current[index].passes),
+                }
+                for index, raw in enumerate(baseline)
+            ]
+            atomic_write(str(self.path), json.dumps(restored, indent=2) + "\n")
+            return problems
@@ -0,0 +1,908 @@
+import difflib
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from datetime import datetime
+from fnmatch import fnmatch
+
+from schemas import FileEdit
+
+BLOCK_SIZE = 1 << 14
+BINARY_SNIFF_BYTES = 8192
+MAX_LINE_LENGTH = 2000
+DEFAULT_EXCLUDES = frozenset(
+    {".git", ".autocode", ".venv", "__pycache__", "node_modules"}
+)
+
+
+def _glob_to_regex(pattern: str) -> str:
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            parts.append("/.*")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and (end := pattern.find("]", i + 2)) != -1:
+            body = pattern[i + 1 : end].replace("\\", "\\\\")
+            parts.append("[^" + body[1:] + "]" if body[0] == "!" else f"[{body}]")
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(parts)
+
+
+@dataclass
+class IgnoreRule:
+    regex: re.Pattern
+    negated: bool
+    dir_only: bool
+
+
+@dataclass
+class Gitignore:
+    """The rules of one .gitignore file, matched against paths relative to its
+    directory."""
+
+    base: str
+    rules: list[IgnoreRule]
+
+    @classmethod
+    def parse(cls, base: str, text: str) -> "Gitignore":
+        rules = []
+        for line in text.splitlines():
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            line = line.removeprefix("!").removeprefix("\\")
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            anchored = "/" in line
+            body = _glob_to_regex(line.lstrip("/"))
+            regex = f"^{body}$" if anchored else f"^(?:.*/)?{body}$"
+            rules.append(IgnoreRule(re.compile(regex), negated, dir_only))
+        return cls(base, rules)
+
+    @classmethod
+    def load(cls, directory: str) -> "Gitignore | None":
+        try:
+            with open(os.path.join(directory, ".gitignore"), errors="replace") as f:
+                return cls.parse(directory, f.read())
+        except OSError:
+            return None
+
+    def match(self, path: str, is_dir: bool) -> bool | None:
+        """True if ignored, False if re-included by a negation, None if no rule
+        applies."""
+        relative = os.path.relpath(path, self.base).replace(os.sep, "/")
+        result = None
+        for rule in self.rules:
+            if rule.dir_only and not is_dir:
+                continue
+            if rule.regex.match(relative):
+                result = not rule.negated
+        return result
+
+
+def is_ignored(path: str, is_dir: bool, ignores: tuple[Gitignore, ...]) -> bool:
+    ignored = False
+    for gitignore in ignores:
+        result = gitignore.match(path, is_dir)
+        if result is not None:
+            ignored = result
+    return ignored
+
+
+def scan_dir(
+    directory: str,
+    ignores: tuple[Gitignore, ...],
+    excludes: frozenset[str] = DEFAULT_EXCLUDES,
+    use_gitignore: bool = True,
+) -> tuple[list[os.DirEntry], list[tuple[str, tuple[Gitignore, ...]]]]:
+    """List one directory, dropping excluded and ignored entries before anyone
+    descends into them. Returns sorted file entries and the subdirectories to visit
+    next with the ignore rules that apply inside them."""
+    if use_gitignore and (gitignore := Gitignore.load(directory)):
+        ignores = (*ignores, gitignore)
+    files, dirs = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name in excludes:
+                    continue
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if not is_dir and not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                if ignores and is_ignored(entry.path, is_dir, ignores):
+                    continue
+                (dirs if is_dir else files).append(entry)
+    except OSError:
+        return [], []
+    files.sort(key=lambda entry: entry.name)
+    dirs.sort(key=lambda entry: entry.name)
+    return files, [(entry.path, ignores) for entry in dirs]
+
+
+def _ancestor_ignores(root: str) -> tuple[Gitignore, ...]:
+    """The .gitignore files between root and the enclosing git work tree, so that
+    walking a subdirectory ignores the same paths as walking the whole repo."""
+    directory = os.path.realpath(root)
+    ancestors = []
+    while not os.path.exists(os.path.join(directory, ".git")):
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return ()
+        directory = parent
+        ancestors.append(directory)
+    loaded = (Gitignore.load(ancestor) for ancestor in reversed(ancestors))
+    return tuple(gitignore for gitignore in loaded if gitignore)
+
+
+Scan = Callable[
+    [str, tuple[Gitignore, ...], frozenset[str], bool],
+    tuple[list[os.DirEntry], list[tuple[str, tuple[Gitignore, ...]]]],
+]
+
+
+def walk_tree(
+    root: str,
+    executor: Executor | None = None,
+    excludes: frozenset[str] = DEFAULT_EXCLUDES,
+    use_gitignore: bool = True,
+    max_depth: int | None = None,
+    scan: Scan = scan_dir,
+) -> Iterator[tuple[str, list[os.DirEntry]]]:
+    """Yield (directory, files) breadth-first, shallow paths first and sorted by name
+    within a directory, descending at most max_depth levels below root. Each level
+    of directories is scanned in parallel when an executor is given."""
+    ignores = _ancestor_ignores(root) if use_gitignore else ()
+    level: list[tuple[str, tuple[Gitignore, ...]]] = [(root, ignores)]
+    depth = 0
+    while level:
+        directories = [directory for directory, _ in level]
+        rules = [ignores for _, ignores in level]
+        args = (
+            directories,
+            rules,
+            [excludes] * len(level),
+            [use_gitignore] * len(level),
+        )
+        scans = executor.map(scan, *args) if executor else map(scan, *args)
+        level = []
+        for directory, (files, dirs) in zip(directories, scans):
+            yield directory, files
+            level.extend(dirs)
+        depth += 1
+        if max_depth is not None and depth > max_depth:
+            break
+
+
+def walk_files(
+    root: str,
+    executor: Executor | None = None,
+    excludes: frozenset[str] = DEFAULT_EXCLUDES,
+    use_gitignore: bool = True,
+) -> Iterator[os.DirEntry]:
+    """Yield the files of walk_tree in the same order."""
+    for _, files in walk_tree(root, executor, excludes, use_gitignore):
+        yield from files
+
+
+@dataclass
+class CachedScan:
+    mtime_ns: int
+    gitignore_mtime_ns: int | None
+    ignores: tuple[Gitignore, ...]
+    files: list[os.DirEntry]
+    dirs: list[tuple[str, tuple[Gitignore, ...]]]
+
+
+def _mtime_ns(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class DirectoryCache:
+    """Remembers directory scans and replays them while a directory is unchanged.
+
+    A scan is reused as long as the directory's own mtime (which moves whenever an
+    entry is added, removed or renamed), its .gitignore mtime and the inherited
+    ignore rules are the same, so a repeated walk costs one stat per directory
+    instead of one per entry. Pass ``scan`` to walk_tree to use it.
+    """
+
+    def __init__(self, max_dirs: int = 50_000):
+        self.max_dirs = max_dirs
+        self._scans: OrderedDict[tuple, CachedScan] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def scan(
+        self,
+        directory: str,
+        ignores: tuple[Gitignore, ...],
+        excludes: frozenset[str] = DEFAULT_EXCLUDES,
+        use_gitignore: bool = True,
+    ) -> tuple[list[os.DirEntry], list[tuple[str, tuple[Gitignore, ...]]]]:
+        mtime_ns = _mtime_ns(directory)
+        if mtime_ns is None:
+            return [], []
+        gitignore_mtime_ns = (
+            _mtime_ns(os.path.join(directory, ".gitignore")) if use_gitignore else None
+        )
+        key = (os.path.abspath(directory), excludes, use_gitignore)
+        with self._lock:
+            cached = self._scans.get(key)
+            if (
+                cached
+                and cached.mtime_ns == mtime_ns
+                and cached.gitignore_mtime_ns == gitignore_mtime_ns
+                and cached.ignores == ignores
+            ):
+                self._scans.move_to_end(key)
+                return cached.files, cached.dirs
+
+        files, dirs = scan_dir(directory, ignores, excludes, use_gitignore)
+        with self._lock:
+            self._scans[key] = CachedScan(
+                mtime_ns, gitignore_mtime_ns, ignores, files, dirs
+            )
+            self._scans.move_to_end(key)
+            while len(self._scans) > self.max_dirs:
+                self._scans.popitem(last=False)
+        return files, dirs
+
+    def invalidate(self, path: str):
+        """Drop the scan of the directory containing path."""
+        directory = os.path.dirname(os.path.abspath(path))
+        with self._lock:
+            for key in [key for key in self._scans if key[0] == directory]:
+                del self._scans[key]
+
+
+def _name_matcher(pattern: str) -> Callable[[str], bool]:
+    """Match a glob against file names, or against whole relative paths when the
+    pattern contains a slash."""
+    if "/" not in pattern:
+        return lambda relpath: fnmatch(os.path.basename(relpath), pattern)
+    regex = re.compile(f"^(?:.*/)?{_glob_to_regex(pattern.lstrip('/'))}$")
+    return lambda relpath: regex.match(relpath) is not None
+
+
+def render_tree(paths: list[str]) -> str:
+    """Render sorted relative paths as an indented tree, directories ending in /."""
+    lines = []
+    previous: list[str] = []
+    for path in paths:
+        parts = path.split("/")
+        common = 0
+        while (
+            common < len(parts) - 1
+            and common < len(previous) - 1
+            and parts[common] == previous[common]
+        ):
+            common += 1
+        for depth in range(common, len(parts) - 1):
+            lines.append("  " * depth + parts[depth] + "/")
+        lines.append("  " * (len(parts) - 1) + parts[-1])
+        previous = parts
+    return "\n".join(lines)
+
+
+def list_files(
+    directory: str = ".",
+    pattern: str = "*",
+    max_depth: int | None = None,
+    max_results: int = 500,
+    tree: bool = False,
+    cache: DirectoryCache | None = None,
+) -> str:
+    """List files under directory matching pattern, sorted and truncated, as paths or
+    as a tree."""
+    matches = _name_matcher(pattern)
+    relpaths = []
+    directories = 0
+    for path, files in walk_tree(
+        directory,
+        max_depth=max_depth,
+        scan=cache.scan if cache else scan_dir,
+    ):
+        directories += 1
+        reldir = os.path.relpath(path, directory).replace(os.sep, "/")
+        for entry in files:
+            relpath = entry.name if reldir == "." else f"{reldir}/{entry.name}"
+            if matches(relpath):
+                relpaths.append(relpath)
+    if not relpaths:
+        return "No files found"
+
+    relpaths.sort()
+    shown = relpaths[:max_results]
+    if tree:
+        body = render_tree(shown)
+    else:
+        body = "\n".join(os.path.normpath(os.path.join(directory, p)) for p in shown)
+    summary = f"[{len(relpaths)} files in {directories} directories"
+    if max_depth is not None:
+        summary += f", depth <= {max_depth}"
+    if len(shown) < len(relpaths):
+        summary += f"; showing first {len(shown)}, narrow directory or pattern"
+    return f"{body}\n\n{summary}]"
+
+
+@dataclass
+class LineIndex:
+    """Newline counts per fixed-size block of a file, valid for one mtime/size."""
+
+    mtime_ns: int
+    size: int
+    # newlines_before[i] is the number of newlines before byte i * BLOCK_SIZE
+    newlines_before: array
+    line_count: int
+
+    def matches(self, stat: os.stat_result) -> bool:
+        return (self.mtime_ns, self.size) == (stat.st_mtime_ns, stat.st_size)
+
+
+@dataclass
+class Window:
+    """A numbered slice of a file's lines."""
+
+    lines: list[str]
+    offset: int
+    line_count: int
+
+    def render(self) -> str:
+        content = "\n".join(
+            f"{number:>6}\t{line}"
+            for number, line in enumerate(self.lines, start=self.offset + 1)
+        )
+        end_index = self.offset + len(self.lines)
+        if end_index < self.line_count:
+            remaining = self.line_count - end_index
+            content += f"\n\n[... {remaining} more lines. Use offset={end_index} to read more.]"
+        return content
+
+
+def _format_size(size: int) -> str:
+    value = float(size)
+    for unit in ("B", "KB", "MB"):
+        if value < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} GB"
+
+
+def _build_index(mm: mmap.mmap, stat: os.stat_result) -> LineIndex:
+    newlines_before = array("Q")
+    total = 0
+    for start in range(0, stat.st_size, BLOCK_SIZE):
+        newlines_before.append(total)
+        total += mm[start : start + BLOCK_SIZE].count(b"\n")
+    ends_with_newline = mm[stat.st_size - 1 : stat.st_size] == b"\n"
+    return LineIndex(
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        newlines_before=newlines_before,
+        line_count=total if ends_with_newline else total + 1,
+    )
+
+
+def _line_start(mm: mmap.mmap, index: LineIndex, line: int) -> int:
+    """Byte offset of the start of a 0-based line, scanning at most one block."""
+    if line == 0:
+        return 0
+    block = bisect_right(index.newlines_before, line - 1) - 1
+    pos = block * BLOCK_SIZE
+    for _ in range(line - index.newlines_before[block]):
+        pos = mm.find(b"\n", pos) + 1
+    return pos
+
+
+class FileReader:
+    """Reads line windows from local files without loading them whole.
+
+    Files are memory-mapped and a block-level newline index is built once per
+    mtime/size and cached, so paging through a large file only touches the requested
+    window. Binary and huge files get a metadata summary instead of their contents.
+    """
+
+    def __init__(self, huge_file_bytes: int = 1 << 30, max_indexes: int = 128):
+        self.huge_file_bytes = huge_file_bytes
+        self.max_indexes = max_indexes
+        self._indexes: OrderedDict[str, LineIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index(self, path: str, mm: mmap.mmap, stat: os.stat_result) -> LineIndex:
+        with self._lock:
+            index = self._indexes.get(path)
+            if index and index.matches(stat):
+                self._indexes.move_to_end(path)
+                return index
+
+        index = _build_index(mm, stat)
+        with self._lock:
+            self._indexes[path] = index
+            self._indexes.move_to_end(path)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        return index
+
+    def _summary(self, filepath: str, kind: str, stat: os.stat_result) -> str:
+        modified = datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds")
+        return (
+            f"[{kind} file: {filepath}, {_format_size(stat.st_size)}, "
+            f"modified {modified}. Contents not shown.]"
+        )
+
+    def window(self, filepath: str, offset: int = 0, limit: int = 2000) -> Window | str:
+        """Return lines [offset, offset + limit) of a file, or a summary string for
+        empty, binary and huge files and reads past the end."""
+        if offset < 0:
+            raise ValueError("offset must be >= 0")
+        path = os.path.realpath(filepath)
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size == 0:
+                return "[Empty file]"
+            if stat.st_size > self.huge_file_bytes:
+                return self._summary(filepath, "Huge", stat)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if b"\0" in mm[:BINARY_SNIFF_BYTES]:
+                    return self._summary(filepath, "Binary", stat)
+
+                index = self._index(path, mm, stat)
+                if offset >= index.line_count:
+                    return "[End of file]"
+
+                start = _line_start(mm, index, offset)
+                end = start
+                count = min(limit, index.line_count - offset)
+                for _ in range(count):
+                    newline = mm.find(b"\n", end)
+                    end = stat.st_size if newline == -1 else newline + 1
+                chunk = mm[start:end].decode("utf-8", errors="replace")
+
+        lines = []
+        for line in chunk.split("\n")[:count]:
+            line = line.removesuffix("\r")
+            if len(line) > MAX_LINE_LENGTH:
+                line = line[:MAX_LINE_LENGTH] + " ... [line truncated]"
+            lines.append(line)
+        return Window(lines=lines, offset=offset, line_count=index.line_count)
+
+    def read(self, filepath: str, offset: int = 0, limit: int = 2000) -> str:
+        """Return lines [offset, offset + limit) of a file, numbered like `cat -n`."""
+        window = self.window(filepath, offset, limit)
+        return window if isinstance(window, str) else window.render()
+
+
+@dataclass
+class SeenWindow:
+    """A window of a file as it was last shown to one run."""
+
+    mtime_ns: int
+    size: int
+    digest: str
+    lines: list[str]
+    turn: int
+    nbytes: int
+
+
+def _digest(lines: list[str]) -> str:
+    return hashlib.blake2b("\n".join(lines).encode(), digest_size=16).hexdigest()
+
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(,\d+)? \+(\d+)(,\d+)? @@")
+
+
+def _window_diff(old: list[str], new: list[str], offset: int, label: str) -> str:
+    """Unified diff of two windows with hunk line numbers relative to the file."""
+
+    def shift(match: re.Match) -> str:
+        old_start, old_len, new_start, new_len = match.groups()
+        return (
+            f"@@ -{int(old_start) + offset}{old_len or ''} "
+            f"+{int(new_start) + offset}{new_len or ''} @@"
+        )
+
+    diff = difflib.unified_diff(
+        old, new, fromfile=f"{label} (last read)", tofile=label, lineterm="", n=2
+    )
+    return "\n".join(_HUNK_HEADER.sub(shift, line) for line in diff)
+
+
+class ReadCache:
+    """Remembers which file windows each run has already seen.
+
+    Entries are keyed by run, path and window and validated by mtime/size, falling
+    back to a content hash when only the metadata changed. A window the run has
+    already seen comes back as a short "unchanged" marker, and a changed one as a
+    diff against the version the run last saw. The cache is LRU-bounded by bytes.
+    """
+
+    def __init__(self, reader: FileReader, max_bytes: int = 32 << 20):
+        self.reader = reader
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, SeenWindow] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _store(self, key: tuple, entry: SeenWindow):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._bytes -= previous.nbytes
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def invalidate(self, filepath: str):
+        """Forget every window of a file, e.g. after the agent rewrote it."""
+        path = os.path.realpath(filepath)
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == path]:
+                self._bytes -= self._entries.pop(key).nbytes
+
+    def read(
+        self,
+        filepath: str,
+        offset: int,
+        limit: int,
+        run_id: str | None,
+        turn: int,
+        refresh: bool = False,
+    ) -> str:
+        path = os.path.realpath(filepath)
+        key = (run_id, path, offset, limit)
+        stat = os.stat(path)
+        with self._lock:
+            seen = None if refresh else self._entries.get(key)
+            if seen:
+                self._entries.move_to_end(key)
+        unchanged = (
+            f"[{filepath} lines {offset + 1}-{offset + len(seen.lines)} unchanged "
+            f"since turn {seen.turn}. Pass refresh=True to read them again.]"
+            if seen
+            else ""
+        )
+        if seen and (seen.mtime_ns, seen.size) == (stat.st_mtime_ns, stat.st_size):
+            return unchanged
+
+        window = self.reader.window(filepath, offset, limit)
+        if isinstance(window, str):
+            return window
+        digest = _digest(window.lines)
+        self._store(
+            key,
+            SeenWindow(
+                mtime_ns=stat.st_mtime_ns,
+                size=stat.st_size,
+                digest=digest,
+                lines=window.lines,
+                turn=seen.turn if seen and seen.digest == digest else turn,
+                nbytes=sum(len(line) for line in window.lines),
+            ),
+        )
+        if not seen:
+            return window.render()
+        if seen.digest == digest:
+            return unchanged
+
+        content = window.render()
+        diff = _window_diff(seen.lines, window.lines, offset, filepath)
+        if len(diff) >= len(content):
+            return content
+        return f"[{filepath} changed since turn {seen.turn}; diff against that read:]\n{diff}"
+
+
+class EditError(Exception):
+    pass
+
+
+def read_text(path: str) -> str:
+    with open(path, encoding="utf-8", newline="") as f:
+        return f.read()
+
+
+def _stage(path: str, content: str) -> str:
+    """Write content to a synced temp file next to path and return its name."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            os.chmod(tmp, 0o644)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return tmp
+
+
+def atomic_write(path: str, content: str):
+    """Replace path with content so readers never see a partially written file."""
+    os.replace(_stage(path, content), path)
+
+
+def replace_text(
+    content: str,
+    old: str,
+    new: str,
+    occurrence: int | None = None,
+    replace_all: bool = False,
+) -> tuple[str, int]:
+    """Replace old in content and return the new content and replacement count."""
+    if not old:
+        raise EditError("old_str is empty")
+    count = content.count(old)
+    if count == 0:
+        raise EditError("old_str not found")
+    if replace_all:
+        return content.replace(old, new), count
+    if occurrence is None:
+        if count > 1:
+            raise EditError(
+                f"old_str occurs {count} times; add surrounding context, "
+                "pass occurrence, or set replace_all"
+            )
+        occurrence = 1
+    if not 1 <= occurrence <= count:
+        raise EditError(
+            f"occurrence {occurrence} requested but old_str occurs {count} times"
+        )
+    index = -len(old)
+    for _ in range(occurrence):
+        index = content.find(old, index + len(old))
+    return content[:index] + new + content[index + len(old) :], 1
+
+
+@dataclass
+class Hunk:
+    old_start: int
+    old_lines: list[str]
+    new_lines: list[str]
+
+
+@dataclass
+class FilePatch:
+    old_path: str | None
+    new_path: str | None
+    hunks: list[Hunk]
+
+
+_HUNK_RANGE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def _patch_path(header: str) -> str | None:
+    path = header[4:].split("\t")[0].strip()
+    return None if path == "/dev/null" else path
+
+
+def parse_patch(text: str) -> list[FilePatch]:
+    """Parse a unified diff that may span several files."""
+    patches: list[FilePatch] = []
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if (
+            line.startswith("--- ")
+            and i + 1 < len(lines)
+            and lines[i + 1].startswith("+++ ")
+        ):
+            old_path, new_path = _patch_path(line), _patch_path(lines[i + 1])
+            if (old_path or "a/").startswith("a/") and (new_path or "b/").startswith(
+                "b/"
+            ):
+                old_path = old_path and old_path[2:]
+                new_path = new_path and new_path[2:]
+            patches.append(FilePatch(old_path, new_path, []))
+            i += 2
+            continue
+        match = _HUNK_RANGE.match(line)
+        if match:
+            if not patches:
+                raise EditError("hunk found before any ---/+++ file header")
+            old_count = int(match.group(2) or 1)
+            new_count = int(match.group(4) or 1)
+            hunk = Hunk(int(match.group(1)), [], [])
+            i += 1
+            while i < len(lines) and (
+                len(hunk.old_lines) < old_count or len(hunk.new_lines) < new_count
+            ):
+                body = lines[i]
+                if body.startswith("\\"):
+                    pass
+                elif body.startswith("-"):
+                    hunk.old_lines.append(body[1:])
+                elif body.startswith("+"):
+                    hunk.new_lines.append(body[1:])
+                else:
+                    hunk.old_lines.append(body[1:])
+                    hunk.new_lines.append(body[1:])
+                i += 1
+            patches[-1].hunks.append(hunk)
+            continue
+        i += 1
+    if not patches:
+        raise EditError("no ---/+++ file headers found in patch")
+    return patches
+
+
+def apply_hunks(content: str, hunks: list[Hunk]) -> str:
+    """Apply hunks in order, allowing each to have drifted from its stated line."""
+    trailing_newline = content.endswith("\n") or not content
+    lines = content.removesuffix("\n").split("\n") if content else []
+    offset = 0
+    floor = 0
+    for number, hunk in enumerate(hunks, start=1):
+        # A pure insertion's start is the line it goes after, otherwise the first line.
+        stated = hunk.old_start if not hunk.old_lines else hunk.old_start - 1
+        expected = max(stated + offset, floor)
+        if not hunk.old_lines:
+            position = min(expected, len(lines))
+        else:
+            size = len(hunk.old_lines)
+            position = next(
+                (
+                    candidate
+                    for distance in range(len(lines) + 1)
+                    for candidate in (expected - distance, expected + distance)
+                    if floor <= candidate <= len(lines) - size
+                    and lines[candidate : candidate + size] == hunk.old_lines
+                ),
+                None,
+            )
+            if position is None:
+                raise EditError(
+                    f"hunk {number} (line {hunk.old_start}) does not match the file"
+                )
+        lines[position : position + len(hunk.old_lines)] = hunk.new_lines
+        offset = position - stated + len(hunk.new_lines) - len(hunk.old_lines)
+        floor = position + len(hunk.new_lines)
+    return "\n".join(lines) + ("\n" if trailing_newline and lines else "")
+
+
+class EditTransaction:
+    """Applies a batch of edits and patches to many files, all or nothing.
+
+    Every edit is validated against the in-memory result of the edits before it.
+    Nothing touches the disk unless all of them succeed, and then every changed file
+    is staged as a synced temp file and renamed into place, restoring the originals
+    if any rename fails. Files are keyed by their real path, so "./x" and "x" are
+    the same file; changed() reports each by the path it was first named with.
+    """
+
+    def __init__(self):
+        self.originals: dict[str, str | None] = {}
+        self.contents: dict[str, str | None] = {}
+        self.names: dict[str, str] = {}
+        self.report: list[str] = []
+        self.failed = 0
+
+    def _load(self, path: str) -> tuple[str, str | None]:
+        """The key of path and its content after the edits so far."""
+        key = os.path.realpath(path)
+        if key not in self.contents:
+            try:
+                self.originals[key] = read_text(key)
+            except FileNotFoundError:
+                self.originals[key] = None
+            self.contents[key] = self.originals[key]
+            self.names[key] = path
+        return key, self.contents[key]
+
+    def _record(self, label: str, action):
+        try:
+            self.report.append(f"{label}: {action()}")
+        except (EditError, OSError, UnicodeDecodeError) as e:
+            self.failed += 1
+            self.report.append(f"{label}: FAILED: {e}")
+
+    def edit(self, number: int, edit: FileEdit):
+        def action() -> str:
+            key, content = self._load(edit.filepath)
+            if content is None:
+                raise EditError("file not found")
+            self.contents[key], count = replace_text(
+                content, edit.old_str, edit.new_str, edit.occurrence, edit.replace_all
+            )
+            return f"replaced {count} occurrence{'s' if count != 1 else ''}"
+
+        self._record(f"{number}. {edit.filepath}", action)
+
+    def patch(self, file_patch: FilePatch):
+        path = file_patch.new_path or file_patch.old_path or ""
+
+        def action() -> str:
+            if None not in (file_patch.old_path, file_patch.new_path) and (
+                file_patch.old_path != file_patch.new_path
+            ):
+                raise EditError("renaming files is not supported; use git mv")
+            key, content = self._load(path)
+            if file_patch.old_path is None:
+                if content:
+                    raise EditError("patch creates a file that already exists")
+                content = ""
+            elif content is None:
+                raise EditError("file not found")
+            if file_patch.new_path is None:
+                self.contents[key] = None
+                return "deleted"
+            self.contents[key] = apply_hunks(content, file_patch.hunks)
+            return f"applied {len(file_patch.hunks)} hunk(s)"
+
+        self._record(f"patch {path}", action)
+
+    def _changed(self) -> list[str]:
+        return [
+            key
+            for key, content in self.contents.items()
+            if content != self.originals[key]
+        ]
+
+    def changed(self) -> list[str]:
+        return [self.names[key] for key in self._changed()]
+
+    def commit(self):
+        staged: list[tuple[str, str | None]] = []
+        done: list[str] = []
+        try:
+            for path in self._changed():
+                content = self.contents[path]
+                staged.append(
+                    (path, None if content is None else _stage(path, content))
+                )
+            for path, tmp in staged:
+                if tmp is None:
+                    os.remove(path)
+                else:
+                    os.replace(tmp, path)
+                done.append(path)
+        except BaseException:
+            for path in done:
+                original = self.originals[path]
+                if original is None:
+                    os.remove(path)
+                else:
+                    atomic_write(path, original)
+            for path, tmp in staged:
+                if tmp and path not in done and os.path.exists(tmp):
+                    os.unlink(tmp)
+            raise
@@ -0,0 +1,317 @@
+import dataclasses
+import re
+from collections.abc import Callable
+
+import logfire
+from pydantic_ai import (
+    Agent,
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    RetryPromptPart,
+    RunContext,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+from pydantic_ai.models import KnownModelName, Model
+
+from output import estimate_tokens
+from prompts import compaction_instruction
+from schemas import AgentDeps
+
+USAGE_WARNING = re.compile(r"<system_warning>.*?</system_warning>\n?", re.DOTALL)
+PARTIAL_READ = re.compile(r"^\[.*(?:unchanged|changed) since turn \d+")
+READ_TOOLS = {"read_file"}
+WRITE_TOOLS = {"write_file"}
+OUTPUT_TOOLS = {
+    "execute",
+    "search_files",
+    "list_files",
+    "read_output",
+    "start_process",
+    "tail_logs",
+    "latest_progress",
+    "progress_for_feature",
+}
+COMPACTED = {"compacted": True}
+SUMMARY_TAG = "<summary_of_earlier_turns>"
+
+
+def _part_text(part) -> str:
+    if isinstance(part, ToolCallPart):
+        return f"{part.tool_name}({part.args_as_json_str()})"
+    if isinstance(part, ToolReturnPart):
+        return part.model_response_str()
+    if isinstance(part, RetryPromptPart):
+        return part.model_response()
+    content = getattr(part, "content", "")
+    return content if isinstance(content, str) else str(content)
+
+
+def message_tokens(messages: list[ModelMessage]) -> int:
+    """Estimated tokens of the text content of messages."""
+    return sum(estimate_tokens(_part_text(p)) for m in messages for p in m.parts)
+
+
+def _window(args: dict) -> tuple:
+    return (args.get("filepath"), args.get("offset", 0), args.get("limit", 2000))
+
+
+def _is_summary(part) -> bool:
+    return isinstance(part, UserPromptPart) and str(part.content).startswith(
+        SUMMARY_TAG
+    )
+
+
+def _body(part: ToolReturnPart) -> str:
+    return USAGE_WARNING.sub("", part.model_response_str())
+
+
+class HistoryCompactor:
+    """A pydantic-ai history processor that keeps long coding sessions within budget.
+
+    Before each model request it:
+
+    - replaces stale tool results with short stubs: reads of a file window that was
+      read again in full later (or overwritten by write_file), and large command,
+      search, listing and progress outputs older than keep_turns turns;
+    - once the history passes summarize_at of the context window, replaces every
+      turn but the first request and the last keep_turns turns with a summary from
+      a cheap model.
+
+    Changing old messages invalidates the provider's prompt cache from that point
+    on, so stubs are only applied once they reclaim at least min_reclaim_tokens or
+    the history is over summarize_at.
+
+    Dropping a full read leaves later "unchanged since turn N" markers pointing at
+    nothing, so those are stubbed too and forget(filepath) is called, making the
+    next read_file of that file return its lines again.
+    """
+
+    def __init__(
+        self,
+        model: Model | KnownModelName | str | None = None,
+        keep_turns: int = 6,
+        summarize_at: float = 0.6,
+        stub_min_tokens: int = 200,
+        min_reclaim_tokens: int = 2000,
+        forget: Callable[[str], object] | None = None,
+    ):
+        self.keep_turns = keep_turns
+        self.summarize_at = summarize_at
+        self.stub_min_tokens = stub_min_tokens
+        self.min_reclaim_tokens = min_reclaim_tokens
+        self.forget = forget
+        self.reclaimed_tokens = 0
+        self._summarizer = (
+            Agent(
+                model,
+                instructions=compaction_instruction,
+                output_type=str,
+                defer_model_check=True,
+            )
+            if model
+            else None
+        )
+
+    def _calls(self, messages: list[ModelMessage]) -> dict[str, ToolCallPart]:
+        return {
+            part.tool_call_id: part
+            for message in messages
+            if isinstance(message, ModelResponse)
+            for part in message.parts
+            if isinstance(part, ToolCallPart)
+        }
+
+    def _tail_start(self, messages: list[ModelMessage]) -> int:
+        """Index of the oldest model response among the last keep_turns turns."""
+        responses = [i for i, m in enumerate(messages) if isinstance(m, ModelResponse)]
+        if len(responses) <= self.keep_turns:
+            return 0
+        return responses[-self.keep_turns] if self.keep_turns else len(messages) - 1
+
+    def _stub_part(self, part: ToolReturnPart, call: ToolCallPart | None) -> str | None:
+        """A stub for an old non-read tool result, or None to keep it verbatim."""
+        body = _body(part)
+        if estimate_tokens(body) < self.stub_min_tokens:
+            return None
+        args = call.args_as_dict() if call else {}
+        label = args.get("command") or args.get("pattern") or args.get("handle") or ""
+        lines = body.splitlines()
+        kept = [line for line in lines[-5:] if line.strip()]
+        note = "\n".join(kept)
+        return (
+            f"[Old {part.tool_name} output for {label!r} compacted: {len(lines)} lines. "
+            f"Last lines:]\n{note}\n[Run it again if you need the full output.]"
+        )
+
+    def stub_stale(
+        self, messages: list[ModelMessage]
+    ) -> tuple[list[ModelMessage], int, set[str]]:
+        """Replace superseded reads and old large outputs with stubs.
+
+        Returns the new messages, how many tool results were stubbed and the files
+        whose reads must be forgotten if the new messages are used.
+        """
+        calls = self._calls(messages)
+        tail_start = self._tail_start(messages)
+        parts = [
+            (i, j, part)
+            for i, message in enumerate(messages)
+            if isinstance(message, ModelRequest)
+            for j, part in enumerate(message.parts)
+            if isinstance(part, ToolReturnPart) and part.metadata != COMPACTED
+        ]
+
+        # Position of the latest full read of each window, and of each overwrite.
+        latest_full: dict[tuple, int] = {}
+        latest_write: dict[str, int] = {}
+        for i, _, part in parts:
+            call = calls.get(part.tool_call_id)
+            if not call:
+                continue
+            args = call.args_as_dict()
+            if part.tool_name in READ_TOOLS:
+                if not PARTIAL_READ.match(_body(part)):
+                    key = _window(args)
+                    latest_full[key] = i
+            elif part.tool_name in WRITE_TOOLS:
+                latest_write[args.get("filepath", "")] = i
+
+        replacements: dict[tuple[int, int], str] = {}
+        forgotten: set[str] = set()
+        seen_full: set[tuple] = set()
+        for i, j, part in parts:
+            call = calls.get(part.tool_call_id)
+            if not call:
+                continue
+            args = call.args_as_dict()
+            if part.tool_name in READ_TOOLS:
+                filepath = args.get("filepath", "")
+                key = _window(args)
+                partial = bool(PARTIAL_READ.match(_body(part)))
+                if not partial:
+                    seen_full.add(key)
+                if i < latest_full.get(key, -1) or i < latest_write.get(filepath, -1):
+                    replacements[i, j] = (
+                        f"[Read of {filepath} superseded by a later read or write; "
+                        "see that result instead.]"
+                    )
+                elif partial and key not in seen_full:
+                    # The full read this marker refers to is gone from history.
+                    replacements[i, j] = (
+                        f"[Earlier read of {filepath} dropped from history; "
+                        "read it again if you need its contents.]"
+                    )
+                    if filepath:
+                        forgotten.add(filepath)
+            elif part.tool_name in OUTPUT_TOOLS and i < tail_start:
+                if stub := self._stub_part(part, call):
+                    replacements[i, j] = stub
+
+        result = list(messages)
+        for (i, j), stub in replacements.items():
+            message = result[i]
+            new_parts = list(message.parts)
+            new_parts[j] = dataclasses.replace(
+                new_parts[j], content=stub, metadata=COMPACTED
+            )
+            result[i] = dataclasses.replace(message, parts=new_parts)
+        return result, len(replacements), forgotten
+
+    def _transcript(self, messages: list[ModelMessage], max_chars: int = 2000) -> str:
+        lines = []
+        for message in messages:
+            for part in message.parts:
+                text = USAGE_WARNING.sub("", _part_text(part))
+                if not text.strip():
+                    continue
+                if len(text) > max_chars:
+                    text = text[:max_chars] + " ... [truncated]"
+                if isinstance(part, ToolCallPart):
+                    lines.append(f"ASSISTANT called {text}")
+                elif isinstance(part, (ToolReturnPart, RetryPromptPart)):
+                    lines.append(f"TOOL {part.tool_name} returned: {text}")
+                elif isinstance(part, UserPromptPart):
+                    lines.append(f"USER: {text}")
+                elif isinstance(part, TextPart):
+                    lines.append(f"ASSISTANT: {text}")
+        return "\n\n".join(lines)
+
+    async def summarize(
+        self, messages: list[ModelMessage]
+    ) -> tuple[list[ModelMessage], int]:
+        """Replace all but the first request and the last turns with a summary.
+
+        Returns the new messages and how many messages were summarized.
+        """
+        tail_start = self._tail_start(messages)
+        if not self._summarizer or tail_start <= 1:
+            return messages, 0
+        first, old, tail = messages[0], messages[1:tail_start], messages[tail_start:]
+        if not isinstance(first, ModelRequest):
+            return messages, 0
+
+        # Fold an earlier summary into the new one rather than stacking them.
+        previous = [p for p in first.parts if _is_summary(p)]
+        kept = [p for p in first.parts if not _is_summary(p)]
+        transcript = self._transcript([ModelRequest(parts=previous), *old])
+        result = await self._summarizer.run(transcript)
+        summary = UserPromptPart(
+            f"{SUMMARY_TAG}\n{result.output}\n</summary_of_earlier_turns>"
+        )
+        self._forget(self._read_paths(old))
+        head = dataclasses.replace(first, parts=[*kept, summary])
+        return [head, *tail], len(old)
+
+    def _forget(self, paths: set[str]):
+        if self.forget:
+            for path in paths:
+                self.forget(path)
+
+    def _read_paths(self, messages: list[ModelMessage]) -> set[str]:
+        return {
+            path
+            for call in self._calls(messages).values()
+            if call.tool_name in READ_TOOLS
+            and isinstance(path := call.args_as_dict().get("filepath"), str)
+        }
+
+    async def __call__(
+        self, ctx: RunContext[AgentDeps], messages: list[ModelMessage]
+    ) -> list[ModelMessage]:
+        before = message_tokens(messages)
+        limit = ctx.deps.context_window_size * self.summarize_at
+        stubbed_messages, stubbed, forgotten = self.stub_stale(messages)
+        if before - message_tokens(stubbed_messages) < self.min_reclaim_tokens and (
+            before <= limit
+        ):
+            # Not worth a prompt cache miss yet.
+            return messages
+        messages = stubbed_messages
+        self._forget(forgotten)
+        summarized = 0
+        if message_tokens(messages) > limit:
+            try:
+                messages, summarized = await self.summarize(messages)
+            except Exception as e:
+                logfire.warn("History summarization failed: {error}", error=str(e))
+            else:
+                # Reads in the summarized turns may have been stubbed on their way out.
+                messages, more, forgotten = self.stub_stale(messages)
+                self._forget(forgotten)
+                stubbed += more
+        reclaimed = before - message_tokens(messages)
+        if reclaimed > 0:
+            self.reclaimed_tokens += reclaimed
+            logfire.info(
+                "Compacted history: reclaimed ~{reclaimed} tokens "
+                "({stubbed} results stubbed, {summarized} messages summarized)",
+                reclaimed=reclaimed,
+                stubbed=stubbed,
+                summarized=summarized,
+                total_reclaimed=self.reclaimed_tokens,
+            )
+        return messages
@@ -1,31 +1,85 @@
+import contextlib
 from pathlib import Path
 
 import questionary
+from pydantic import BaseModel
 from pydantic_ai import (
     DeferredToolRequests,
     DeferredToolResults,
+    ModelMessage,
     ToolApproved,
-    ToolDenied,
+    ToolCallPart,
 )
 from rich.console import Console
+from rich.markdown import Markdown
 
-from agent import planning_agent
+from agent import log_cache_usage, plan_fanout, planning_agent
+from orchestrator import Orchestrator
+from planning import FANOUT, PlanSkeleton, draft_plan, revise_plan
 from schemas import Plan
-from utils import format_plan_to_markdown
+from spec import SPEC_FILE, save_spec
+from utils import PlanStream, render_section
+
+# Name pydantic-ai gives the output tool when the output type is Plan.
+PLAN_TOOL = "final_result"
 
 console = Console()
 
 
+async def run_planning(
+    plan_file_path: Path, **kwargs
+) -> tuple[BaseModel | DeferredToolRequests, list[ModelMessage]]:
+    """Run the planning agent, streaming any Plan (or skeleton) it outputs.
+
+    Sections are rendered in the terminal and appended to the file as soon as they
+    are complete, instead of after the whole Plan has been generated. A finished
+    Plan is then saved with its JSON sidecar.
+    """
+    stream = PlanStream()
+    spec = None
+    async with planning_agent.run_stream(**kwargs) as result:
+        with contextlib.ExitStack() as stack:
+            async for response, last in result.stream_responses(debounce_by=0.05):
+                calls = [
+                    part
+                    for part in response.parts
+                    if isinstance(part, ToolCallPart) and part.tool_name == PLAN_TOOL
+                ]
+                if not calls:
+                    continue
+                for section in stream.feed(calls[-1].args_as_json_str(), final=last):
+                    if spec is None:
+                        console.print(
+                            f"[bold green]Writing project specification to "
+                            f"{plan_file_path}...[/bold green]"
+                        )
+                        spec = stack.enter_context(open(plan_file_path, "w"))
+                    spec.write(section)
+                    spec.flush()
+                    console.print(Markdown(section))
+        output = await result.get_output()
+        log_cache_usage("planning", result.usage())
+        messages = result.all_messages()
+    if isinstance(output, Plan):
+        # Also covers fields that arrived out of document order and were skipped.
+        save_spec(output, plan_file_path)
+    return output, messages
+
+
 async def planning_step():
     project_path = Path("project")
     project_path.mkdir(parents=True, exist_ok=True)
-    plan_file_path = project_path / "app_spec.md"
+    plan_file_path = project_path / SPEC_FILE
 
-    user_input = await questionary.text("Enter your project description: ").ask_async()
-    result = await planning_agent.run(user_input)
+    # In fan-out mode the planner only drafts the skeleton; sub-agents do the rest.
+    options = (
+        {"output_type": PlanSkeleton | DeferredToolRequests} if plan_fanout else {}
+    )
 
-    messages = result.all_messages()
-    output: Plan | DeferredToolRequests = result.output
+    user_input = await questionary.text("Enter your project description: ").ask_async()
+    output, messages = await run_planning(
+        plan_file_path, user_prompt=user_input, **options
+    )
 
     while isinstance(output, DeferredToolRequests):
         results = DeferredToolResults()
@@ -33,21 +87,7 @@ async def planning_step():
         for call in output.approvals:
             approval = False
 
-            if call.tool_name == "approve":
-                _questions = call.args_as_dict().get("plan", "")
-                console.print("\n" + _questions, markup=True)
-                choice = await questionary.select(
-                    "Do you approve this plan? ", choices=["Yes", "No"]
-                ).ask_async()
-
-                if choice == "Yes":
-                    approval = True
-                else:
-                    followup = await questionary.text(
-                        "What should agent do instead?: "
-                    ).ask_async()
-                    approval = ToolDenied(followup)
-            elif call.tool_name == "ask_followup":
+            if call.tool_name == "ask_followup":
                 _questions = call.args_as_dict().get("questions", "")
                 answers = await questionary.form(
                     **{
@@ -67,24 +107,48 @@ async def planning_step():
 
             results.approvals[call.tool_call_id] = approval
 
-        result = await planning_agent.run(
+        output, messages = await run_planning(
+            plan_file_path,
             user_prompt="Continue with the next step after receiving the answers to the previous questions.",
             message_history=messages,
             deferred_tool_results=results,
+            **options,
         )
-        messages = result.all_messages()
-        output = result.output
 
-    if isinstance(output, Plan):
+    if plan_fanout:
+        console.print("[bold green]Drafting the remaining sections...[/bold green]")
+        plan = await draft_plan(output, messages)
+        save_spec(plan, plan_file_path)
+        for field in FANOUT:
+            if section := render_section(field, getattr(plan, field)):
+                console.print(Markdown(section))
+    elif isinstance(output, Plan):
+        plan = output
+    else:
+        raise RuntimeError(f"planning ended with a {type(output).__name__}, not a Plan")
+    while True:
+        choice = await questionary.select(
+            "Do you approve this plan? ", choices=["Yes", "No"]
+        ).ask_async()
+        if choice == "Yes":
+            break
+        feedback = await questionary.text("What should change?: ").ask_async()
+        plan, sections = await revise_plan(plan, feedback)
+        save_spec(plan, plan_file_path)
         console.print(
-            f"[bold green]Writing project specification to {plan_file_path}...[/bold green]"
+            f"[bold green]Rewrote {', '.join(sections)} in {plan_file_path}[/bold green]"
         )
-        plan = format_plan_to_markdown(output)
-        with open(plan_file_path, "w") as f:
-            f.write(plan)
+        for field in sections:
+            if section := render_section(field, getattr(plan, field)):
+                console.print(Markdown(section))
+
+
+async def main():
+    await planning_step()
+    await Orchestrator("project").run()
 
 
 if __name__ == "__main__":
     import asyncio
 
-    asyncio.run(planning_step())
+    asyncio.run(main())
@@ -0,0 +1,199 @@
+import functools
+import inspect
+import json
+import statistics
+import threading
+import time
+from dataclasses import dataclass, field
+
+import logfire
+from pydantic_ai import RunContext
+
+from history import USAGE_WARNING
+from output import TRUNCATED_NOTE, estimate_tokens
+
+# Upper bounds in milliseconds of the in-process latency histogram buckets.
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1_000, 2_000, 5_000, 10_000, 30_000)
+ERROR_PREFIXES = ("ERROR", "FILE_NOT_FOUND", "No files changed")
+
+duration_histogram = logfire.metric_histogram(
+    "autocode.tool.duration", unit="ms", description="Wall time of a tool call"
+)
+tokens_histogram = logfire.metric_histogram(
+    "autocode.tool.tokens", unit="{token}", description="Estimated tokens returned"
+)
+
+
+@dataclass
+class ToolStats:
+    """Accumulated cost of one tool's calls."""
+
+    calls: int = 0
+    errors: int = 0
+    timeouts: int = 0
+    truncations: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    tokens: int = 0
+    durations_ms: list[float] = field(default_factory=list)
+    buckets: list[int] = field(default_factory=lambda: [0] * (len(BUCKETS_MS) + 1))
+
+    def add(self, duration_ms: float):
+        self.durations_ms.append(duration_ms)
+        index = next(
+            (i for i, bound in enumerate(BUCKETS_MS) if duration_ms <= bound),
+            len(BUCKETS_MS),
+        )
+        self.buckets[index] += 1
+
+    def percentile(self, q: float) -> float:
+        if len(self.durations_ms) < 2:
+            return self.durations_ms[0] if self.durations_ms else 0.0
+        return statistics.quantiles(self.durations_ms, n=100, method="inclusive")[
+            round(q * 100) - 1
+        ]
+
+
+class ToolMetrics:
+    """In-process per-tool latency, payload and token accounting for one session.
+
+    Tools calls record() through the @instrumented decorator; the owner of the
+    session calls log_summary() when it ends and reset() before the next one.
+    """
+
+    def __init__(self):
+        self.tools: dict[str, ToolStats] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        tool: str,
+        duration_ms: float,
+        bytes_in: int,
+        output: str,
+    ) -> dict:
+        """Add one call and return the attributes describing it."""
+        body = USAGE_WARNING.sub("", output)
+        attributes = {
+            "tool": tool,
+            "duration_ms": duration_ms,
+            "bytes_in": bytes_in,
+            "bytes_out": len(output.encode()),
+            "tokens": estimate_tokens(output),
+            "truncated": TRUNCATED_NOTE in body,
+            "timed_out": body.startswith("TIMEOUT"),
+            "error": body.startswith(ERROR_PREFIXES),
+        }
+        with self._lock:
+            stats = self.tools.setdefault(tool, ToolStats())
+            stats.calls += 1
+            stats.errors += attributes["error"]
+            stats.timeouts += attributes["timed_out"]
+            stats.truncations += attributes["truncated"]
+            stats.bytes_in += bytes_in
+            stats.bytes_out += attributes["bytes_out"]
+            stats.tokens += attributes["tokens"]
+            stats.add(duration_ms)
+        duration_histogram.record(duration_ms, {"tool": tool})
+        tokens_histogram.record(attributes["tokens"], {"tool": tool})
+        return attributes
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(sum(s.durations_ms) for s in self.tools.values()) / 1000
+
+    def summary(self, top: int = 5) -> dict:
+        """Per-tool p50/p95 latency and totals, and the tools that returned most tokens."""
+        with self._lock:
+            tools = {
+                name: {
+                    "calls": stats.calls,
+                    "p50_ms": round(stats.percentile(0.5), 2),
+                    "p95_ms": round(stats.percentile(0.95), 2),
+                    "total_ms": round(sum(stats.durations_ms), 2),
+                    "bytes_in": stats.bytes_in,
+                    "bytes_out": stats.bytes_out,
+                    "tokens": stats.tokens,
+                    "truncations": stats.truncations,
+                    "timeouts": stats.timeouts,
+                    "errors": stats.errors,
+                    "histogram_ms": dict(
+                        zip([*map(str, BUCKETS_MS), "inf"], stats.buckets)
+                    ),
+                }
+                for name, stats in sorted(self.tools.items())
+            }
+        consumers = sorted(tools, key=lambda name: tools[name]["tokens"], reverse=True)
+        return {
+            "tool_seconds": round(self.total_seconds, 3),
+            "tools": tools,
+            "top_token_consumers": [
+                [name, tools[name]["tokens"]] for name in consumers[:top]
+            ],
+        }
+
+    def log_summary(self, name: str) -> dict:
+        summary = self.summary()
+        logfire.info(
+            "{name}: {calls} tool calls took {tool_seconds}s; top token consumers "
+            "{top_token_consumers}",
+            name=name,
+            calls=sum(tool["calls"] for tool in summary["tools"].values()),
+            **summary,
+        )
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self.tools.clear()
+
+
+def _bytes_in(args: tuple, kwargs: dict) -> int:
+    values = [a for a in args if not isinstance(a, RunContext)] + list(kwargs.values())
+    return len(json.dumps(values, default=str).encode())
+
+
+def instrumented(method):
+    """Trace a Tools method in a span and record its cost in self.metrics.
+
+    The wrapper keeps the method's signature and docstring, which pydantic-ai
+    uses for the tool schema.
+    """
+    name = method.__name__
+
+    def finish(self, span, started: float, args: tuple, kwargs: dict, output):
+        duration_ms = (time.perf_counter() - started) * 1000
+        attributes = self.metrics.record(
+            name, duration_ms, _bytes_in(args, kwargs), str(output)
+        )
+        span.set_attributes(attributes)
+
+    if inspect.iscoroutinefunction(method):
+
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            with logfire.span("tool {tool}", tool=name) as span:
+                started = time.perf_counter()
+                try:
+                    output = await method(self, *args, **kwargs)
+                except Exception as e:
+                    finish(self, span, started, args, kwargs, f"ERROR: {e}")
+                    raise
+                finish(self, span, started, args, kwargs, output)
+                return output
+
+        return async_wrapper
+
+    @functools.wraps(method)
+    def sync_wrapper(self, *args, **kwargs):
+        with logfire.span("tool {tool}", tool=name) as span:
+            started = time.perf_counter()
+            try:
+                output = method(self, *args, **kwargs)
+            except Exception as e:
+                finish(self, span, started, args, kwargs, f"ERROR: {e}")
+                raise
+            finish(self, span, started, args, kwargs, output)
+            return output
+
+    return sync_wrapper
@@ -0,0 +1,305 @@
+import argparse
+import asyncio
+import contextlib
+import shlex
+from datetime import datetime, timezone
+from pathlib import Path
+
+import logfire
+from pydantic_ai import UsageLimits
+from rich.console import Console
+
+from agent import (
+    context_window_size,
+    create_coding_agent,
+    create_initializer_agent,
+    log_cache_usage,
+    sandbox_runtime,
+)
+from features import FEATURES_FILE, FeatureRegistry
+from processes import ProcessManager
+from sandboxes import SandboxPool
+from schemas import AgentDeps, OrchestratorState, SessionRecord
+from tools import BashSessionPool, LazySandbox, Tools
+
+CHECKPOINT = Path(".autocode") / "orchestrator.json"
+INITIALIZER_PROMPT = "Initialize the project described in app_spec.md."
+CODING_PROMPT = (
+    "Start a new coding session. Follow the session start protocol, then implement "
+    "the feature next_feature returns."
+)
+
+
+def count_passing(features_path: Path) -> tuple[int, int]:
+    """Return (passing, total) features in features.json."""
+    stats = FeatureRegistry(features_path.parent).stats()
+    return stats["passing"], stats["total"]
+
+
+async def enforce_features(
+    registry: FeatureRegistry,
+    baseline: list[dict],
+    pool: BashSessionPool,
+    label: str,
+):
+    """Revert changes to features.json made other than by mark_passing, and commit."""
+    problems = registry.restore(baseline)
+    if not problems:
+        return
+    logfire.warn(
+        "{label} changed {file} outside mark_passing; restored it: {problems}",
+        label=label,
+        file=FEATURES_FILE,
+        problems="; ".join(problems),
+    )
+    message = f"chore: restore {FEATURES_FILE} after {label}"
+    await pool.execute(
+        f"git commit -q -m {shlex.quote(message)} -- {FEATURES_FILE}", timeout=30
+    )
+
+
+async def reap_processes(processes: ProcessManager, label: str):
+    """Stop the background processes a session left running."""
+    if reaped := await processes.close():
+        logfire.warn(
+            "{label} left {count} background processes running; stopped them: "
+            "{handles}",
+            label=label,
+            count=len(reaped),
+            handles=", ".join(reaped),
+        )
+
+
+class Orchestrator:
+    """Run the initializer once, then coding sessions until every feature passes.
+
+    State is checkpointed to .autocode/orchestrator.json inside the project after
+    every step, so a crashed run resumes with the session that was interrupted.
+    Each session starts as soon as the previous one returns. The run stops when all
+    features pass, after max_sessions, or when stall_limit sessions in a row added
+    no passing feature.
+
+    File tools resolve relative paths against the working directory, so run() works
+    from inside the project directory. With sandbox_runtime set, each session's
+    tools run in a fresh Docker container of that runtime with the project mounted,
+    taken on the first tool call from a pool that keeps sandbox_warm containers
+    started and starts them from the snapshot of the last successful init.sh.
+    """
+
+    def __init__(
+        self,
+        project_dir: str | Path,
+        context_window_size: int = context_window_size,
+        max_sessions: int = 50,
+        stall_limit: int = 3,
+        sandbox_runtime: str | None = sandbox_runtime,
+        sandbox_warm: int = 1,
+    ):
+        self.project_dir = Path(project_dir).resolve()
+        self.deps = AgentDeps(context_window_size=context_window_size)
+        self.max_sessions = max_sessions
+        self.stall_limit = stall_limit
+        self.pool = BashSessionPool(size=4, cwd=str(self.project_dir))
+        # Each session takes a fresh sandbox from the pool on its first tool call.
+        self.sandbox_pool = (
+            SandboxPool(sandbox_runtime, self.project_dir, size=sandbox_warm)
+            if sandbox_runtime
+            else None
+        )
+        self.sandbox = LazySandbox(self.sandbox_pool) if self.sandbox_pool else None
+        self.tools = Tools(self.pool, self.sandbox)
+        self.features = FeatureRegistry(self.project_dir)
+        self.initializer_agent = create_initializer_agent(self.tools)
+        self.coding_agent = create_coding_agent(self.tools)
+        self.checkpoint = self.project_dir / CHECKPOINT
+        self.state = self._load()
+
+    def _load(self) -> OrchestratorState:
+        if not self.checkpoint.exists():
+            return OrchestratorState()
+        state = OrchestratorState.model_validate_json(self.checkpoint.read_text())
+        if state.sessions and state.sessions[-1].finished_at is None:
+            # Crashed mid-session: run that session again.
+            interrupted = state.sessions.pop()
+            logfire.warn(
+                "Resuming interrupted session {number}", number=interrupted.number
+            )
+        return state
+
+    def _save(self):
+        self.checkpoint.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.checkpoint.with_suffix(".tmp")
+        temp.write_text(self.state.model_dump_json(indent=2))
+        temp.replace(self.checkpoint)
+
+    async def _git(self, command: str) -> str:
+        result = await self.pool.execute(f"git {command}", timeout=30)
+        return result.stdout.strip() if result.exit_code == 0 else ""
+
+    async def _exclude_checkpoint(self):
+        """Keep the checkpoint out of git status so agents see a clean tree."""
+        exclude = Path(await self._git("rev-parse --git-path info/exclude"))
+        if not exclude.parts:
+            return
+        exclude = self.project_dir / exclude
+        lines = exclude.read_text().splitlines() if exclude.exists() else []
+        if f"{CHECKPOINT.parts[0]}/" not in lines:
+            exclude.parent.mkdir(parents=True, exist_ok=True)
+            exclude.write_text("\n".join([*lines, f"{CHECKPOINT.parts[0]}/", ""]))
+
+    def features_per_hour(self) -> float:
+        """Features moved to passing per hour of finished coding sessions."""
+        finished = [s for s in self.state.sessions if s.finished_at is not None]
+        seconds = sum(
+            (s.finished_at - s.started_at).total_seconds()
+            for s in self.state.sessions
+            if s.finished_at is not None
+        )
+        gained = sum((s.passing_after or 0) - s.passing_before for s in finished)
+        return gained / (seconds / 3600) if seconds else 0.0
+
+    async def initialize(self):
+        # The initializer creates features.json and may need to fix it until it
+        # parses; only coding sessions are limited to mark_passing.
+        self.tools.features_editable = True
+        try:
+            with logfire.span("initializer session"):
+                result = await self.initializer_agent.run(
+                    INITIALIZER_PROMPT,
+                    deps=self.deps,
+                    usage_limits=UsageLimits(request_limit=None),
+                )
+        finally:
+            self.tools.features_editable = False
+        log_cache_usage("initializer", result.usage())
+        self.tools.metrics.log_summary("initializer")
+        await reap_processes(self.tools.processes, "initializer session")
+        if not self.features.exists():
+            raise RuntimeError("initializer session finished without features.json")
+        # Fail here, not in the first coding session, if it does not parse.
+        self.features.load()
+        self.state.initialized = True
+        self._save()
+
+    async def run_session(self) -> SessionRecord:
+        passing, total = count_passing(self.features.path)
+        record = SessionRecord(
+            number=len(self.state.sessions) + 1,
+            started_at=datetime.now(timezone.utc),
+            passing_before=passing,
+        )
+        self.state.sessions.append(record)
+        self._save()
+
+        self.tools.metrics.reset()
+        baseline = self.features.snapshot()
+        with logfire.span("coding session {number}", number=record.number):
+            try:
+                result = await self.coding_agent.run(
+                    CODING_PROMPT,
+                    deps=self.deps,
+                    usage_limits=UsageLimits(request_limit=None),
+                )
+                usage = result.usage()
+                record.input_tokens = usage.input_tokens
+                record.cache_read_tokens = usage.cache_read_tokens
+                log_cache_usage(f"coding session {record.number}", usage)
+            except Exception as e:
+                record.error = str(e)
+                logfire.exception(
+                    "Coding session {number} failed", number=record.number
+                )
+
+        await reap_processes(self.tools.processes, f"coding session {record.number}")
+        if self.sandbox:
+            self.sandbox.stop()
+        await enforce_features(
+            self.features, baseline, self.pool, f"coding session {record.number}"
+        )
+        record.finished_at = datetime.now(timezone.utc)
+        record.tool_seconds = self.tools.metrics.log_summary(
+            f"coding session {record.number}"
+        )["tool_seconds"]
+        record.passing_after, _ = count_passing(self.features.path)
+        record.commit = await self._git("rev-parse HEAD") or None
+        moved = record.passing_after > record.passing_before
+        self.state.stalled = 0 if moved else self.state.stalled + 1
+        self._save()
+        logfire.info(
+            "Coding session {number}: {passing}/{total} features passing, "
+            "{rate:.2f} features/hour",
+            number=record.number,
+            passing=record.passing_after,
+            total=total,
+            rate=self.features_per_hour(),
+        )
+        return record
+
+    async def run(self) -> OrchestratorState:
+        with contextlib.chdir(self.project_dir):
+            try:
+                if not self.state.initialized:
+                    await self.initialize()
+                await self._exclude_checkpoint()
+                if self.sandbox_pool:
+                    self.sandbox_pool.fill()
+                while len(self.state.sessions) < self.max_sessions:
+                    passing, total = count_passing(self.features.path)
+                    if passing == total:
+                        logfire.info("All {total} features pass", total=total)
+                        break
+                    if self.state.stalled >= self.stall_limit:
+                        logfire.warn(
+                            "Stopping: no feature passed in the last {stalled} sessions",
+                            stalled=self.state.stalled,
+                        )
+                        break
+                    await self.run_session()
+            finally:
+                await self.tools.processes.close()
+                await self.pool.close()
+                if self.sandbox:
+                    self.sandbox.stop()
+                if self.sandbox_pool:
+                    self.sandbox_pool.close()
+        return self.state
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Build a planned project with coding sessions."
+    )
+    parser.add_argument("project_dir", nargs="?", default="project")
+    parser.add_argument("--context-window-size", type=int, default=context_window_size)
+    parser.add_argument("--max-sessions", type=int, default=50)
+    parser.add_argument("--stall-limit", type=int, default=3)
+    parser.add_argument(
+        "--sandbox",
+        default=sandbox_runtime,
+        help="Docker runtime to run coding tools in (default: $AUTOCODE_SANDBOX)",
+    )
+    parser.add_argument(
+        "--sandbox-warm",
+        type=int,
+        default=1,
+        help="Sandboxes to keep started ahead of the next session",
+    )
+    args = parser.parse_args()
+
+    orchestrator = Orchestrator(
+        args.project_dir,
+        context_window_size=args.context_window_size,
+        max_sessions=args.max_sessions,
+        stall_limit=args.stall_limit,
+        sandbox_runtime=args.sandbox,
+        sandbox_warm=args.sandbox_warm,
+    )
+    state = await orchestrator.run()
+    Console().print(
+        f"[bold green]{len(state.sessions)} coding sessions, "
+        f"{orchestrator.features_per_hour():.2f} features/hour[/bold green]"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
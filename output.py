@@ -0,0 +1,145 @@
+import hashlib
+import re
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from files import MAX_LINE_LENGTH
+
+OUTPUTS_DIR = Path(".autocode") / "outputs"
+CHARS_PER_TOKEN = 4
+TRUNCATED_NOTE = "[Output truncated:"
+ERROR_LINE = re.compile(
+    r"error|exception|traceback|fail|fatal|panic|assert|denied|not found|warn",
+    re.IGNORECASE,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate; close enough for budgeting without a tokenizer."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _clip(line: str) -> str:
+    if len(line) > MAX_LINE_LENGTH:
+        return line[:MAX_LINE_LENGTH] + "... [truncated]"
+    return line
+
+
+def _take(lines: list[tuple[int, str]], tokens: int) -> list[tuple[int, str]]:
+    """Take numbered lines from the front until the token budget runs out."""
+    taken = []
+    for number, line in lines:
+        tokens -= estimate_tokens(line) + 2
+        if tokens < 0:
+            break
+        taken.append((number, line))
+    return taken
+
+
+class OutputStore:
+    """Full tool outputs spilled to disk, addressed by a short content handle.
+
+    Handles are content hashes, so spilling the same output twice reuses one file.
+    Only the most recent max_outputs files are kept. Each project (and each
+    scheduler worktree) has its own store under .autocode/outputs, so parallel
+    workers never evict each other's handles.
+    """
+
+    def __init__(self, root: str | Path, max_outputs: int = 64):
+        self.directory = Path(root) / OUTPUTS_DIR
+        self.max_outputs = max_outputs
+        self._lock = threading.Lock()
+
+    def _path(self, handle: str) -> Path:
+        if not re.fullmatch(r"[0-9a-f]{12}", handle):
+            raise ValueError(f"invalid output handle: {handle!r}")
+        return self.directory / f"{handle}.log"
+
+    def spill(self, text: str) -> str:
+        handle = hashlib.blake2b(text.encode(), digest_size=6).hexdigest()
+        path = self._path(handle)
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            if path.exists():
+                path.touch()
+            else:
+                path.write_text(text, encoding="utf-8")
+            outputs = sorted(
+                self.directory.glob("*.log"), key=lambda p: p.stat().st_mtime
+            )
+            for stale in outputs[: -self.max_outputs]:
+                stale.unlink(missing_ok=True)
+        return handle
+
+    def page(self, handle: str, offset: int, max_tokens: int) -> str:
+        """Numbered lines of a spilled output from offset, up to max_tokens."""
+        path = self._path(handle)
+        if not path.exists():
+            raise FileNotFoundError(f"output {handle} has expired or never existed")
+        lines = path.read_text(encoding="utf-8").splitlines()
+        offset = max(offset, 0)
+        numbered = [(i, _clip(line)) for i, line in enumerate(lines[offset:], offset)]
+        page = _take(numbered, max_tokens) or numbered[:1]
+        content = "\n".join(f"{number + 1:>6}\t{line}" for number, line in page)
+        end_index = offset + len(page)
+        if end_index < len(lines):
+            remaining = len(lines) - end_index
+            content += f"\n\n[... {remaining} more lines. Use offset={end_index} to read more.]"
+        return content or "[End of output]"
+
+
+@dataclass
+class OutputBudget:
+    """Per-call token budget for tool output.
+
+    Each call gets a fraction of the context still remaining, clamped to
+    [min_tokens, max_tokens]. Output over budget keeps its head, its tail and any
+    error-looking lines in between; the full text is spilled to the store.
+    """
+
+    store: OutputStore
+    fraction: float = 0.05
+    min_tokens: int = 500
+    max_tokens: int = 8000
+
+    def tokens_for(self, context_window_size: int, used_tokens: int) -> int:
+        remaining = max(context_window_size - used_tokens, 0)
+        return max(
+            self.min_tokens, min(self.max_tokens, int(remaining * self.fraction))
+        )
+
+    def fit(self, text: str, max_tokens: int) -> tuple[str, bool]:
+        """Return text trimmed to max_tokens, and whether it had to be trimmed."""
+        total = estimate_tokens(text)
+        if total <= max_tokens:
+            return text, False
+        handle = self.store.spill(text)
+        lines = [(i, _clip(line)) for i, line in enumerate(text.splitlines())]
+
+        head = _take(lines, max_tokens * 3 // 10)
+        tail = _take(lines[len(head) :][::-1], max_tokens * 4 // 10)[::-1]
+        middle = lines[len(head) : len(lines) - len(tail)]
+        errors = _take(
+            [(i, line) for i, line in middle if ERROR_LINE.search(line)],
+            max_tokens - sum(estimate_tokens(line) + 2 for _, line in head + tail),
+        )
+
+        parts = [line for _, line in head]
+        skipped = len(middle)
+        if errors:
+            parts.append(
+                f"[... {skipped} lines omitted; error-looking lines among them:]"
+            )
+            parts.extend(f"{number + 1:>6}\t{line}" for number, line in errors)
+            parts.append("[...]")
+        elif skipped:
+            parts.append(f"[... {skipped} lines omitted ...]")
+        parts.extend(line for _, line in tail)
+        parts.append(
+            f"\n{TRUNCATED_NOTE} ~{total} tokens in {len(lines)} lines, over the "
+            f"{max_tokens}-token budget. Full output saved as handle {handle!r}; "
+            f"page through it with read_output(handle={handle!r}, "
+            f"offset={len(head)}).]"
+        )
+        return "\n".join(parts), True
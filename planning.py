@@ -0,0 +1,156 @@
+import asyncio
+from typing import Any, get_args
+
+import logfire
+from pydantic import BaseModel, create_model
+from pydantic_ai import (
+    ModelMessage,
+    RetryPromptPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+from agent import (
+    drafting_agent,
+    log_cache_usage,
+    review_agent,
+    revision_agent,
+    section_agent,
+)
+from schemas import Plan, PlanSection
+
+# Drafted by the planning agent once requirements are clarified; everything else
+# is drafted from it by one sub-agent per section, concurrently.
+SKELETON: list[PlanSection] = [
+    "overview",
+    "technology_stack",
+    "prerequisites",
+    "core_features",
+    "success_criteria",
+]
+FANOUT: list[PlanSection] = [s for s in get_args(PlanSection) if s not in SKELETON]
+
+
+def sections_model(
+    sections: list[PlanSection], name: str = "PlanSections"
+) -> type[BaseModel]:
+    """An output type holding just the given Plan fields, with their descriptions."""
+    fields: dict[str, Any] = {
+        section: (Plan.model_fields[section].annotation, Plan.model_fields[section])
+        for section in sections
+    }
+    return create_model(name, **fields)
+
+
+PlanSkeleton = sections_model(SKELETON, "PlanSkeleton")
+
+
+def requirements_brief(messages: list[ModelMessage]) -> str:
+    """The user's requests and clarifications from a planning conversation."""
+    lines = []
+    for message in messages:
+        for part in message.parts:
+            if isinstance(part, UserPromptPart) and isinstance(part.content, str):
+                lines.append(f"USER: {part.content}")
+            elif getattr(part, "tool_name", None) != "ask_followup":
+                continue
+            elif isinstance(part, ToolCallPart):
+                lines.append(f"PLANNER ASKED: {part.args_as_json_str()}")
+            elif isinstance(part, ToolReturnPart):
+                lines.append(f"USER ANSWERED: {part.model_response_str()}")
+            elif isinstance(part, RetryPromptPart):
+                lines.append(f"USER ANSWERED: {part.model_response()}")
+    return "\n\n".join(lines)
+
+
+async def rewrite_sections(
+    plan: Plan, feedback: str, sections: list[PlanSection]
+) -> Plan:
+    """Regenerate the given sections of plan to address feedback and merge them in."""
+    result = await section_agent.run(
+        f"<plan>\n{plan.model_dump_json(indent=2)}\n</plan>\n\n"
+        f"<feedback>\n{feedback}\n</feedback>\n\n"
+        f"<rewrite>{', '.join(sections)}</rewrite>",
+        output_type=sections_model(sections),
+    )
+    log_cache_usage("sections", result.usage())
+    return Plan.model_validate(
+        {**plan.model_dump(), **result.output.model_dump(include=set(sections))}
+    )
+
+
+async def revise_plan(plan: Plan, feedback: str) -> tuple[Plan, list[PlanSection]]:
+    """Regenerate only the sections of plan that feedback affects and merge them in.
+
+    Returns the revised plan and the sections that were rewritten.
+    """
+    # The plan comes first so this request and the rewrite share a cacheable prefix.
+    revision = await revision_agent.run(
+        f"<plan>\n{plan.model_dump_json(indent=2)}\n</plan>\n\n"
+        f"<feedback>\n{feedback}\n</feedback>"
+    )
+    log_cache_usage("revision", revision.usage())
+    # Nothing picked means the feedback was not understood: rewrite everything.
+    sections = list(dict.fromkeys(revision.output.sections)) or list(
+        get_args(PlanSection)
+    )
+    logfire.info(
+        "Revising plan sections {sections}: {reason}",
+        sections=sections,
+        reason=revision.output.reason,
+    )
+    return await rewrite_sections(plan, feedback, sections), sections
+
+
+async def review_plan(plan: Plan) -> tuple[Plan, list[PlanSection]]:
+    """Cross-check independently drafted sections and rewrite inconsistent ones.
+
+    Returns the checked plan and the sections that were rewritten.
+    """
+    result = await review_agent.run(
+        f"<plan>\n{plan.model_dump_json(indent=2)}\n</plan>"
+    )
+    log_cache_usage("review", result.usage())
+    review = result.output
+    sections = list(dict.fromkeys(review.sections))
+    if not sections:
+        return plan, []
+    logfire.info(
+        "Plan review found {count} issues in {sections}",
+        count=len(review.issues),
+        sections=sections,
+        issues=review.issues,
+    )
+    feedback = "\n".join(f"- {issue}" for issue in review.issues)
+    return await rewrite_sections(plan, feedback, sections), sections
+
+
+async def draft_plan(skeleton: BaseModel, messages: list[ModelMessage]) -> Plan:
+    """Draft every section beyond the skeleton concurrently, then review the result.
+
+    Each FANOUT section gets its own sub-agent call, given the clarified
+    requirements and the skeleton, so drafting takes as long as the slowest
+    section rather than the sum of all of them.
+    """
+    context = (
+        f"<requirements>\n{requirements_brief(messages)}\n</requirements>\n\n"
+        f"<skeleton>\n{skeleton.model_dump_json(indent=2)}\n</skeleton>"
+    )
+
+    async def draft(section: PlanSection) -> dict:
+        with logfire.span("draft plan section {section}", section=section):
+            result = await drafting_agent.run(
+                f"{context}\n\n<draft>{section}</draft>",
+                output_type=sections_model([section]),
+            )
+        log_cache_usage(f"draft {section}", result.usage())
+        return result.output.model_dump()
+
+    with logfire.span("draft plan sections"):
+        drafts = await asyncio.gather(*(draft(section) for section in FANOUT))
+    plan = Plan.model_validate(
+        {**skeleton.model_dump(), **{k: v for d in drafts for k, v in d.items()}}
+    )
+    plan, _ = await review_plan(plan)
+    return plan
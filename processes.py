@@ -0,0 +1,233 @@
+import asyncio
+import atexit
+import os
+import re
+import signal
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from files import MAX_LINE_LENGTH
+
+# Bytes of one output line kept while waiting for its newline; the rest is dropped.
+LINE_BYTES = MAX_LINE_LENGTH * 4
+
+
+class ProcessError(Exception):
+    pass
+
+
+@dataclass
+class ManagedProcess:
+    handle: str
+    command: str
+    proc: asyncio.subprocess.Process
+    logs: deque[str]
+    ready_port: int | None = None
+    ready_pattern: re.Pattern | None = None
+    started_at: float = field(default_factory=time.monotonic)
+    ready_after: float | None = None
+    lines: int = 0
+    matched: asyncio.Event = field(default_factory=asyncio.Event)
+    reader: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.proc.returncode is None
+
+    def status(self) -> str:
+        if self.running:
+            state = f"running (pid {self.proc.pid}, up {self._uptime()})"
+        else:
+            state = f"exited with code {self.proc.returncode}"
+        ready = (
+            f"ready after {self.ready_after:.1f}s"
+            if self.ready_after is not None
+            else "not ready"
+        )
+        return f"{self.handle}: {state}, {ready}, {self.lines} lines of output"
+
+    def _uptime(self) -> str:
+        seconds = int(time.monotonic() - self.started_at)
+        return (
+            f"{seconds // 60}m{seconds % 60:02d}s" if seconds >= 60 else f"{seconds}s"
+        )
+
+    def tail(self, n: int) -> str:
+        shown = list(self.logs)[-n:] if n > 0 else []
+        dropped = self.lines - len(shown)
+        header = f"[{dropped} earlier lines not shown]\n" if dropped else ""
+        return header + "\n".join(shown)
+
+
+class ProcessManager:
+    """Long-running commands (dev servers, watchers) started in the background.
+
+    Each process runs in its own session and process group under bash -c, with
+    stdout and stderr merged into a ring buffer of the last log_lines lines, drained
+    by a reader task so a chatty server never blocks on a full pipe. Readiness is
+    probed by connecting to a port and/or matching a regex against new output.
+    close() stops every process; it is called at the end of each session, and any
+    process still alive when the interpreter exits is killed.
+    """
+
+    def __init__(self, cwd: str | None = None, log_lines: int = 2000):
+        self.cwd = cwd
+        self.log_lines = log_lines
+        self._processes: dict[str, ManagedProcess] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._count = 0
+        atexit.register(self._kill_all)
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        # Pipes and reader tasks belong to the loop that created them.
+        self._kill_all()
+        self._processes.clear()
+        self._loop = loop
+
+    def get(self, handle: str) -> ManagedProcess:
+        if handle not in self._processes:
+            known = ", ".join(self._processes) or "none"
+            raise ProcessError(f"no process {handle!r}; known handles: {known}")
+        return self._processes[handle]
+
+    def all(self) -> list[ManagedProcess]:
+        return list(self._processes.values())
+
+    def _append(self, process: ManagedProcess, line: bytes, truncated: bool):
+        text = line.decode(errors="replace").removesuffix("\r")
+        if truncated or len(text) > MAX_LINE_LENGTH:
+            text = text[:MAX_LINE_LENGTH] + " ... [line truncated]"
+        process.logs.append(text)
+        process.lines += 1
+        if process.ready_pattern and process.ready_pattern.search(text):
+            process.matched.set()
+
+    async def _read(self, process: ManagedProcess):
+        """Drain output in chunks and split it into lines here, so an over-long line
+        (e.g. minified bundler output) is truncated instead of stopping the reader."""
+        stream = process.proc.stdout
+        pending = b""
+        truncated = False
+        while chunk := await stream.read(65536):  # pyright: ignore[reportOptionalMemberAccess]
+            *lines, pending = (pending + chunk).split(b"\n")
+            for line in lines:
+                self._append(process, line, truncated)
+                truncated = False
+            if len(pending) > LINE_BYTES:
+                pending = pending[:LINE_BYTES]
+                truncated = True
+        if pending or truncated:
+            self._append(process, pending, truncated)
+
+    async def _port_open(self, port: int) -> bool:
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection("127.0.0.1", port), 1.0
+            )
+        except (OSError, TimeoutError):
+            return False
+        writer.close()
+        return True
+
+    async def _ready(self, process: ManagedProcess) -> bool:
+        if process.ready_pattern and not process.matched.is_set():
+            return False
+        return not process.ready_port or await self._port_open(process.ready_port)
+
+    async def wait_ready(self, process: ManagedProcess, timeout: float) -> bool:
+        """Wait until every probe passes, the process exits or timeout runs out.
+
+        Without probes, a process counts as ready if it is still running after a
+        short grace period.
+        """
+        if not process.ready_port and not process.ready_pattern:
+            await asyncio.sleep(min(timeout, 1.0))
+        deadline = time.monotonic() + timeout
+        while process.running:
+            if await self._ready(process):
+                process.ready_after = time.monotonic() - process.started_at
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.2)
+        return False
+
+    async def start(
+        self,
+        command: str,
+        name: str | None = None,
+        ready_port: int | None = None,
+        ready_pattern: str | None = None,
+    ) -> ManagedProcess:
+        self._bind_loop()
+        if name and name in self._processes and self._processes[name].running:
+            raise ProcessError(f"{name!r} is already running; stop it first")
+        pattern = re.compile(ready_pattern) if ready_pattern else None
+        self._count += 1
+        handle = name or f"proc-{self._count}"
+        proc = await asyncio.create_subprocess_exec(
+            "/bin/bash",
+            "-c",
+            command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            cwd=self.cwd,
+            start_new_session=True,
+        )
+        process = ManagedProcess(
+            handle=handle,
+            command=command,
+            proc=proc,
+            logs=deque(maxlen=self.log_lines),
+            ready_port=ready_port,
+            ready_pattern=pattern,
+        )
+        process.reader = asyncio.create_task(self._read(process))
+        self._processes[handle] = process
+        return process
+
+    def _signal(self, process: ManagedProcess, sig: signal.Signals):
+        try:
+            os.killpg(process.proc.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    async def stop(self, handle: str, grace: float = 5.0) -> ManagedProcess:
+        """SIGTERM the process group, then SIGKILL it if it outlives grace."""
+        process = self.get(handle)
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            if not process.running:
+                break
+            self._signal(process, sig)
+            try:
+                await asyncio.wait_for(process.proc.wait(), grace)
+            except TimeoutError:
+                continue
+        # Children that ignored SIGTERM may outlive the shell in the same group.
+        self._signal(process, signal.SIGKILL)
+        if process.reader:
+            try:
+                await asyncio.wait_for(process.reader, grace)
+            except TimeoutError:
+                process.reader.cancel()
+            except Exception as e:
+                # The process is stopped either way; a broken reader only loses logs.
+                process.logs.append(f"[log reader failed: {e}]")
+        return process
+
+    async def close(self) -> list[str]:
+        """Stop every running process; returns the handles that were still running."""
+        running = [p.handle for p in self._processes.values() if p.running]
+        await asyncio.gather(*(self.stop(handle) for handle in running))
+        self._processes.clear()
+        return running
+
+    def _kill_all(self):
+        for process in self._processes.values():
+            if process.running:
+                self._signal(process, signal.SIGKILL)
@@ -0,0 +1,140 @@
+import os
+import secrets
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+from schemas import ProgressEntry, ProgressRecord
+
+PROGRESS_LOG = "progress.jsonl"
+PROGRESS_VIEW = "PROGRESS.md"
+LEGACY_VIEW = "PROGRESS.legacy.md"
+GENERATED_NOTE = f"_Generated from {PROGRESS_LOG}; newest first. Do not edit by hand._"
+
+
+def _one_line(text: str, limit: int = 160) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
+
+def render_entry(record: ProgressRecord) -> str:
+    subject = "general" if record.feature is None else f"feature {record.feature}"
+    lines = [
+        f"### {record.timestamp:%Y-%m-%d %H:%M} UTC — {subject} [{record.id}]",
+        "",
+        record.summary.strip(),
+    ]
+    details = [
+        ("Validation", record.validation),
+        ("Remaining", record.remaining),
+        ("Commit", record.commit),
+    ]
+    if any(value for _, value in details):
+        lines.append("")
+        lines.extend(f"- {label}: {value.strip()}" for label, value in details if value)
+    return "\n".join(lines)
+
+
+class ProgressStore:
+    """Append-only JSONL log of progress entries, with bounded views of it.
+
+    One entry per line, so the file can be committed and union-merged across
+    parallel worktrees; entries are ordered by timestamp when read. PROGRESS.md
+    next to the log is regenerated after every append as a read-only view for
+    humans.
+    """
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        self.path = self.directory / PROGRESS_LOG
+        self.view = self.directory / PROGRESS_VIEW
+        self._lock = threading.Lock()
+
+    def append(
+        self, entry: ProgressEntry, session: str | None = None
+    ) -> ProgressRecord:
+        record = ProgressRecord(
+            **entry.model_dump(),
+            id=secrets.token_hex(4),
+            timestamp=datetime.now(timezone.utc),
+            session=session,
+        )
+        line = record.model_dump_json() + "\n"
+        with self._lock:
+            # A single O_APPEND write, so concurrent writers never interleave lines.
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode())
+            finally:
+                os.close(fd)
+            self.write_view()
+        return record
+
+    def entries(self) -> list[ProgressRecord]:
+        if not self.path.exists():
+            return []
+        records = {}
+        for line in self.path.read_text().splitlines():
+            if line.strip():
+                record = ProgressRecord.model_validate_json(line)
+                records[record.id] = record
+        return sorted(records.values(), key=lambda r: r.timestamp)
+
+    def for_feature(self, feature: int) -> list[ProgressRecord]:
+        return [r for r in self.entries() if r.feature == feature]
+
+    def summary(self, older: list[ProgressRecord], max_features: int = 15) -> str:
+        """A fixed-size digest of entries: the latest word on each recent feature."""
+        if not older:
+            return ""
+        by_feature: dict[int | None, list[ProgressRecord]] = defaultdict(list)
+        for record in older:
+            by_feature[record.feature].append(record)
+        recent = sorted(by_feature, key=lambda f: by_feature[f][-1].timestamp)
+        shown = recent[-max_features:]
+        lines = [
+            f"Earlier progress: {len(older)} entries from "
+            f"{older[0].timestamp:%Y-%m-%d %H:%M} to {older[-1].timestamp:%Y-%m-%d %H:%M} UTC."
+        ]
+        for feature in reversed(shown):
+            records = by_feature[feature]
+            last = records[-1]
+            subject = "general" if feature is None else f"feature {feature}"
+            note = (
+                f"; remaining: {_one_line(last.remaining, 80)}"
+                if last.remaining
+                else ""
+            )
+            lines.append(
+                f"- {subject} ({len(records)} entries, last {last.timestamp:%Y-%m-%d}): "
+                f"{_one_line(last.summary)}{note}"
+            )
+        if hidden := len(recent) - len(shown):
+            lines.append(
+                f"- ... and {hidden} more; use progress_for_feature to see them."
+            )
+        return "\n".join(lines)
+
+    def render(self, n: int = 5) -> str:
+        """The rolling summary of older entries followed by the latest n in full."""
+        records = self.entries()
+        if not records:
+            return "No progress has been logged yet."
+        cut = max(len(records) - n, 0)
+        parts = [self.summary(records[:cut])] if cut else []
+        parts.extend(render_entry(record) for record in records[cut:])
+        return "\n\n".join(parts)
+
+    def write_view(self):
+        legacy = self.directory / LEGACY_VIEW
+        if self.view.exists() and GENERATED_NOTE not in self.view.read_text():
+            # A hand-written PROGRESS.md from before the log: keep it alongside.
+            self.view.replace(legacy)
+        records = self.entries()
+        body = "\n\n".join(render_entry(record) for record in reversed(records))
+        older = f"\n\nEarlier notes are in {LEGACY_VIEW}." if legacy.exists() else ""
+        text = f"# Progress\n\n{GENERATED_NOTE}\n\n{body}{older}\n"
+        temp = self.view.with_suffix(".tmp")
+        temp.write_text(text)
+        temp.replace(self.view)
@@ -0,0 +1,237 @@
+import hashlib
+import itertools
+import json
+import os
+import threading
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any
+
+import logfire
+from pydantic_ai import (
+    ModelMessage,
+    ModelMessagesTypeAdapter,
+    ModelRequest,
+    ModelResponse,
+    RunContext,
+    TextPart,
+    ToolCallPart,
+)
+from pydantic_ai.models import (
+    KnownModelName,
+    Model,
+    ModelRequestParameters,
+    StreamedResponse,
+)
+from pydantic_ai.models.function import AgentInfo, DeltaToolCall, FunctionModel
+from pydantic_ai.models.wrapper import WrapperModel
+from pydantic_ai.settings import ModelSettings
+from pydantic_ai.tools import ToolDefinition
+
+from history import USAGE_WARNING
+from search import CACHE_DIR
+
+VOLATILE_KEYS = {
+    "timestamp",
+    "run_id",
+    "usage",
+    "instructions",
+    "metadata",
+    "model_name",
+    "provider_name",
+    "provider_url",
+    "provider_details",
+    "provider_response_id",
+    "finish_reason",
+}
+
+
+class ReplayMiss(LookupError):
+    pass
+
+
+def _normalize(value: Any) -> Any:
+    """Drop fields that differ between otherwise identical requests."""
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if k not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, str):
+        return USAGE_WARNING.sub("", value)
+    return value
+
+
+class ReplayStore:
+    """Content-addressed store of model responses, keyed by normalized request.
+
+    Responses live in objects/<key>.json. Each agent name also has an ordered log of
+    the keys it requested, so replay can fall back to "the n-th request" when tool
+    output that varies from run to run (commit hashes, timings) changes the key.
+
+    A key covers the agent name and the message history, minus timestamps, run ids,
+    usage and token usage warnings. With strict=True it also covers the
+    instructions and tool definitions, so editing a prompt forces a miss.
+    """
+
+    def __init__(self, directory: Path = CACHE_DIR / "replay", strict: bool = False):
+        self.directory = Path(directory)
+        self.strict = strict
+        self._lock = threading.Lock()
+
+    def key(
+        self,
+        name: str,
+        messages: list[ModelMessage],
+        tools: list[ToolDefinition] | None = None,
+    ) -> str:
+        payload: dict[str, Any] = {
+            "name": name,
+            "messages": _normalize(
+                ModelMessagesTypeAdapter.dump_python(messages, mode="json")
+            ),
+        }
+        if self.strict:
+            requests = [m for m in messages if isinstance(m, ModelRequest)]
+            payload["instructions"] = requests[-1].instructions if requests else None
+            payload["tools"] = [
+                [tool.name, tool.description, tool.parameters_json_schema]
+                for tool in tools or []
+            ]
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def _object(self, key: str) -> Path:
+        return self.directory / "objects" / f"{key}.json"
+
+    def _sequence(self, name: str) -> Path:
+        return self.directory / "sequences" / f"{name}.jsonl"
+
+    def get(self, key: str) -> ModelResponse | None:
+        path = self._object(key)
+        if not path.exists():
+            return None
+        [response] = ModelMessagesTypeAdapter.validate_json(path.read_bytes())
+        assert isinstance(response, ModelResponse)
+        return response
+
+    def start_sequence(self, name: str):
+        """Begin a new recording of an agent's request order."""
+        with self._lock:
+            self._sequence(name).unlink(missing_ok=True)
+
+    def put(self, name: str, key: str, response: ModelResponse):
+        path = self._object(key)
+        with self._lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp = path.with_suffix(f".{os.getpid()}.tmp")
+            temp.write_bytes(ModelMessagesTypeAdapter.dump_json([response]))
+            temp.replace(path)
+            sequence = self._sequence(name)
+            sequence.parent.mkdir(parents=True, exist_ok=True)
+            with sequence.open("a") as f:
+                f.write(json.dumps(key) + "\n")
+
+    def sequence(self, name: str) -> list[str]:
+        path = self._sequence(name)
+        if not path.exists():
+            return []
+        return [json.loads(line) for line in path.read_text().splitlines() if line]
+
+
+class RecordingModel(WrapperModel):
+    """Wrap a real model and store every response it returns.
+
+    The first response recorded replaces the agent's previous request sequence.
+    Parallel scheduler workers each start their own, so replaying those relies on
+    exact key matches.
+    """
+
+    def __init__(self, wrapped: Model | KnownModelName, store: ReplayStore, name: str):
+        super().__init__(wrapped)
+        self.store = store
+        self.name = name
+        self._started = False
+
+    def _record(self, key: str, response: ModelResponse):
+        if not self._started:
+            self.store.start_sequence(self.name)
+            self._started = True
+        self.store.put(self.name, key, response)
+
+    async def request(
+        self,
+        messages: list[ModelMessage],
+        model_settings: ModelSettings | None,
+        model_request_parameters: ModelRequestParameters,
+    ) -> ModelResponse:
+        key = self.store.key(
+            self.name, messages, model_request_parameters.function_tools
+        )
+        response = await super().request(
+            messages, model_settings, model_request_parameters
+        )
+        self._record(key, response)
+        return response
+
+    @asynccontextmanager
+    async def request_stream(
+        self,
+        messages: list[ModelMessage],
+        model_settings: ModelSettings | None,
+        model_request_parameters: ModelRequestParameters,
+        run_context: RunContext[Any] | None = None,
+    ) -> AsyncIterator[StreamedResponse]:
+        key = self.store.key(
+            self.name, messages, model_request_parameters.function_tools
+        )
+        async with super().request_stream(
+            messages, model_settings, model_request_parameters, run_context
+        ) as stream:
+            yield stream
+        self._record(key, stream.get())
+
+
+def replay_model(store: ReplayStore, name: str, fallback: bool = True) -> FunctionModel:
+    """An offline stand-in serving the responses recorded for an agent.
+
+    Requests are matched by key. On a miss, if fallback is set, the response
+    recorded at the same position in the agent's request sequence is served
+    instead; otherwise ReplayMiss is raised.
+    """
+    counter = itertools.count()
+    recorded = store.sequence(name)
+
+    def lookup(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        position = next(counter)
+        key = store.key(name, messages, info.function_tools)
+        response = store.get(key)
+        if response is None and fallback and position < len(recorded):
+            logfire.warn(
+                "Replay miss for {name} request {position}; serving by position",
+                name=name,
+                position=position,
+            )
+            response = store.get(recorded[position])
+        if response is None:
+            raise ReplayMiss(f"no recorded response for {name} request {position}")
+        return response
+
+    def respond(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        return lookup(messages, info)
+
+    async def stream(messages: list[ModelMessage], info: AgentInfo):
+        response = lookup(messages, info)
+        for index, part in enumerate(response.parts):
+            if isinstance(part, TextPart):
+                yield part.content
+            elif isinstance(part, ToolCallPart):
+                yield {
+                    index: DeltaToolCall(
+                        name=part.tool_name,
+                        json_args=part.args_as_json_str(),
+                        tool_call_id=part.tool_call_id,
+                    )
+                }
+
+    return FunctionModel(respond, stream_function=stream, model_name=f"replay:{name}")
@@ -0,0 +1,202 @@
+import hashlib
+import threading
+from pathlib import Path
+
+import logfire
+from pydantic_ai_backends import DockerSandbox, get_runtime
+
+SNAPSHOT_REPOSITORY = "autocode-env"
+# Files whose contents decide what init.sh installs. Looked up in the project root
+# and its immediate subdirectories (e.g. frontend/, backend/).
+MANIFESTS = (
+    "init.sh",
+    "package.json",
+    "package-lock.json",
+    "pnpm-lock.yaml",
+    "yarn.lock",
+    "requirements.txt",
+    "pyproject.toml",
+    "uv.lock",
+    "poetry.lock",
+    "Pipfile.lock",
+    "Gemfile.lock",
+    "go.sum",
+    "Cargo.lock",
+)
+SKIP_DIRS = {".git", ".autocode", "node_modules", ".venv", "__pycache__"}
+
+
+def manifest_hash(project_dir: str | Path) -> str:
+    """Hash of the dependency manifests, naming the snapshot of their environment."""
+    root = Path(project_dir)
+    directories = [root] + sorted(
+        d for d in root.iterdir() if d.is_dir() and d.name not in SKIP_DIRS
+    )
+    digest = hashlib.sha256()
+    for directory in directories:
+        for name in MANIFESTS:
+            path = directory / name
+            if path.is_file():
+                digest.update(path.relative_to(root).as_posix().encode() + b"\0")
+                digest.update(path.read_bytes() + b"\0")
+    return digest.hexdigest()[:20]
+
+
+class SandboxPool:
+    """Warm Docker sandboxes for one project, started from its bootstrapped snapshot.
+
+    Up to size containers are started ahead of time in a background thread, with
+    project_dir mounted as the runtime's work dir. After init.sh succeeds in a
+    sandbox, snapshot() commits the container as an image tagged with the hash of
+    the dependency manifests, so later sandboxes start with dependencies already
+    installed. Warm containers started from an older image are discarded once a
+    snapshot for the current manifests exists.
+
+    Only the container filesystem is captured; the mounted project (including
+    node_modules) lives on the host and is shared anyway.
+    """
+
+    def __init__(self, runtime: str, project_dir: str | Path, size: int = 1):
+        self.runtime = runtime
+        self.project_dir = str(Path(project_dir).resolve())
+        self.size = size
+        self.work_dir = get_runtime(runtime).work_dir
+        self._warm: list[tuple[str | None, DockerSandbox]] = []
+        self._snapshotted: set[str] = set()
+        self._commits: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._filling = False
+        self._closed = False
+
+    def _client(self):
+        import docker
+
+        return docker.from_env()
+
+    def snapshot_tag(self) -> str:
+        return f"{SNAPSHOT_REPOSITORY}:{manifest_hash(self.project_dir)}"
+
+    def _snapshot_image(self) -> str | None:
+        """The snapshot for the current manifests, if one has been taken."""
+        import docker.errors
+
+        tag = self.snapshot_tag()
+        try:
+            self._client().images.get(tag)
+            return tag
+        except docker.errors.ImageNotFound:
+            return None
+
+    def _start(self, image: str | None) -> DockerSandbox:
+        volumes = {self.project_dir: self.work_dir}
+        if image:
+            sandbox = DockerSandbox(
+                image=image, work_dir=self.work_dir, volumes=volumes
+            )
+        else:
+            sandbox = DockerSandbox(runtime=self.runtime, volumes=volumes)
+        sandbox.start()
+        return sandbox
+
+    def _fill(self):
+        try:
+            while True:
+                with self._lock:
+                    if self._closed or len(self._warm) >= self.size:
+                        return
+                image = self._snapshot_image()
+                sandbox = self._start(image)
+                with self._lock:
+                    if self._closed:
+                        sandbox.stop()
+                        return
+                    self._warm.append((image, sandbox))
+        except Exception as e:
+            logfire.warn("Could not warm a sandbox: {error}", error=str(e))
+        finally:
+            with self._lock:
+                self._filling = False
+
+    def fill(self):
+        """Start warming containers in the background, up to size."""
+        with self._lock:
+            if self._filling or self._closed or len(self._warm) >= self.size:
+                return
+            self._filling = True
+        threading.Thread(target=self._fill, daemon=True).start()
+
+    def take(self) -> DockerSandbox:
+        """A running sandbox from the newest snapshot; warm if one is ready."""
+        image = self._snapshot_image()
+        with self._lock:
+            matching = [entry for entry in self._warm if entry[0] == image]
+            stale = [entry for entry in self._warm if image and entry[0] != image]
+            for entry in stale:
+                self._warm.remove(entry)
+            warm = matching[0][1] if matching else None
+            if warm:
+                self._warm.remove(matching[0])
+        for _, sandbox in stale:
+            sandbox.stop()
+        if warm is None or not warm.is_alive():
+            warm = self._start(image)
+        logfire.info(
+            "Took a sandbox from {image}", image=image or f"runtime {self.runtime}"
+        )
+        self.fill()
+        return warm
+
+    def _commit(self, sandbox: DockerSandbox, tag: str):
+        # DockerSandbox keeps its container private; it is only read here.
+        container = getattr(sandbox, "_container", None)
+        if container is None:
+            return
+        repository, _, version = tag.partition(":")
+        with logfire.span("snapshot sandbox as {tag}", tag=tag):
+            try:
+                container.commit(repository=repository, tag=version)
+            except Exception as e:
+                logfire.warn("Sandbox snapshot failed: {error}", error=str(e))
+                with self._lock:
+                    self._snapshotted.discard(tag)
+                return
+        # Re-warm from the new snapshot.
+        with self._lock:
+            stale = [entry for entry in self._warm if entry[0] != tag]
+            self._warm = [entry for entry in self._warm if entry[0] == tag]
+        for _, warm in stale:
+            warm.stop()
+        self.fill()
+
+    def snapshot(self, sandbox: DockerSandbox):
+        """Commit a freshly bootstrapped sandbox, once per set of manifests.
+
+        The commit runs in a background thread so the tool call that ran init.sh
+        returns immediately.
+        """
+        tag = self.snapshot_tag()
+        with self._lock:
+            if tag in self._snapshotted:
+                return
+            self._snapshotted.add(tag)
+        if self._snapshot_image() == tag:
+            return
+        thread = threading.Thread(target=self._commit, args=(sandbox, tag), daemon=True)
+        with self._lock:
+            self._commits.append(thread)
+        thread.start()
+
+    def release(self, sandbox: DockerSandbox):
+        """Stop a taken sandbox once any snapshot of it has been written."""
+        with self._lock:
+            commits, self._commits = self._commits, []
+        for thread in commits:
+            thread.join()
+        sandbox.stop()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            warm, self._warm = self._warm, []
+        for _, sandbox in warm:
+            sandbox.stop()
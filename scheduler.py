@@ -0,0 +1,408 @@
+import argparse
+import asyncio
+import contextlib
+import os
+import re
+import shlex
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+
+import logfire
+from pydantic_ai import UsageLimits
+from rich.console import Console
+
+from agent import (
+    context_window_size,
+    create_coding_agent,
+    log_cache_usage,
+    sandbox_runtime,
+)
+from features import FeatureRegistry
+from orchestrator import Orchestrator, enforce_features, reap_processes
+from progress import PROGRESS_LOG, PROGRESS_VIEW, ProgressStore
+from sandboxes import SandboxPool
+from schemas import AgentDeps, FeatureAttempt, SchedulerState
+from tools import BashSessionPool, LazySandbox, Tools
+
+STATE_DIR = Path(".autocode")
+WORKTREES = STATE_DIR / "worktrees"
+PORTS_PER_WORKER = 100
+EXCLUSIVE_CATEGORIES = {"infra"}
+SERIAL_CATEGORIES = {"style"}
+PATH_LIKE = re.compile(
+    r"/api/[\w/{}:-]+|[\w-]+(?:/[\w.-]+)*\."
+    r"(?:css|go|html|java|js|json|jsx|md|py|rb|rs|scss|sh|sql|svelte|toml|ts|tsx|vue|ya?ml)\b"
+)
+FEATURE_PROMPT = """Start a new coding session in this git worktree.
+Follow the session start protocol, but instead of choosing a feature yourself,
+implement exactly this feature (index {index}; get_feature({index}) shows its steps):
+
+{description}
+
+Other agents are working on other features in parallel worktrees: do not mark any
+other feature as passing. Run servers only on ports {first_port}-{last_port}; PORT
+is set to {first_port}. Commit your work on the current branch before finishing."""
+
+
+@dataclass
+class Feature:
+    index: int
+    category: str
+    description: str
+    passes: bool
+    depends_on: list[int] = field(default_factory=list)
+    paths: set[str] = field(default_factory=set)
+
+    @classmethod
+    def load_all(cls, features_path: Path) -> list["Feature"]:
+        features = []
+        for index, spec in enumerate(FeatureRegistry(features_path.parent).load()):
+            text = " ".join([spec.description, *spec.steps])
+            features.append(
+                cls(
+                    index=index,
+                    category=spec.category,
+                    description=spec.description,
+                    passes=spec.passes,
+                    depends_on=list(spec.depends_on),
+                    paths=set(PATH_LIKE.findall(text)),
+                )
+            )
+        return features
+
+
+def independent(a: Feature, b: Feature, touched: dict[int, set[str]]) -> bool:
+    """Whether two features can be implemented at the same time.
+
+    Infra features run alone, style features one at a time, and features that name
+    the same files or endpoints, or touched the same files in earlier attempts, run
+    one after the other.
+    """
+    if a.category in EXCLUSIVE_CATEGORIES or b.category in EXCLUSIVE_CATEGORIES:
+        return False
+    if a.category == b.category and a.category in SERIAL_CATEGORIES:
+        return False
+    if a.index in b.depends_on or b.index in a.depends_on:
+        return False
+    paths_a = a.paths | touched.get(a.index, set())
+    paths_b = b.paths | touched.get(b.index, set())
+    return not paths_a & paths_b
+
+
+class Scheduler:
+    """Implement features in parallel, one coding session per git worktree.
+
+    Each worker gets its own worktree and branch off the current HEAD, its own
+    process (and so its own Tools, BashSession pool and working directory) and its
+    own port range. Finished branches are merged back one at a time; a feature whose
+    merge conflicts, or that does not pass after merging, is re-queued to run again
+    on top of the new HEAD, up to max_attempts times.
+    """
+
+    def __init__(
+        self,
+        project_dir: str | Path,
+        workers: int | None = None,
+        context_window_size: int = context_window_size,
+        max_attempts: int = 3,
+        base_port: int = 3100,
+        sandbox_runtime: str | None = sandbox_runtime,
+    ):
+        self.project_dir = Path(project_dir).resolve()
+        self.workers = workers or os.cpu_count() or 1
+        self.context_window_size = context_window_size
+        self.max_attempts = max_attempts
+        self.base_port = base_port
+        self.sandbox_runtime = sandbox_runtime
+        self.pool = BashSessionPool(size=2, cwd=str(self.project_dir))
+        self.state_path = self.project_dir / STATE_DIR / "scheduler.json"
+        self.state = (
+            SchedulerState.model_validate_json(self.state_path.read_text())
+            if self.state_path.exists()
+            else SchedulerState()
+        )
+        self._merge_lock = asyncio.Lock()
+
+    def _save(self):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.state_path.with_suffix(".tmp")
+        temp.write_text(self.state.model_dump_json(indent=2))
+        temp.replace(self.state_path)
+
+    async def _git(self, command: str, timeout: float = 120) -> tuple[bool, str]:
+        result = await self.pool.execute(f"git {command}", timeout=timeout)
+        return result.exit_code == 0, result.stdout.strip()
+
+    def _features(self) -> list[Feature]:
+        return Feature.load_all(self.project_dir / "features.json")
+
+    def _attempts(self, index: int) -> list[FeatureAttempt]:
+        return [a for a in self.state.attempts if a.feature == index]
+
+    def _touched(self) -> dict[int, set[str]]:
+        touched: dict[int, set[str]] = {}
+        for attempt in self.state.attempts:
+            touched.setdefault(attempt.feature, set()).update(attempt.conflicts)
+        return touched
+
+    async def _git_info(self, name: str, line: str):
+        """Add a line to a repository-local (untracked) file under .git/info."""
+        ok, path = await self._git(f"rev-parse --git-path info/{name}")
+        if not ok:
+            return
+        info = self.project_dir / path
+        lines = info.read_text().splitlines() if info.exists() else []
+        if line not in lines:
+            info.parent.mkdir(parents=True, exist_ok=True)
+            info.write_text("\n".join([*lines, line, ""]))
+
+    async def _prepare(self):
+        """Set up the repository for parallel branches and clean up after a crash.
+
+        Worktrees are hidden from git status, and the append-only progress log is
+        union-merged so parallel sessions logging to it do not conflict. PROGRESS.md,
+        generated from the log, is union-merged too and regenerated after each merge.
+        """
+        await self._git_info("exclude", f"{STATE_DIR}/")
+        await self._git_info("attributes", f"{PROGRESS_LOG} merge=union")
+        await self._git_info("attributes", f"{PROGRESS_VIEW} merge=union")
+        for attempt in self.state.attempts:
+            if attempt.finished_at is None:
+                attempt.finished_at = datetime.now(timezone.utc)
+                attempt.error = "interrupted"
+                await self._remove_worktree(attempt.branch)
+        self._save()
+
+    def _worktree(self, branch: str) -> Path:
+        return self.project_dir / WORKTREES / branch.replace("/", "-")
+
+    async def _remove_worktree(self, branch: str):
+        worktree = shlex.quote(str(self._worktree(branch)))
+        await self._git(f"worktree remove --force {worktree}")
+        await self._git(f"branch -D {shlex.quote(branch)}")
+
+    def _ready(
+        self, features: list[Feature], running: dict[int, asyncio.Task]
+    ) -> list[Feature]:
+        passing = {f.index for f in features if f.passes}
+        touched = self._touched()
+        active = [features[i] for i in running]
+        ready: list[Feature] = []
+        for feature in features:
+            if feature.passes or feature.index in running:
+                continue
+            if len(self._attempts(feature.index)) >= self.max_attempts:
+                continue
+            if not all(dep in passing for dep in feature.depends_on):
+                continue
+            # Keep infra features in order: nothing starts past an unfinished one.
+            blockers = [
+                f
+                for f in features[: feature.index]
+                if f.category in EXCLUSIVE_CATEGORIES
+                and not f.passes
+                and len(self._attempts(f.index)) < self.max_attempts
+            ]
+            if blockers and feature.category not in EXCLUSIVE_CATEGORIES:
+                continue
+            if all(independent(feature, other, touched) for other in active + ready):
+                ready.append(feature)
+        return ready
+
+    async def _run_worker(self, feature: Feature, slot: int) -> FeatureAttempt:
+        attempt = FeatureAttempt(
+            feature=feature.index,
+            branch=f"feature/{feature.index}-{len(self._attempts(feature.index)) + 1}",
+            started_at=datetime.now(timezone.utc),
+        )
+        self.state.attempts.append(attempt)
+        self._save()
+
+        worktree = self._worktree(attempt.branch)
+        ok, _ = await self._git(
+            f"worktree add -b {shlex.quote(attempt.branch)} "
+            f"{shlex.quote(str(worktree))} HEAD"
+        )
+        if not ok:
+            attempt.error = "could not create worktree"
+            return attempt
+
+        first_port = self.base_port + slot * PORTS_PER_WORKER
+        log_path = self.project_dir / STATE_DIR / "logs" / f"{worktree.name}.log"
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        with logfire.span(
+            "feature {index} on {branch}", index=feature.index, branch=attempt.branch
+        ):
+            with log_path.open("w") as log:
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable,
+                    os.path.abspath(__file__),
+                    str(worktree),
+                    f"--feature={feature.index}",
+                    f"--first-port={first_port}",
+                    f"--context-window-size={self.context_window_size}",
+                    f"--sandbox={self.sandbox_runtime or ''}",
+                    stdout=log,
+                    stderr=log,
+                    env={**os.environ, "PORT": str(first_port)},
+                )
+                if await process.wait() != 0:
+                    attempt.error = f"worker exited with {process.returncode}"
+        return attempt
+
+    async def _merge(self, attempt: FeatureAttempt):
+        """Merge a finished attempt's branch into the main worktree."""
+        branch = shlex.quote(attempt.branch)
+        async with self._merge_lock:
+            _, changed = await self._git(f"diff --name-only HEAD...{branch}")
+            attempt.files = changed.splitlines()
+            if not attempt.files:
+                attempt.error = attempt.error or "no commits on branch"
+            else:
+                ok, _ = await self._git(f"merge --no-ff --no-commit {branch}")
+                if ok:
+                    if (self.project_dir / PROGRESS_LOG).exists():
+                        ProgressStore(self.project_dir).write_view()
+                        await self._git(f"add {PROGRESS_VIEW}")
+                    ok, _ = await self._git("commit --no-edit")
+                if ok:
+                    attempt.merged = True
+                else:
+                    _, conflicts = await self._git("diff --name-only --diff-filter=U")
+                    attempt.conflicts = conflicts.splitlines()
+                    attempt.error = "merge conflict" if conflicts else "merge failed"
+                    await self._git("merge --abort")
+            attempt.passed = attempt.merged and self._features()[attempt.feature].passes
+            attempt.finished_at = datetime.now(timezone.utc)
+            await self._remove_worktree(attempt.branch)
+            self._save()
+        logfire.info(
+            "Feature {index}: merged={merged} passed={passed} conflicts={conflicts}",
+            index=attempt.feature,
+            merged=attempt.merged,
+            passed=attempt.passed,
+            conflicts=attempt.conflicts,
+        )
+
+    async def run(self) -> SchedulerState:
+        if not (self.project_dir / "features.json").exists():
+            # Initialize through the sequential orchestrator, without coding sessions.
+            await Orchestrator(self.project_dir, max_sessions=0).run()
+        await self._prepare()
+
+        running: dict[int, asyncio.Task] = {}
+        slots = list(range(self.workers))
+        try:
+            while True:
+                features = self._features()
+                for feature in self._ready(features, running)[: len(slots)]:
+                    slot = slots.pop(0)
+                    task = asyncio.create_task(self._run_worker(feature, slot))
+                    task.add_done_callback(lambda _, slot=slot: slots.append(slot))
+                    running[feature.index] = task
+                if not running:
+                    break
+                done, _ = await asyncio.wait(
+                    running.values(), return_when=asyncio.FIRST_COMPLETED
+                )
+                for index, task in list(running.items()):
+                    if task in done:
+                        del running[index]
+                        await self._merge(task.result())
+        finally:
+            for task in running.values():
+                task.cancel()
+            await self.pool.close()
+        return self.state
+
+
+async def run_worker(
+    worktree: str,
+    index: int,
+    first_port: int,
+    context_window_size: int,
+    sandbox_runtime: str | None = None,
+):
+    """Run one coding session on one feature inside a worktree."""
+    registry = FeatureRegistry(worktree)
+    spec = registry.get(index)
+    baseline = registry.snapshot()
+    pool = BashSessionPool(size=4, cwd=worktree)
+    # Workers are separate processes, so they share snapshots but not warm
+    # containers: size=0 starts one on demand from the latest snapshot.
+    sandbox = (
+        LazySandbox(SandboxPool(sandbox_runtime, worktree, size=0))
+        if sandbox_runtime
+        else None
+    )
+    tools = Tools(pool, sandbox)
+    agent = create_coding_agent(tools)
+    prompt = FEATURE_PROMPT.format(
+        index=index,
+        description=spec.description,
+        first_port=first_port,
+        last_port=first_port + PORTS_PER_WORKER - 1,
+    )
+    with contextlib.chdir(worktree):
+        try:
+            result = await agent.run(
+                prompt,
+                deps=AgentDeps(context_window_size=context_window_size),
+                usage_limits=UsageLimits(request_limit=None),
+            )
+            log_cache_usage(f"feature {index}", result.usage())
+        finally:
+            tools.metrics.log_summary(f"feature {index}")
+            await reap_processes(tools.processes, f"feature {index}")
+            await enforce_features(registry, baseline, pool, f"feature {index}")
+            await pool.close()
+            if sandbox:
+                sandbox.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Build a planned project with parallel coding sessions."
+    )
+    parser.add_argument("project_dir", nargs="?", default="project")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--context-window-size", type=int, default=context_window_size)
+    parser.add_argument(
+        "--sandbox",
+        default=sandbox_runtime,
+        help="Docker runtime to run coding tools in (default: $AUTOCODE_SANDBOX)",
+    )
+    # Used by the scheduler to run one feature in a worker process.
+    parser.add_argument("--feature", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--first-port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.feature is not None:
+        await run_worker(
+            args.project_dir,
+            args.feature,
+            args.first_port,
+            args.context_window_size,
+            args.sandbox or None,
+        )
+        return
+    scheduler = Scheduler(
+        args.project_dir,
+        workers=args.workers,
+        context_window_size=args.context_window_size,
+        max_attempts=args.max_attempts,
+        sandbox_runtime=args.sandbox or None,
+    )
+    state = await scheduler.run()
+    passed = sum(1 for attempt in state.attempts if attempt.passed)
+    Console().print(
+        f"[bold green]{passed} features passed in {len(state.attempts)} attempts"
+        "[/bold green]"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
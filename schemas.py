@@ -1,4 +1,5 @@
-from typing import Optional
+from datetime import datetime
+from typing import Literal, Optional
 
 from pydantic import BaseModel, Field
 
@@ -86,7 +87,178 @@ class Plan(BaseModel):
     )
 
 
+PlanSection = Literal[
+    "overview",
+    "technology_stack",
+    "prerequisites",
+    "core_features",
+    "database_schema",
+    "api_endpoints_summary",
+    "ui_layout",
+    "design_system",
+    "key_interactions",
+    "implementation_steps",
+    "success_criteria",
+]
+
+
+class PlanRevision(BaseModel):
+    sections: list[PlanSection] = Field(
+        description="The Plan fields that must change to address the feedback, including fields that must change to stay consistent with them (e.g. implementation_steps when api_endpoints_summary changes). Leave out every field the feedback does not affect."
+    )
+    reason: str = Field(
+        description="One sentence on why these sections, and only these, are affected."
+    )
+
+
+class PlanReview(BaseModel):
+    issues: list[str] = Field(
+        description="Each inconsistency between sections, naming both sides (e.g. 'POST /api/orders has no orders table'). Empty if the sections agree."
+    )
+    sections: list[PlanSection] = Field(
+        description="The fields to rewrite to fix the issues. Empty if there are none."
+    )
+
+
 class AgentDeps(BaseModel):
     context_window_size: int = Field(
         description="Maximum number of tokens the agent can process at once. This is typically the maximum context size of the model.",
     )
+    cache_friendly: bool = Field(
+        default=True,
+        description="Keep request prefixes byte-stable for provider prompt caching: tool results carry no token usage, which is appended once at the end of each request instead.",
+    )
+
+
+class FileEdit(BaseModel):
+    filepath: str = Field(description="Path to the file to edit.")
+    old_str: str = Field(
+        description="The exact text to find, including whitespace and indentation."
+    )
+    new_str: str = Field(description="The replacement text.")
+    occurrence: Optional[int] = Field(
+        default=None,
+        description="1-based index of the occurrence of old_str to replace. Omit to require old_str to occur exactly once.",
+    )
+    replace_all: bool = Field(
+        default=False,
+        description="Replace every occurrence of old_str instead of a single one.",
+    )
+
+
+class FeatureSpec(BaseModel):
+    category: str = Field(description="One of functional, style, performance or infra.")
+    description: str = Field(
+        description="What the feature does and what verifying it proves end-to-end."
+    )
+    steps: list[str] = Field(
+        default_factory=list, description="Concrete actions and verifiable outcomes."
+    )
+    passes: bool = Field(
+        default=False, description="Whether the feature has been verified end-to-end."
+    )
+    depends_on: list[int] = Field(
+        default_factory=list,
+        description="0-based indexes of features that must pass before this one.",
+    )
+
+
+class ProgressEntry(BaseModel):
+    summary: str = Field(
+        description="What was done, in a few sentences. Name files, commands and decisions."
+    )
+    feature: Optional[int] = Field(
+        default=None,
+        description="0-based index in features.json of the feature this is about, if any.",
+    )
+    validation: Optional[str] = Field(
+        default=None, description="Commands run to validate the work and their results."
+    )
+    remaining: Optional[str] = Field(
+        default=None, description="What is left to do, known issues or blockers."
+    )
+    commit: Optional[str] = Field(
+        default=None, description="The last commit hash, if work was committed."
+    )
+
+
+class ProgressRecord(ProgressEntry):
+    id: str = Field(description="Unique id of the entry.")
+    timestamp: datetime = Field(description="When the entry was logged.")
+    session: Optional[str] = Field(
+        default=None, description="Id of the agent run that logged the entry."
+    )
+
+
+class SessionRecord(BaseModel):
+    number: int = Field(description="1-based coding session number.")
+    started_at: datetime = Field(description="When the session started.")
+    finished_at: Optional[datetime] = Field(
+        default=None, description="When the session ended; unset while it is running."
+    )
+    passing_before: int = Field(
+        description="Features passing in features.json when the session started."
+    )
+    passing_after: Optional[int] = Field(
+        default=None,
+        description="Features passing in features.json when the session ended.",
+    )
+    commit: Optional[str] = Field(
+        default=None, description="HEAD commit when the session ended."
+    )
+    input_tokens: int = Field(
+        default=0, description="Input tokens sent to the model during the session."
+    )
+    cache_read_tokens: int = Field(
+        default=0,
+        description="Input tokens served from the provider's prompt cache.",
+    )
+    tool_seconds: float = Field(
+        default=0.0, description="Wall time spent inside tool calls, in seconds."
+    )
+    error: Optional[str] = Field(
+        default=None, description="Why the session failed, if it did."
+    )
+
+
+class OrchestratorState(BaseModel):
+    initialized: bool = Field(
+        default=False, description="Whether the initializer session has completed."
+    )
+    stalled: int = Field(
+        default=0,
+        description="Consecutive finished sessions that did not add a passing feature.",
+    )
+    sessions: list[SessionRecord] = Field(
+        default_factory=list, description="Coding sessions in the order they ran."
+    )
+
+
+class FeatureAttempt(BaseModel):
+    feature: int = Field(description="Index of the feature in features.json.")
+    branch: str = Field(description="Git branch the attempt was made on.")
+    started_at: datetime = Field(description="When the attempt's session started.")
+    finished_at: Optional[datetime] = Field(
+        default=None, description="When the attempt was merged or given up on."
+    )
+    merged: bool = Field(
+        default=False, description="Whether the branch merged back cleanly."
+    )
+    passed: bool = Field(
+        default=False, description="Whether the feature passes after the merge."
+    )
+    files: list[str] = Field(
+        default_factory=list, description="Files the branch changed."
+    )
+    conflicts: list[str] = Field(
+        default_factory=list, description="Files that conflicted when merging."
+    )
+    error: Optional[str] = Field(
+        default=None, description="Why the attempt failed, if it did."
+    )
+
+
+class SchedulerState(BaseModel):
+    attempts: list[FeatureAttempt] = Field(
+        default_factory=list, description="Feature attempts in the order they started."
+    )
@@ -0,0 +1,541 @@
+import atexit
+import hashlib
+import os
+import pickle
+import re
+import threading
+import time
+import weakref
+from array import array
+from collections import deque
+from collections.abc import Generator
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from fnmatch import fnmatch
+from itertools import batched
+from pathlib import Path
+from re import _constants as sre_constants  # pyright: ignore[reportAttributeAccessIssue]
+from re import _parser as sre_parser  # pyright: ignore[reportAttributeAccessIssue]
+from typing import Any
+
+from files import BINARY_SNIFF_BYTES, MAX_LINE_LENGTH, walk_files, walk_tree
+
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "autocode"
+
+
+@dataclass
+class LineMatch:
+    line_number: int
+    line: str
+    before: list[str] = field(default_factory=list)
+    after: list[str] = field(default_factory=list)
+
+
+@dataclass
+class FileMatches:
+    path: str
+    matches: list[LineMatch]
+    truncated: bool = False
+
+
+@dataclass
+class SearchResult:
+    files: list[FileMatches]
+    total_matches: int
+    files_searched: int
+    truncated: bool
+
+    def render(self) -> str:
+        if not self.files:
+            return "No matches found"
+        blocks = []
+        for file in self.files:
+            lines = []
+            for match in file.matches:
+                first = match.line_number - len(match.before)
+                for offset, line in enumerate(match.before):
+                    lines.append(f"{file.path}-{first + offset}-{line}")
+                lines.append(f"{file.path}:{match.line_number}:{match.line}")
+                for offset, line in enumerate(match.after, start=1):
+                    lines.append(f"{file.path}-{match.line_number + offset}-{line}")
+                if match.before or match.after:
+                    lines.append("--")
+            if file.truncated:
+                lines.append(f"{file.path}: [more matches in this file not shown]")
+            blocks.append("\n".join(lines))
+        summary = (
+            f"[{self.total_matches} matches in {len(self.files)} files, "
+            f"{self.files_searched} files searched"
+        )
+        if self.truncated:
+            summary += "; stopped at the match limit, narrow the pattern or path"
+        return "\n".join(blocks) + "\n\n" + summary + "]"
+
+
+def _decode(line: bytes | str) -> str:
+    if isinstance(line, bytes):
+        line = line.decode("utf-8", errors="replace")
+    text = line.removesuffix("\r")
+    if len(text) > MAX_LINE_LENGTH:
+        text = text[:MAX_LINE_LENGTH] + " ... [line truncated]"
+    return text
+
+
+def _required_literals(pattern: str, flags: int = 0) -> list[bytes]:
+    """ASCII substrings that every match of the regex must contain.
+
+    Only concatenated literals are collected; anything the parser cannot pin down
+    (classes, alternation, optional repeats) just ends the current run, so the result
+    is always safe to use as a prefilter.
+    """
+    literals: list[bytes] = []
+
+    def visit(items):
+        run = bytearray()
+        for op, av in items:
+            if op is sre_constants.LITERAL and av < 128:
+                run.append(av)
+                continue
+            literals.append(bytes(run))
+            run.clear()
+            if op is sre_constants.SUBPATTERN:
+                visit(av[-1])
+            elif op is sre_constants.ATOMIC_GROUP:
+                visit(av)
+            elif op in (
+                sre_constants.MAX_REPEAT,
+                sre_constants.MIN_REPEAT,
+                sre_constants.POSSESSIVE_REPEAT,
+            ):
+                if av[0] >= 1:
+                    visit(av[2])
+        literals.append(bytes(run))
+
+    visit(sre_parser.parse(pattern, flags))
+    return [literal.lower() for literal in literals if len(literal) >= 3]
+
+
+def _trigrams(data: bytes) -> set[int]:
+    return {(a << 16) | (b << 8) | c for a, b, c in zip(data, data[1:], data[2:])}
+
+
+@dataclass
+class IndexedFile:
+    file_id: int
+    mtime_ns: int
+    size: int
+
+
+class TrigramIndex:
+    """A persistent trigram index of a project tree, used to narrow search candidates.
+
+    The index maps every lowercased trigram to the ids of the files containing it and
+    is pickled under the cache dir. Each query re-stats the tree (no file reads) and
+    reindexes only files whose mtime or size changed, so results stay identical to
+    an unindexed scan. Reindexed files get a fresh id and their old id is tombstoned
+    until the postings are compacted.
+    """
+
+    VERSION = 1
+
+    def __init__(
+        self,
+        root: str,
+        cache_dir: Path = CACHE_DIR / "index",
+        max_file_bytes: int = 8 << 20,
+        save_interval: float = 30.0,
+    ):
+        self.root = os.path.realpath(root)
+        digest = hashlib.sha1(self.root.encode()).hexdigest()[:16]
+        self.cache_path = cache_dir / f"{digest}.pickle"
+        self.max_file_bytes = max_file_bytes
+        self.save_interval = save_interval
+        self._files: dict[str, IndexedFile] = {}
+        self._paths: dict[int, str] = {}
+        self._postings: dict[int, array] = {}
+        self._dead: set[int] = set()
+        self._next_id = 0
+        self._order: dict[str, int] = {}
+        self._dirs: set[str] = set()
+        self._dirty = False
+        self._loaded = False
+        self._saved_at = 0.0
+        self._lock = threading.RLock()
+        _live_indexes.add(self)
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.cache_path, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return
+        if state.get("version") != self.VERSION or state.get("root") != self.root:
+            return
+        self._files = state["files"]
+        self._paths = state["paths"]
+        self._postings = state["postings"]
+        self._dead = state["dead"]
+        self._next_id = state["next_id"]
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            state = {
+                "version": self.VERSION,
+                "root": self.root,
+                "files": self._files,
+                "paths": self._paths,
+                "postings": self._postings,
+                "dead": self._dead,
+                "next_id": self._next_id,
+            }
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_path.with_suffix(".tmp")
+            with open(tmp, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.cache_path)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+
+    def _forget(self, relpath: str):
+        entry = self._files.pop(relpath, None)
+        if entry:
+            self._paths.pop(entry.file_id, None)
+            self._dead.add(entry.file_id)
+            self._dirty = True
+
+    def _index_file(self, relpath: str, stat: os.stat_result):
+        self._forget(relpath)
+        file_id = self._next_id
+        self._next_id += 1
+        self._files[relpath] = IndexedFile(file_id, stat.st_mtime_ns, stat.st_size)
+        self._paths[file_id] = relpath
+        self._dirty = True
+        if stat.st_size > self.max_file_bytes:
+            return
+        try:
+            with open(os.path.join(self.root, relpath), "rb") as f:
+                data = f.read(self.max_file_bytes + 1)
+        except OSError:
+            return
+        if len(data) > self.max_file_bytes or b"\0" in data[:BINARY_SNIFF_BYTES]:
+            return
+        for trigram in _trigrams(data.lower()):
+            postings = self._postings.get(trigram)
+            if postings is None:
+                postings = self._postings[trigram] = array("I")
+            postings.append(file_id)
+
+    def _compact(self):
+        dead = self._dead
+        for trigram, postings in list(self._postings.items()):
+            kept = array("I", (file_id for file_id in postings if file_id not in dead))
+            if kept:
+                self._postings[trigram] = kept
+            else:
+                del self._postings[trigram]
+        self._dead = set()
+
+    def update(self, filepath: str):
+        """Reindex one file right away, e.g. after a write or edit tool call."""
+        path = os.path.realpath(filepath)
+        relpath = os.path.relpath(path, self.root)
+        if relpath.startswith(".."):
+            return
+        with self._lock:
+            self._load()
+            try:
+                self._index_file(relpath, os.stat(path))
+            except FileNotFoundError:
+                self._forget(relpath)
+
+    def refresh(
+        self, path: str = ".", executor: Executor | None = None
+    ) -> dict[str, str]:
+        """Bring the index in line with the tree under path, reading only changed
+        files. Returns the walked files in walk order, mapping each path relative to
+        the index root to the path as a walk of ``path`` spells it."""
+        with self._lock:
+            self._load()
+            relroot = os.path.relpath(os.path.realpath(path), self.root)
+            walked: dict[str, str] = {}
+            for directory, files in walk_tree(path, executor):
+                reldir = os.path.normpath(
+                    os.path.join(relroot, os.path.relpath(directory, path))
+                )
+                for entry in files:
+                    relpath = os.path.join(reldir, entry.name).removeprefix("./")
+                    walked[relpath] = entry.path
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    indexed = self._files.get(relpath)
+                    if (
+                        indexed is None
+                        or indexed.mtime_ns != stat.st_mtime_ns
+                        or indexed.size != stat.st_size
+                    ):
+                        self._index_file(relpath, stat)
+            prefix = "" if relroot == "." else relroot + os.sep
+            for relpath in [
+                relpath
+                for relpath in self._files
+                if relpath.startswith(prefix) and relpath not in walked
+            ]:
+                self._forget(relpath)
+            if len(self._dead) > len(self._files):
+                self._compact()
+            if self._dirty and time.monotonic() - self._saved_at > self.save_interval:
+                self.save()
+            return walked
+
+    def candidates(
+        self,
+        pattern: str,
+        path: str = ".",
+        literal: bool = False,
+        ignore_case: bool = False,
+        executor: Executor | None = None,
+    ) -> list[tuple[str, bool]] | None:
+        """Every file under path, in the order and spelling of a walk of path, with
+        whether it may match. None when the index cannot narrow the search."""
+        if os.path.relpath(os.path.realpath(path), self.root).startswith(".."):
+            return None
+        if ignore_case and not pattern.isascii():
+            # Unicode case folding can match ASCII letters to other code points
+            # (K to the Kelvin sign), which ASCII trigrams cannot rule out.
+            return None
+        if literal:
+            literals = [pattern.encode().lower()] if len(pattern.encode()) >= 3 else []
+        else:
+            flags = re.IGNORECASE if ignore_case else 0
+            literals = _required_literals(pattern, flags)
+        if not literals:
+            return None
+
+        with self._lock:
+            walked = self.refresh(path, executor)
+            trigrams = set().union(*(_trigrams(literal) for literal in literals))
+            postings = sorted(
+                (self._postings.get(trigram, array("I")) for trigram in trigrams),
+                key=len,
+            )
+            file_ids = set(postings[0])
+            for other in postings[1:]:
+                if not file_ids:
+                    break
+                file_ids.intersection_update(other)
+            relpaths = {self._paths[file_id] for file_id in file_ids - self._dead}
+        return [(walked[relpath], relpath in relpaths) for relpath in walked]
+
+
+# Indexes still alive at exit are saved by one hook, without keeping any of them
+# alive until then.
+_live_indexes: weakref.WeakSet[TrigramIndex] = weakref.WeakSet()
+
+
+@atexit.register
+def _save_indexes():
+    for index in list(_live_indexes):
+        index.save()
+
+
+class SearchEngine:
+    """In-process regex search over a directory tree.
+
+    Directories are walked level by level on a thread pool, pruning excluded and
+    .gitignored paths, and files are searched on the same pool as raw bytes so a
+    file without a match is never decoded or split into lines. Results come back in
+    walk order, shallow paths first, and stop at per-file and total match caps. With
+    a TrigramIndex only the files that can contain the pattern's literals are read.
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        max_file_bytes: int = 8 << 20,
+        batch_size: int = 64,
+        index: TrigramIndex | None = None,
+    ):
+        self.index = index
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self.max_file_bytes = max_file_bytes
+        # Files are handed to the pool in batches to keep per-future overhead down.
+        self.batch_size = batch_size
+
+    def _compile(self, pattern: str, literal: bool, ignore_case: bool) -> re.Pattern:
+        """A bytes regex, or a str one for case-insensitive non-ASCII patterns,
+        since bytes patterns only fold ASCII letters."""
+        source = re.escape(pattern) if literal else pattern
+        flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+        if ignore_case and not pattern.isascii():
+            return re.compile(source, flags)
+        return re.compile(source.encode(), flags)
+
+    def search_file(
+        self,
+        path: str,
+        regex: re.Pattern,
+        needle: bytes | None = None,
+        context: int = 0,
+        max_per_file: int = 20,
+    ) -> FileMatches | None:
+        try:
+            with open(path, "rb") as f:
+                data = f.read(self.max_file_bytes + 1)
+        except OSError:
+            return None
+        if len(data) > self.max_file_bytes or b"\0" in data[:BINARY_SNIFF_BYTES]:
+            return None
+        if needle is not None and needle not in data:
+            return None
+        text: Any = data
+        newline: Any = b"\n"
+        if isinstance(regex.pattern, str):
+            text, newline = data.decode("utf-8", errors="replace"), "\n"
+
+        matches: list[LineMatch] = []
+        lines: list | None = None
+        line_number, position, previous_line = 1, 0, 0
+        truncated = False
+        for match in regex.finditer(text):
+            line_number += text.count(newline, position, match.start())
+            position = match.start()
+            if line_number == previous_line:
+                continue
+            if len(matches) == max_per_file:
+                truncated = True
+                break
+            previous_line = line_number
+            start = text.rfind(newline, 0, position) + 1
+            end = text.find(newline, position)
+            line_match = LineMatch(
+                line_number, _decode(text[start : None if end == -1 else end])
+            )
+            if context:
+                if lines is None:
+                    lines = list(text.split(newline))
+                index = line_number - 1
+                line_match.before = [
+                    _decode(line) for line in lines[max(0, index - context) : index]
+                ]
+                line_match.after = [
+                    _decode(line) for line in lines[index + 1 : index + 1 + context]
+                ]
+            matches.append(line_match)
+        if not matches:
+            return None
+        return FileMatches(path=path, matches=matches, truncated=truncated)
+
+    def _search_batch(
+        self, batch: tuple[tuple[str, bool], ...], *args
+    ) -> list[FileMatches | None]:
+        return [
+            self.search_file(path, *args) if may_match else None
+            for path, may_match in batch
+        ]
+
+    def iter_search(
+        self,
+        pattern: str,
+        path: str = ".",
+        glob: str | None = None,
+        literal: bool = False,
+        ignore_case: bool = False,
+        context: int = 0,
+        max_per_file: int = 20,
+    ) -> Generator[FileMatches | None]:
+        """Yield FileMatches in walk order as soon as each one is ready.
+
+        Every searched file without a match yields None, so callers can count the
+        files searched. Files the index rules out yield None too, without being
+        read, so the count is the same with and without an index.
+        """
+        regex = self._compile(pattern, literal, ignore_case)
+        needle = pattern.encode() if literal and not ignore_case else None
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            if os.path.isfile(path):
+                candidates = [(path, True)]
+            else:
+                indexed = (
+                    self.index.candidates(pattern, path, literal, ignore_case, executor)
+                    if self.index
+                    else None
+                )
+                candidates = (
+                    candidate
+                    for candidate in (
+                        indexed
+                        if indexed is not None
+                        else (
+                            (entry.path, True) for entry in walk_files(path, executor)
+                        )
+                    )
+                    if glob is None or fnmatch(os.path.basename(candidate[0]), glob)
+                )
+            pending: deque[Future] = deque()
+            try:
+                for batch in batched(candidates, self.batch_size):
+                    pending.append(
+                        executor.submit(
+                            self._search_batch,
+                            batch,
+                            regex,
+                            needle,
+                            context,
+                            max_per_file,
+                        )
+                    )
+                    while pending and pending[0].done():
+                        yield from pending.popleft().result()
+                while pending:
+                    yield from pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def search(
+        self,
+        pattern: str,
+        path: str = ".",
+        glob: str | None = None,
+        literal: bool = False,
+        ignore_case: bool = False,
+        context: int = 0,
+        max_per_file: int = 20,
+        max_total: int = 200,
+    ) -> SearchResult:
+        files: list[FileMatches] = []
+        total = searched = 0
+        truncated = False
+        results = self.iter_search(
+            pattern, path, glob, literal, ignore_case, context, max_per_file
+        )
+        try:
+            for result in results:
+                searched += 1
+                if result is None:
+                    continue
+                if total >= max_total:
+                    truncated = True
+                    break
+                if len(result.matches) > max_total - total:
+                    result.matches = result.matches[: max_total - total]
+                    truncated = True
+                total += len(result.matches)
+                files.append(result)
+                if truncated:
+                    break
+        finally:
+            results.close()
+        return SearchResult(
+            files=files,
+            total_matches=total,
+            files_searched=searched,
+            truncated=truncated,
+        )
@@ -0,0 +1,93 @@
+from pathlib import Path
+from typing import Any
+
+from files import atomic_write
+from schemas import Plan
+from utils import SECTIONS, format_plan_to_markdown, render_section
+
+SPEC_FILE = "app_spec.md"
+SPEC_DATA = "app_spec.json"
+
+
+class SpecError(Exception):
+    pass
+
+
+def save_spec(plan: Plan, path: str | Path):
+    """Write the markdown spec to path and the Plan as JSON next to it."""
+    path = Path(path)
+    atomic_write(str(path), format_plan_to_markdown(plan))
+    atomic_write(str(path.with_name(SPEC_DATA)), plan.model_dump_json(indent=2) + "\n")
+
+
+def load_spec(directory: str | Path = ".") -> Plan:
+    path = Path(directory) / SPEC_DATA
+    if not path.exists():
+        raise SpecError(f"{SPEC_DATA} does not exist; read {SPEC_FILE} instead")
+    return Plan.model_validate_json(path.read_text())
+
+
+def _one_line(text: str, limit: int = 80) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
+
+def item_keys(item: Any) -> list[str]:
+    """The names an item of a list section can be looked up by."""
+    if isinstance(item, str):
+        return [item]
+    if hasattr(item, "columns"):
+        return [item.name]
+    if hasattr(item, "method"):
+        return [f"{item.method} {item.path}", item.path]
+    if hasattr(item, "workflow"):
+        return [item.feature]
+    return [item.task_name]
+
+
+def _field(section: str) -> str:
+    wanted = section.strip().lower()
+    for field, (title, _, _) in SECTIONS.items():
+        if wanted in (field, title.lower()):
+            return field
+    raise SpecError(f"no section {section!r}; sections are {', '.join(SECTIONS)}")
+
+
+def spec_outline(plan: Plan) -> str:
+    """The overview and stack in full, and the lookup keys of every other section."""
+    lines = [
+        f"Overview: {plan.overview}",
+        f"Tech stack: {plan.technology_stack}",
+    ]
+    for field, (title, _, _) in SECTIONS.items():
+        value = getattr(plan, field)
+        if field in ("overview", "technology_stack") or not value:
+            continue
+        keys = [_one_line(item_keys(item)[0]) for item in value]
+        numbered = "; ".join(f"{n}. {key}" for n, key in enumerate(keys, start=1))
+        lines.append(f"{title} ({field}, {len(keys)}): {numbered}")
+    return "\n".join(lines)
+
+
+def spec_lookup(plan: Plan, section: str, key: str | None = None) -> str:
+    """One section of the spec, or only its items matching key.
+
+    key matches an item's name exactly (case-insensitive), then its 1-based number,
+    then any item whose name contains it.
+    """
+    field = _field(section)
+    value = getattr(plan, field)
+    if key is None or isinstance(value, str):
+        return render_section(field, value) or f"The spec has no {field}."
+    items = value or []
+    wanted = key.strip().lower()
+    keyed = [(item, [k.lower() for k in item_keys(item)]) for item in items]
+    matches = [item for item, keys in keyed if wanted in keys]
+    if not matches and wanted.isdigit() and 0 < int(wanted) <= len(items):
+        matches = [items[int(wanted) - 1]]
+    if not matches:
+        matches = [item for item, keys in keyed if any(wanted in k for k in keys)]
+    if not matches:
+        available = ", ".join(_one_line(item_keys(item)[0], 40) for item in items)
+        raise SpecError(f"no {field} entry matches {key!r}; entries: {available}")
+    return render_section(field, matches)
@@ -1,58 +1,465 @@
+import asyncio
+import atexit
+import dataclasses
+import os
 import re
-import subprocess
+import shlex
+import signal
 import threading
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from pathlib import Path
 
-from pydantic_ai import RunContext
+from pydantic_ai import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    RunContext,
+    UserPromptPart,
+)
 from pydantic_ai_backends import DockerSandbox
 
-from schemas import AgentDeps
+from features import FEATURES_FILE, FeatureRegistry, render_feature
+from files import (
+    DirectoryCache,
+    EditError,
+    EditTransaction,
+    FileReader,
+    ReadCache,
+    atomic_write,
+    list_files,
+    parse_patch,
+    read_text,
+    replace_text,
+)
+from metrics import ToolMetrics, instrumented
+from output import OutputBudget, OutputStore
+from processes import ProcessManager
+from progress import ProgressStore, render_entry
+from sandboxes import SandboxPool
+from schemas import AgentDeps, FileEdit, ProgressEntry
+from search import SearchEngine, TrigramIndex
+from spec import load_spec, spec_lookup, spec_outline
 
-sandbox = DockerSandbox(runtime="python-datascience")
-sandbox.start()
+# A command that runs init.sh in the foreground (not one that merely reads or edits
+# it, and not `nohup ./init.sh` or `./init.sh &`, which return before it finishes).
+# A lone & up to the end of the command list backgrounds it; &&, &> and >&1 do not.
+INIT_SCRIPT = re.compile(
+    r"(?:^|[;&|(])\s*(?:(?:ba)?sh\s+|source\s+|\.\s+)?(?:\S*/)?init\.sh\b"
+    r"(?![^;\n]*?(?<![<>&])&(?![&>]))"
+)
+
+
+@dataclass
+class CommandResult:
+    stdout: str
+    stderr: str
+    exit_code: int | None
+    timed_out: bool = False
+
+    def __str__(self) -> str:
+        parts = []
+        if self.timed_out:
+            parts.append("TIMEOUT")
+        if self.stdout:
+            parts.append(self.stdout)
+        if self.stderr:
+            parts.append(f"STDERR:\n{self.stderr}")
+        if self.exit_code:
+            parts.append(f"EXIT CODE: {self.exit_code}")
+        return "\n".join(parts)
 
 
 class BashSession:
-    def __init__(self):
-        self.proc = subprocess.Popen(
-            ["/bin/bash"],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
+    """A persistent bash process driven by the asyncio event loop.
+
+    Both pipes are drained continuously by two long-lived reader tasks, so a noisy
+    stderr can never fill up and block the shell. Every command is framed by a
+    unique sentinel that also carries its exit code. Job control is enabled so each
+    command runs in its own process group and can be cancelled without restarting
+    the shell.
+    """
+
+    def __init__(
+        self,
+        shell: str = "/bin/bash",
+        cwd: str | None = None,
+        cancel_grace: float = 1.0,
+    ):
+        self._shell = shell
+        self._cwd = cwd
+        self._cancel_grace = cancel_grace
+        self._proc: asyncio.subprocess.Process | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock: asyncio.Lock | None = None
+        self._output: asyncio.Event | None = None
+        self._readers: list[asyncio.Task] = []
+        self._stdout = bytearray()
+        self._stderr = bytearray()
+
+    @property
+    def is_alive(self) -> bool:
+        return self._proc is not None and self._proc.returncode is None
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        # Pipes belong to the loop that created them; start over in this one.
+        self._kill()
+        self._proc = None
+        self._loop = loop
+        self._lock = asyncio.Lock()
+        self._output = asyncio.Event()
+
+    async def _start(self):
+        self._stdout = bytearray()
+        self._stderr = bytearray()
+        self._proc = await asyncio.create_subprocess_exec(
+            self._shell,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self._cwd,
+            start_new_session=True,
         )
+        self._readers = [
+            asyncio.create_task(self._drain(self._proc.stdout, self._stdout)),  # pyright: ignore[reportArgumentType]
+            asyncio.create_task(self._drain(self._proc.stderr, self._stderr)),  # pyright: ignore[reportArgumentType]
+        ]
+        self._proc.stdin.write(b"set -m\ntrap 'return 130' USR1\n")  # pyright: ignore[reportOptionalMemberAccess]
+        await self._proc.stdin.drain()  # pyright: ignore[reportOptionalMemberAccess]
 
-    def execute(self, command: str, timeout: float = 10.0) -> str:
-        self.proc.stdin.write(f"{command}; echo '__DONE__'\n")  # pyright: ignore[reportOptionalMemberAccess]
-        self.proc.stdin.flush()  # pyright: ignore[reportOptionalMemberAccess]
-        output = []
+    async def _drain(self, stream: asyncio.StreamReader, buffer: bytearray):
+        while chunk := await stream.read(65536):
+            buffer.extend(chunk)
+            self._output.set()  # pyright: ignore[reportOptionalMemberAccess]
+        self._output.set()  # pyright: ignore[reportOptionalMemberAccess]
 
-        def read_output():
-            while True:
-                line = self.proc.stdout.readline()  # pyright: ignore[reportOptionalMemberAccess]
-                if not line:
-                    break
-                output.append(line)
-                if "__DONE__" in line:
-                    break
+    async def _wait_for(self, marker: bytes) -> bool:
+        """Wait until both streams contain the marker. False if the shell died first."""
+        while True:
+            self._output.clear()  # pyright: ignore[reportOptionalMemberAccess]
+            if marker in self._stdout and marker in self._stderr:
+                return True
+            if self._proc.stdout.at_eof():  # pyright: ignore[reportOptionalMemberAccess]
+                return False
+            await self._output.wait()  # pyright: ignore[reportOptionalMemberAccess]
 
-        thread = threading.Thread(target=read_output)
-        thread.daemon = True
-        thread.start()
-        thread.join(timeout)
+    async def _children(self) -> list[int]:
+        proc = await asyncio.create_subprocess_exec(
+            "pgrep",
+            "-P",
+            str(self._proc.pid),  # pyright: ignore[reportOptionalMemberAccess]
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        stdout, _ = await proc.communicate()
+        return [int(pid) for pid in stdout.split()]
 
-        if thread.is_alive():
-            return "TIMEOUT"
+    async def _signal_children(self, sig: signal.Signals):
+        for pid in await self._children():
+            try:
+                os.killpg(os.getpgid(pid), sig)
+            except ProcessLookupError:
+                pass
 
-        output_lines = "".join(output).splitlines()
-        return "\n".join([line for line in output_lines if "__DONE__" not in line])
+    async def cancel(self, marker: bytes | None = None):
+        """Interrupt whatever is running in the shell, keeping the shell itself.
+
+        The shell gets SIGUSR1, whose trap returns from the running command as soon
+        as the current job ends, and the jobs are signalled by process group, first
+        SIGTERM and then SIGKILL. If the shell still does not reach the marker, it is
+        restarted.
+        """
+        if not self.is_alive:
+            return
+        self._proc.send_signal(signal.SIGUSR1)  # pyright: ignore[reportOptionalMemberAccess]
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            await self._signal_children(sig)
+            if marker is None:
+                continue
+            try:
+                if await asyncio.wait_for(self._wait_for(marker), self._cancel_grace):
+                    return
+            except TimeoutError:
+                continue
+        if marker is not None:
+            await self.restart()
+
+    async def execute(
+        self, command: str, timeout: float = 10.0, cwd: str | None = None
+    ) -> CommandResult:
+        self._bind_loop()
+        async with self._lock:  # pyright: ignore[reportOptionalContextManager]
+            if not self.is_alive:
+                await self.restart()
+            sentinel = f"__DONE_{uuid.uuid4().hex}__"
+            marker = f"\n{sentinel}".encode()
+            self._stdout.clear()
+            self._stderr.clear()
+            stdout_buffer, stderr_buffer = self._stdout, self._stderr
+            chdir = f"cd -- {shlex.quote(cwd)}\n" if cwd else ""
+            script = chdir + (
+                f"IFS= read -r -d '' __cmd <<'{sentinel}'\n{command}\n{sentinel}\n"
+                '__run() { eval "$__cmd"; }\n'
+                "__run < /dev/null\n"
+                f"printf '\\n{sentinel} %d\\n' $?\n"
+                f"printf '\\n{sentinel}\\n' >&2\n"
+            )
+            timed_out = False
+            try:
+                self._proc.stdin.write(script.encode())  # pyright: ignore[reportOptionalMemberAccess]
+                await self._proc.stdin.drain()  # pyright: ignore[reportOptionalMemberAccess]
+                finished = await asyncio.wait_for(self._wait_for(marker), timeout)
+            except TimeoutError:
+                timed_out = True
+                await self.cancel(marker)
+                finished = marker in stdout_buffer
+            except (BrokenPipeError, ConnectionResetError):
+                finished = False
+            except asyncio.CancelledError:
+                await asyncio.shield(self.cancel(marker))
+                raise
+
+            stdout, _, status = bytes(stdout_buffer).partition(marker)
+            stderr = bytes(stderr_buffer).partition(marker)[0]
+            exit_code = None
+            if finished and not timed_out:
+                exit_code = int(status.split()[0])
+            elif not finished and not timed_out:
+                # The command ended the shell itself (e.g. `exit 3`).
+                exit_code = await self._proc.wait()  # pyright: ignore[reportOptionalMemberAccess]
+                stderr += (
+                    b"\nbash session exited; it will be restarted on the next command"
+                )
+            return CommandResult(
+                stdout=stdout.decode(errors="replace"),
+                stderr=stderr.decode(errors="replace").strip("\n"),
+                exit_code=exit_code,
+                timed_out=timed_out,
+            )
+
+    async def ping(self, timeout: float = 2.0) -> bool:
+        """Check that the shell still answers a trivial command."""
+        result = await self.execute("true", timeout)
+        return result.exit_code == 0
+
+    def _kill(self):
+        if self._proc is None or self._proc.returncode is not None:
+            return
+        try:
+            os.killpg(self._proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    async def restart(self):
+        """Replace the shell process with a fresh one."""
+        if self.is_alive:
+            await self._signal_children(signal.SIGKILL)
+            self._kill()
+            await self._proc.wait()  # pyright: ignore[reportOptionalMemberAccess]
+        await self._start()
+
+    async def close(self):
+        if self.is_alive:
+            await self._signal_children(signal.SIGKILL)
+            self._kill()
+            await self._proc.wait()  # pyright: ignore[reportOptionalMemberAccess]
+
+
+class BashSessionPool:
+    """A bounded set of BashSessions so parallel tool calls each get their own shell.
+
+    Anonymous leases take any idle session and always start in ``cwd``. Sticky leases
+    are keyed by name, live outside the bounded set and keep their working directory
+    and environment between calls. Sessions are started lazily, and a session that
+    stops answering after a timeout is replaced before it goes back to the pool.
+    """
+
+    def __init__(self, size: int = 4, cwd: str | None = None, shell: str = "/bin/bash"):
+        self.size = size
+        self.cwd = cwd or os.getcwd()
+        self._shell = shell
+        self._idle: list[BashSession] = []
+        self._sticky: dict[str, BashSession] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._available: asyncio.Semaphore | None = None
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._available = asyncio.Semaphore(self.size)
+
+    @asynccontextmanager
+    async def lease(self, sticky: str | None = None):
+        """Borrow a session for the duration of the block."""
+        self._bind_loop()
+        if sticky:
+            if sticky not in self._sticky:
+                self._sticky[sticky] = BashSession(self._shell, cwd=self.cwd)
+            yield self._sticky[sticky]
+            return
+
+        async with self._available:  # pyright: ignore[reportOptionalContextManager]
+            session = (
+                self._idle.pop()
+                if self._idle
+                else BashSession(self._shell, cwd=self.cwd)
+            )
+            try:
+                yield session
+            finally:
+                self._idle.append(session)
+
+    async def execute(
+        self, command: str, timeout: float = 10.0, sticky: str | None = None
+    ) -> CommandResult:
+        async with self.lease(sticky) as session:
+            result = await session.execute(
+                command, timeout, cwd=None if sticky else self.cwd
+            )
+            if result.exit_code is None and not await session.ping():
+                await session.restart()
+            return result
+
+    async def close(self):
+        sessions = [*self._idle, *self._sticky.values()]
+        self._idle.clear()
+        self._sticky.clear()
+        await asyncio.gather(*(session.close() for session in sessions))
+
+
+class LazySandbox:
+    """A DockerSandbox that is only created and started on first use.
+
+    Constructing one does not touch Docker, so agents that may never need a
+    container cost nothing until a tool runs. With a pool, the sandbox is taken
+    from it (warm, and from the latest snapshot) and a successful init.sh is
+    snapshotted into it. A started container is stopped by stop() or, failing
+    that, when the interpreter exits.
+    """
+
+    def __init__(self, pool: SandboxPool | None = None, **options):
+        self.pool = pool
+        self.options = options
+        self._sandbox: DockerSandbox | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._sandbox is not None
+
+    def get(self) -> DockerSandbox:
+        """The running sandbox, starting it if this is the first call."""
+        with self._lock:
+            if self._sandbox is None:
+                if self.pool:
+                    sandbox = self.pool.take()
+                else:
+                    sandbox = DockerSandbox(**self.options)
+                    sandbox.start()
+                self._sandbox = sandbox
+                atexit.register(self.stop)
+            return self._sandbox
+
+    def bootstrapped(self):
+        """Called after init.sh succeeded in this sandbox."""
+        if self.pool and self._sandbox:
+            self.pool.snapshot(self._sandbox)
+
+    def stop(self):
+        with self._lock:
+            sandbox, self._sandbox = self._sandbox, None
+        if sandbox is not None:
+            atexit.unregister(self.stop)
+            if self.pool:
+                self.pool.release(sandbox)
+            else:
+                sandbox.stop()
 
 
 class Tools:
-    def __init__(self, session: BashSession, sandbox: DockerSandbox | None = None):
-        self._session = session
+    def __init__(self, pool: BashSessionPool, sandbox: LazySandbox | None = None):
+        self._pool = pool
         self._sandbox = sandbox
+        self._read_cache = ReadCache(FileReader())
+        self._dir_cache = DirectoryCache()
+        self._index = None if sandbox else TrigramIndex(pool.cwd)
+        self._search = SearchEngine(index=self._index)
+        self._output = OutputBudget(OutputStore(pool.cwd))
+        self.metrics = ToolMetrics()
+        self._progress = ProgressStore(pool.cwd)
+        self._features = FeatureRegistry(pool.cwd)
+        # Set while the initializer writes features.json; it is protected otherwise.
+        self.features_editable = False
+        self.processes = ProcessManager(pool.cwd)
+
+    @property
+    def local(self) -> bool:
+        """Whether commands run on this machine rather than in a sandbox."""
+        return self._sandbox is None
+
+    def process_tools(self) -> list:
+        """The background process tools, which only work for local execution."""
+        if not self.local:
+            return []
+        return [
+            self.start_process,
+            self.process_status,
+            self.tail_logs,
+            self.stop_process,
+        ]
+
+    def _invalidate(self, filepath: str):
+        """Drop cached reads, scans and index entries for a file the agent changed."""
+        self._read_cache.invalidate(filepath)
+        self._dir_cache.invalidate(filepath)
+        if self._index:
+            self._index.update(filepath)
+
+    def _protected(self, filepath: str) -> str | None:
+        """An error for edits to an existing features.json, which only mark_passing may change."""
+        path = Path(filepath)
+        if (
+            self.features_editable
+            or path.name != FEATURES_FILE
+            or not self._features.exists()
+        ):
+            return None
+        if self._sandbox:
+            # Inside the container the project is the work dir, e.g. /workspace.
+            if len(path.parts) > (3 if path.is_absolute() else 1):
+                return None
+        elif (Path(self._pool.cwd) / path).resolve() != self._features.path.resolve():
+            return None
+        return (
+            f"ERROR: {FEATURES_FILE} cannot be edited directly. "
+            "Use mark_passing to mark a verified feature as passing."
+        )
+
+    def forget_read(self, filepath: str):
+        """Make the next read of filepath return its lines even if they are unchanged.
+
+        Called when earlier reads of the file are compacted out of the message history.
+        """
+        self._read_cache.invalidate(filepath)
+
+    def _context_tokens(self, ctx: RunContext[AgentDeps]) -> int:
+        """Tokens currently in context, from the latest model response's usage."""
+        for message in reversed(ctx.messages):
+            if isinstance(message, ModelResponse) and message.usage.input_tokens:
+                return message.usage.input_tokens + message.usage.output_tokens
+        return ctx.usage.total_tokens
+
+    def _fit(self, ctx: RunContext[AgentDeps], text: str) -> tuple[str, bool]:
+        """Trim output to this call's share of the remaining context, spilling the rest."""
+        budget = self._output.tokens_for(
+            ctx.deps.context_window_size, self._context_tokens(ctx)
+        )
+        return self._output.fit(text, budget)
 
     def _should_include_usage(self, ctx: RunContext[AgentDeps]) -> bool:
         """Check if usage info should be included (exclude for Claude 4.5+)."""
@@ -68,56 +475,92 @@ class Tools:
         return True
 
     def _get_usage_info(self, ctx: RunContext[AgentDeps]) -> str:
+        """Get usage info to prefix a tool result with, unless it goes at the end."""
+        if ctx.deps.cache_friendly:
+            return ""
+        return self._usage_warning(ctx)
+
+    def append_usage(
+        self, ctx: RunContext[AgentDeps], messages: list[ModelMessage]
+    ) -> list[ModelMessage]:
+        """History processor putting usage info once at the end of each request.
+
+        Tool results then stay byte-identical across runs and the changing count
+        never sits in front of content that could otherwise be served from cache.
+        """
+        warning = self._usage_warning(ctx)
+        if not ctx.deps.cache_friendly or not warning:
+            return messages
+        last = messages[-1]
+        if isinstance(last, ModelRequest):
+            parts = [*last.parts, UserPromptPart(warning.rstrip("\n"))]
+            messages[-1] = dataclasses.replace(last, parts=parts)
+        return messages
+
+    def _usage_warning(self, ctx: RunContext[AgentDeps]) -> str:
         """Get usage info in XML format if applicable."""
         if not self._should_include_usage(ctx):
             return ""
-        used = ctx.usage.total_tokens
+        used = self._context_tokens(ctx)
         total = ctx.deps.context_window_size
         remaining = ((total - used) / total) * 100
         return f"<system_warning>Token usage: {used}/{total}; {remaining:.2f}% remaining</system_warning>\n"
 
+    @instrumented
     def read_file(
         self,
         ctx: RunContext[AgentDeps],
         filepath: str,
         offset: int = 0,
         limit: int = 2000,
+        refresh: bool = False,
     ):
-        """Read the full contents of a file from the filesystem.
+        """Read a window of lines from a file on the filesystem.
 
         Use this to inspect source code, configuration, or any text file before making changes.
+        Page through long files with offset and limit instead of reading them whole.
 
         Args:
             ctx: The run context containing usage info.
             filepath: Absolute or relative path to the file to read.
             offset: Start line index (for pagination). Defaults to 0.
             limit: Maximum number of lines to return. Defaults to 2000.
+            refresh: Return the full lines even if you have already read them unchanged.
 
         Returns:
-            The file contents as a string, "FILE_NOT_FOUND" if the path doesn't exist,
-            or "ERROR: <message>" on failure.
+            The requested lines, numbered, with a note on how to read further if the file
+            continues. Binary and very large files return a metadata summary instead.
+            Re-reading lines you already saw returns a short "unchanged" marker, or a diff
+            against your last read if the file changed since.
+            "FILE_NOT_FOUND" if the path doesn't exist, or "ERROR: <message>" on failure.
         """
         usage_info = self._get_usage_info(ctx)
 
         # Use sandbox if available
         if self._sandbox:
             try:
-                content = self._sandbox.read(filepath, offset, limit)
-                return usage_info + content
+                content = self._sandbox.get().read(filepath, offset, limit)
+                return usage_info + self._fit(ctx, content)[0]
             except FileNotFoundError:
                 return usage_info + "FILE_NOT_FOUND"
             except Exception as e:
                 return usage_info + f"ERROR: {str(e)}"
         else:
             try:
-                with open(filepath, "r") as file:
-                    content = file.read()
+                content = self._read_cache.read(
+                    filepath, offset, limit, ctx.run_id, ctx.run_step, refresh
+                )
+                content, truncated = self._fit(ctx, content)
+                if truncated:
+                    # Not everything was shown, so a re-read must not say "unchanged".
+                    self._read_cache.invalidate(filepath)
                 return usage_info + content
             except FileNotFoundError:
                 return usage_info + "FILE_NOT_FOUND"
             except Exception as e:
                 return usage_info + f"ERROR: {str(e)}"
 
+    @instrumented
     def write_file(self, ctx: RunContext[AgentDeps], filepath: str, content: str):
         """Create or overwrite a file with the given content.
 
@@ -133,63 +576,79 @@ class Tools:
             "File written successfully" on success, or "ERROR: <message>" on failure.
         """
         usage_info = self._get_usage_info(ctx)
+        if error := self._protected(filepath):
+            return usage_info + error
 
         # Use sandbox if available
         if self._sandbox:
             try:
-                self._sandbox.write(filepath, content)
+                self._sandbox.get().write(filepath, content)
                 return usage_info + "File written successfully"
             except Exception as e:
                 return usage_info + f"ERROR: {str(e)}"
         else:
             try:
-                with open(filepath, "w") as file:
-                    file.write(content)
+                atomic_write(filepath, content)
+                self._invalidate(filepath)
                 return usage_info + "File written successfully"
             except Exception as e:
                 return usage_info + f"ERROR: {str(e)}"
 
+    @instrumented
     def list_files(
         self,
         ctx: RunContext[AgentDeps],
         directory: str = ".",
         pattern: str = "*",
+        max_depth: int | None = None,
+        tree: bool = False,
+        max_results: int = 500,
     ):
         """Recursively find files matching a glob pattern within a directory.
 
         Use this to discover project structure or locate files by name/extension.
-        Automatically excludes .venv, __pycache__, and .git directories.
+        Skips .gitignored paths and .venv, __pycache__, .git and node_modules directories.
 
         Args:
             ctx: The run context containing usage info.
             directory: Root directory to search from. Defaults to current directory.
-            pattern: Glob pattern to match filenames (e.g., "*.py", "test_*"). Defaults to "*".
+            pattern: Glob pattern to match filenames (e.g., "*.py", "test_*"), or relative
+                paths if it contains a slash (e.g., "src/**/*.ts"). Defaults to "*".
+            max_depth: How many directory levels below directory to descend. Unlimited by default.
+            tree: Render the result as an indented tree instead of one path per line.
+            max_results: Maximum number of files to show. Defaults to 500.
 
         Returns:
-            A list of matching file paths as strings with usage info appended.
+            Sorted matching file paths (or a tree) followed by file and directory counts,
+            with usage info prepended.
         """
         usage_info = self._get_usage_info(ctx)
 
         # Use sandbox if available
         if self._sandbox:
             try:
-                files = self._sandbox.glob_info(pattern, directory)
+                files = self._sandbox.get().glob_info(pattern, directory)
                 result = (
                     "\n".join([str(f) for f in files]) if files else "No files found"
                 )
-                return usage_info + result
+                return usage_info + self._fit(ctx, result)[0]
             except Exception as e:
                 return usage_info + f"ERROR: {str(e)}"
         else:
-            exclude = {".venv", "__pycache__", ".git"}
-            files = [
-                str(f)
-                for f in Path(directory).rglob(pattern)
-                if not any(part in exclude for part in f.parts) and f.is_file()
-            ]
-            result = "\n".join(files) if files else "No files found"
-            return usage_info + result
+            try:
+                result = list_files(
+                    directory,
+                    pattern,
+                    max_depth=max_depth,
+                    max_results=max_results,
+                    tree=tree,
+                    cache=self._dir_cache,
+                )
+                return usage_info + self._fit(ctx, result)[0]
+            except Exception as e:
+                return usage_info + f"ERROR: {str(e)}"
 
+    @instrumented
     def edit_file(
         self,
         ctx: RunContext[AgentDeps],
@@ -201,15 +660,15 @@ class Tools:
         """Replace a specific string in a file with new content.
 
         Use this for targeted edits instead of rewriting the entire file with write_file.
-        Replaces ALL occurrences of old_str. Always read_file first to find the exact
-        string to match, including whitespace and indentation.
+        Always read_file first to find the exact string to match, including whitespace
+        and indentation. For several edits at once, use batch_edit.
 
         Args:
             ctx: The run context containing usage info.
             filepath: Path to the file to edit.
             old_str: The exact text to find and replace. Must match file content exactly.
             new_str: The replacement text.
-            replace_all: If True, replace all occurrences. If False, only replace first.
+            replace_all: If True, replace all occurrences. If False, only replace the first.
 
         Returns:
             "File edited successfully" on success,
@@ -217,75 +676,157 @@ class Tools:
             or "ERROR: <message>" on failure.
         """
         usage_info = self._get_usage_info(ctx)
+        if error := self._protected(filepath):
+            return usage_info + error
 
         # Use sandbox if available
         if self._sandbox:
             try:
-                self._sandbox.edit(filepath, old_str, new_str, replace_all)
+                self._sandbox.get().edit(filepath, old_str, new_str, replace_all)
                 return usage_info + "File edited successfully"
             except Exception as e:
                 return usage_info + f"ERROR: {str(e)}"
         else:
             try:
-                with open(filepath, "r+") as f:
-                    content = f.read()
-                    f.seek(0)
-                    new_content = content.replace(old_str, new_str)
-                    if new_content == content:
-                        return usage_info + "Warning: No changes made to the file"
-                    f.write(new_content)
-                    f.truncate()
+                content = read_text(filepath)
+                new_content, _ = replace_text(
+                    content, old_str, new_str, occurrence=1, replace_all=replace_all
+                )
+                if new_content == content:
+                    return usage_info + "Warning: No changes made to the file"
+                atomic_write(filepath, new_content)
+                self._invalidate(filepath)
                 return usage_info + "File edited successfully"
+            except EditError as e:
+                if str(e) == "old_str not found":
+                    return usage_info + "Warning: No changes made to the file"
+                return usage_info + f"ERROR: {str(e)}"
             except Exception as e:
                 return usage_info + f"ERROR: {str(e)}"
 
-    def search_files(self, ctx: RunContext[AgentDeps], pattern: str, path: str = "."):
-        """Search file contents for a text pattern using grep.
+    @instrumented
+    def batch_edit(
+        self,
+        ctx: RunContext[AgentDeps],
+        edits: list[FileEdit] | None = None,
+        patch: str | None = None,
+    ):
+        """Apply many edits and unified-diff hunks across many files in one call, all or nothing.
+
+        Use this for refactors and multi-file changes instead of many edit_file calls.
+        Every edit is checked first, against the result of the edits before it; if any
+        fails, no file is changed. Edits run before the patch.
+
+        Args:
+            ctx: The run context containing usage info.
+            edits: String replacements to apply in order. Each old_str must occur exactly
+                once unless occurrence or replace_all is given.
+            patch: A unified diff (as produced by `diff -u` or `git diff`) that may span
+                several files. Use /dev/null as the old path to create a file and as the
+                new path to delete one.
+
+        Returns:
+            A per-edit report, stating whether all changes were written or none were,
+            or "ERROR: <message>" if the patch cannot be parsed.
+        """
+        usage_info = self._get_usage_info(ctx)
+
+        if self._sandbox:
+            return usage_info + "ERROR: batch_edit is only available for local files"
+        transaction = EditTransaction()
+        try:
+            for number, edit in enumerate(edits or [], start=1):
+                transaction.edit(number, edit)
+            for file_patch in parse_patch(patch) if patch else []:
+                transaction.patch(file_patch)
+            report = "\n".join(transaction.report)
+            if transaction.failed:
+                return (
+                    usage_info
+                    + f"No files changed; {transaction.failed} edit(s) failed:\n{report}"
+                )
+            changed = transaction.changed()
+            if error := next(filter(None, map(self._protected, changed)), None):
+                return usage_info + error
+            transaction.commit()
+            for path in changed:
+                self._invalidate(path)
+            return (
+                usage_info + f"All edits applied to {len(changed)} file(s):\n{report}"
+            )
+        except Exception as e:
+            return usage_info + f"ERROR: {str(e)}"
+
+    @instrumented
+    def search_files(
+        self,
+        ctx: RunContext[AgentDeps],
+        pattern: str,
+        path: str = ".",
+        glob: str | None = None,
+        literal: bool = False,
+        ignore_case: bool = False,
+        context: int = 0,
+        max_results: int = 200,
+    ):
+        """Search file contents for a regex or literal text pattern.
 
         Use this to find where a function, variable, string, or pattern is used across
-        the codebase. Automatically excludes .venv, .git, and __pycache__ directories.
+        the codebase. Skips binary files, .gitignored paths and .venv, .git,
+        __pycache__ and node_modules directories.
 
         Args:
             ctx: The run context containing usage info.
-            pattern: Text or regex pattern to search for (passed to grep -r).
+            pattern: Python regular expression to search for, or plain text if literal is True.
             path: Directory to search within. Defaults to current directory.
+            glob: Only search files whose name matches this glob (e.g., "*.py").
+            literal: Treat pattern as plain text instead of a regex.
+            ignore_case: Match case-insensitively.
+            context: Number of lines to show before and after each match.
+            max_results: Maximum number of matching lines to return. Defaults to 200.
 
         Returns:
-            A list of matching lines in "filepath:line" format, or "ERROR: <message>" on failure.
+            Matching lines in "filepath:line:content" format (context lines use "-"),
+            shallow paths first, followed by a match summary, or "ERROR: <message>" on failure.
         """
         usage_info = self._get_usage_info(ctx)
 
         # Use sandbox if available
         if self._sandbox:
             try:
-                result = self._sandbox.grep_raw(pattern, path)
+                result = self._sandbox.get().grep_raw(pattern, path, glob)
                 result_str = (
                     "\n".join([str(line) for line in result])
                     if isinstance(result, list)
                     else result
                 )
-                return usage_info + result_str
+                return usage_info + self._fit(ctx, result_str)[0]
             except Exception as e:
                 return usage_info + f"ERROR: {str(e)}"
         else:
-            exclude = [
-                "--exclude-dir=.venv",
-                "--exclude-dir=.git",
-                "--exclude-dir=__pycache__",
-            ]
-            cmd = f"grep -r '{pattern}' '{path}' {' '.join(exclude)}"
             try:
-                result = self._session.execute(cmd)
-                result_lines = result.splitlines()
-                result_str = (
-                    "\n".join(result_lines) if result_lines else "No matches found"
+                result = self._search.search(
+                    pattern,
+                    path,
+                    glob=glob,
+                    literal=literal,
+                    ignore_case=ignore_case,
+                    context=context,
+                    max_total=max_results,
                 )
-                return usage_info + result_str
+                return usage_info + self._fit(ctx, result.render())[0]
+            except re.error as e:
+                return usage_info + f"ERROR: invalid pattern: {str(e)}"
             except Exception as e:
                 return usage_info + f"ERROR: {str(e)}"
 
-    def execute(
-        self, ctx: RunContext[AgentDeps], command: str, timeout: float = 10.0
+    @instrumented
+    async def execute(
+        self,
+        ctx: RunContext[AgentDeps],
+        command: str,
+        timeout: float = 10.0,
+        sticky_session: str | None = None,
     ) -> str:
         """Run a shell command and return its output.
 
@@ -295,24 +836,399 @@ class Tools:
         Args:
             ctx: The run context containing usage info.
             command: The bash command to execute.
-            timeout: Max seconds to wait before returning "TIMEOUT". Defaults to 10.
+            timeout: Max seconds to wait before the command is cancelled. Defaults to 10.
+            sticky_session: Name of a persistent shell to run in. Commands sharing a name
+                keep their working directory and environment (after `cd`, `export`, ...)
+                and run one after another. Omit to run in any idle shell starting at the
+                project root, so independent commands run in parallel.
 
         Returns:
-            Command stdout as a string, or "TIMEOUT" if the command exceeded the time limit.
+            Command stdout, followed by "STDERR:" output and "EXIT CODE: <n>" when
+            present. Starts with "TIMEOUT" if the command exceeded the time limit and
+            was cancelled; the shell and its working directory are kept.
         """
         usage_info = self._get_usage_info(ctx)
 
-        # Use sandbox if available, otherwise fall back to BashSession
+        # Use sandbox if available, otherwise fall back to the BashSession pool
         if self._sandbox:
             try:
-                result = self._sandbox.execute(command, int(timeout))
-                return usage_info + result.output
+                result = await asyncio.to_thread(
+                    self._sandbox.get().execute, command, int(timeout)
+                )
+                if result.exit_code == 0 and INIT_SCRIPT.search(command):
+                    self._sandbox.bootstrapped()
+                return usage_info + self._fit(ctx, result.output)[0]
             except Exception as e:
                 return usage_info + f"ERROR: {str(e)}"
         else:
-            result = self._session.execute(command, timeout)
-            return usage_info + result
+            result = await self._pool.execute(command, timeout, sticky_session)
+            return usage_info + self._fit(ctx, str(result))[0]
+
+    @instrumented
+    def read_output(self, ctx: RunContext[AgentDeps], handle: str, offset: int = 0):
+        """Page through the full text of a tool output that was truncated.
+
+        Long outputs from read_file, list_files, search_files and execute are cut to
+        their head, tail and error-looking lines, and the full text is saved under a
+        handle named in the truncation note. Read only the part you need.
+
+        Args:
+            ctx: The run context containing usage info.
+            handle: The handle from the truncation note.
+            offset: Line index to start from (as suggested in the note). Defaults to 0.
+
+        Returns:
+            Numbered lines of the saved output, as many as fit this call's budget,
+            with the offset to continue from, or "ERROR: <message>" on failure.
+        """
+        usage_info = self._get_usage_info(ctx)
+
+        try:
+            budget = self._output.tokens_for(
+                ctx.deps.context_window_size, self._context_tokens(ctx)
+            )
+            return usage_info + self._output.store.page(handle, offset, budget)
+        except Exception as e:
+            return usage_info + f"ERROR: {str(e)}"
+
+    @instrumented
+    async def start_process(
+        self,
+        ctx: RunContext[AgentDeps],
+        command: str,
+        name: str | None = None,
+        ready_port: int | None = None,
+        ready_pattern: str | None = None,
+        timeout: float = 60.0,
+    ):
+        """Start a long-running command, such as a dev server, in the background.
+
+        Use this instead of execute for anything that does not exit on its own
+        (servers, watchers, init.sh when it starts a server). Output is kept in a
+        ring buffer you can read with tail_logs. Every process is stopped when the
+        session ends.
+
+        Args:
+            ctx: The run context containing usage info.
+            command: The bash command to run.
+            name: A handle for the process. Defaults to "proc-N".
+            ready_port: Wait until this port accepts connections on localhost.
+            ready_pattern: Wait until a line of output matches this regex
+                (e.g. "Listening on|ready in").
+            timeout: Maximum seconds to wait for readiness. Defaults to 60.
+
+        Returns:
+            The handle, whether the process became ready (or exited), and its last
+            lines of output, or "ERROR: <message>" on failure.
+        """
+        usage_info = self._get_usage_info(ctx)
+
+        if self._sandbox:
+            return (
+                usage_info
+                + "ERROR: start_process is only available for local execution"
+            )
+        try:
+            process = await self.processes.start(
+                command, name, ready_port, ready_pattern
+            )
+            ready = await self.processes.wait_ready(process, timeout)
+            if ready:
+                outcome = "ready"
+            elif process.running:
+                outcome = f"still running but NOT READY after {timeout:g}s"
+            else:
+                outcome = "exited before becoming ready"
+            text = f"{process.status()}\n{outcome}\n{process.tail(20)}"
+            return usage_info + self._fit(ctx, text)[0]
+        except Exception as e:
+            return usage_info + f"ERROR: {str(e)}"
+
+    @instrumented
+    def process_status(self, ctx: RunContext[AgentDeps], handle: str | None = None):
+        """Show whether background processes are running and ready.
 
+        Args:
+            ctx: The run context containing usage info.
+            handle: The process to show. Defaults to all of them.
+
+        Returns:
+            One status line per process, or "ERROR: <message>" on failure.
+        """
+        usage_info = self._get_usage_info(ctx)
+
+        try:
+            processes = [self.processes.get(handle)] if handle else self.processes.all()
+            if not processes:
+                return usage_info + "No background processes."
+            return usage_info + "\n".join(p.status() for p in processes)
+        except Exception as e:
+            return usage_info + f"ERROR: {str(e)}"
+
+    @instrumented
+    def tail_logs(self, ctx: RunContext[AgentDeps], handle: str, n: int = 50):
+        """Show the last lines of a background process's output.
+
+        Args:
+            ctx: The run context containing usage info.
+            handle: The process handle returned by start_process.
+            n: Number of lines to show. Defaults to 50.
+
+        Returns:
+            The process status followed by its last n lines of output (stdout and
+            stderr merged), or "ERROR: <message>" on failure.
+        """
+        usage_info = self._get_usage_info(ctx)
+
+        try:
+            process = self.processes.get(handle)
+            text = f"{process.status()}\n{process.tail(n)}"
+            return usage_info + self._fit(ctx, text)[0]
+        except Exception as e:
+            return usage_info + f"ERROR: {str(e)}"
+
+    @instrumented
+    async def stop_process(self, ctx: RunContext[AgentDeps], handle: str):
+        """Stop a background process and everything it started.
+
+        Args:
+            ctx: The run context containing usage info.
+            handle: The process handle returned by start_process.
+
+        Returns:
+            The final status and last lines of output, or "ERROR: <message>".
+        """
+        usage_info = self._get_usage_info(ctx)
+
+        try:
+            process = await self.processes.stop(handle)
+            text = f"{process.status()}\n{process.tail(20)}"
+            return usage_info + self._fit(ctx, text)[0]
+        except Exception as e:
+            return usage_info + f"ERROR: {str(e)}"
+
+    @instrumented
+    def log_progress(self, ctx: RunContext[AgentDeps], entry: ProgressEntry):
+        """Record progress in the project's progress log.
+
+        Use this after every meaningful action instead of editing PROGRESS.md, which
+        is regenerated from the log. Entries are permanent and shared with future
+        sessions.
+
+        Args:
+            ctx: The run context containing usage info.
+            entry: What was done, for which feature, how it was validated, what
+                remains and the last commit.
+
+        Returns:
+            The id of the new entry, or "ERROR: <message>" on failure.
+        """
+        usage_info = self._get_usage_info(ctx)
+
+        try:
+            record = self._progress.append(entry, session=ctx.run_id)
+            return usage_info + f"Logged progress entry {record.id}"
+        except Exception as e:
+            return usage_info + f"ERROR: {str(e)}"
+
+    @instrumented
+    def latest_progress(self, ctx: RunContext[AgentDeps], n: int = 5):
+        """Show the most recent progress entries and a summary of everything older.
+
+        Use this at the start of a session to learn what earlier sessions did. The
+        result stays the same size however long the project has been running.
+
+        Args:
+            ctx: The run context containing usage info.
+            n: Number of latest entries to show in full. Defaults to 5.
+
+        Returns:
+            A summary of older entries (the latest note per feature), then the
+            latest n entries, oldest first, or "ERROR: <message>" on failure.
+        """
+        usage_info = self._get_usage_info(ctx)
+
+        try:
+            return usage_info + self._fit(ctx, self._progress.render(n))[0]
+        except Exception as e:
+            return usage_info + f"ERROR: {str(e)}"
+
+    @instrumented
+    def progress_for_feature(
+        self, ctx: RunContext[AgentDeps], feature: int, limit: int = 20
+    ):
+        """Show the progress entries logged for one feature.
+
+        Args:
+            ctx: The run context containing usage info.
+            feature: 0-based index of the feature in features.json.
+            limit: Maximum number of entries to show, newest kept. Defaults to 20.
+
+        Returns:
+            The feature's entries, oldest first, or "ERROR: <message>" on failure.
+        """
+        usage_info = self._get_usage_info(ctx)
+
+        try:
+            records = self._progress.for_feature(feature)
+            if not records:
+                return usage_info + f"No progress logged for feature {feature}."
+            shown = records[-limit:]
+            text = "\n\n".join(render_entry(record) for record in shown)
+            if len(records) > len(shown):
+                text = f"[{len(records) - len(shown)} older entries omitted]\n\n{text}"
+            return usage_info + self._fit(ctx, text)[0]
+        except Exception as e:
+            return usage_info + f"ERROR: {str(e)}"
+
+    @instrumented
+    def next_feature(self, ctx: RunContext[AgentDeps]):
+        """Show the next feature to work on.
+
+        This is the earliest feature that does not pass yet and whose dependencies
+        all pass. Use it instead of reading features.json.
+
+        Args:
+            ctx: The run context containing usage info.
+
+        Returns:
+            The feature's id, category, description and steps, a note that every
+            feature passes, or "ERROR: <message>" on failure.
+        """
+        usage_info = self._get_usage_info(ctx)
+
+        try:
+            found = self._features.next()
+            if found is None:
+                stats = self._features.stats()
+                if stats["passing"] == stats["total"]:
+                    return usage_info + f"All {stats['total']} features pass."
+                return usage_info + (
+                    "No feature is ready: every failing feature depends on another "
+                    "failing feature."
+                )
+            return usage_info + render_feature(*found)
+        except Exception as e:
+            return usage_info + f"ERROR: {str(e)}"
+
+    @instrumented
+    def get_feature(self, ctx: RunContext[AgentDeps], feature: int):
+        """Show one feature from features.json.
+
+        Args:
+            ctx: The run context containing usage info.
+            feature: 0-based index of the feature in features.json.
+
+        Returns:
+            The feature's category, description, steps, dependencies and whether it
+            passes, or "ERROR: <message>" on failure.
+        """
+        usage_info = self._get_usage_info(ctx)
+
+        try:
+            return usage_info + render_feature(feature, self._features.get(feature))
+        except Exception as e:
+            return usage_info + f"ERROR: {str(e)}"
+
+    @instrumented
+    def mark_passing(self, ctx: RunContext[AgentDeps], feature: int, evidence: str):
+        """Mark a fully verified feature as passing.
+
+        This is the only way to change features.json, which cannot be edited
+        directly. Only call it after every step of the feature has been verified.
+        The evidence is logged as a progress entry for the feature.
+
+        Args:
+            ctx: The run context containing usage info.
+            feature: 0-based index of the feature in features.json.
+            evidence: How the feature was verified: the tests or commands run and
+                what they showed.
+
+        Returns:
+            A confirmation with the new passing count, or "ERROR: <message>" if the
+            feature does not exist, already passes or depends on failing features.
+        """
+        usage_info = self._get_usage_info(ctx)
+
+        try:
+            if not evidence.strip():
+                return usage_info + "ERROR: evidence must describe the verification"
+            spec = self._features.mark_passing(feature)
+            self._progress.append(
+                ProgressEntry(
+                    summary=f"Marked passing: {spec.description}",
+                    feature=feature,
+                    validation=evidence,
+                ),
+                session=ctx.run_id,
+            )
+            stats = self._features.stats()
+            return usage_info + (
+                f"Feature {feature} marked passing "
+                f"({stats['passing']}/{stats['total']} features pass)"
+            )
+        except Exception as e:
+            return usage_info + f"ERROR: {str(e)}"
+
+    @instrumented
+    def feature_stats(self, ctx: RunContext[AgentDeps]):
+        """Show how many features pass, overall and per category.
+
+        Args:
+            ctx: The run context containing usage info.
+
+        Returns:
+            Passing and total counts, or "ERROR: <message>" on failure.
+        """
+        usage_info = self._get_usage_info(ctx)
+
+        try:
+            stats = self._features.stats()
+            lines = [f"{stats['passing']}/{stats['total']} features pass"]
+            lines.extend(
+                f"- {category}: {counts['passing']}/{counts['total']}"
+                for category, counts in stats["by_category"].items()
+            )
+            return usage_info + "\n".join(lines)
+        except Exception as e:
+            return usage_info + f"ERROR: {str(e)}"
+
+    @instrumented
+    def read_spec(
+        self,
+        ctx: RunContext[AgentDeps],
+        section: str | None = None,
+        key: str | None = None,
+    ):
+        """Look up part of the project specification instead of reading app_spec.md.
+
+        Without arguments, returns the outline: the overview, the tech stack and the
+        numbered entries of every other section. With a section, returns that
+        section; with a key as well, only its matching entries.
+
+        Args:
+            ctx: The run context containing usage info.
+            section: A section name, e.g. "database_schema", "api_endpoints_summary",
+                "ui_layout", "design_system", "key_interactions",
+                "implementation_steps" or "core_features".
+            key: An entry to find within the section: a table name, an endpoint
+                ("POST /api/users" or just its path), an interaction or task name,
+                an entry's number from the outline, or text the entry contains.
+
+        Returns:
+            The requested part of the spec as markdown, or "ERROR: <message>".
+        """
+        usage_info = self._get_usage_info(ctx)
+
+        try:
+            plan = load_spec(self._pool.cwd)
+            if section is None:
+                return usage_info + self._fit(ctx, spec_outline(plan))[0]
+            return usage_info + self._fit(ctx, spec_lookup(plan, section, key))[0]
+        except Exception as e:
+            return usage_info + f"ERROR: {str(e)}"
+
+    @instrumented
     def ask_followup(self, questions: list[str]) -> str:
         """Ask clarifying questions to resolve ambiguities in the user's requirements.
         Limit questions to 3 per call to avoid overwhelming the user.
@@ -326,23 +1242,3 @@ class Tools:
             questions: A list of specific questions to ask the user. Each question should target a single clarification point.
         """
         return "The user has clarified their requirements."
-
-    def approve(self, plan: str) -> str:
-        """Present the complete implementation plan to the user for approval.
-
-        Use this tool when:
-        - All ambiguities have been resolved
-        - The plan is comprehensive and ready for autonomous execution
-        - You need user confirmation before finalizing
-
-        Args:
-            plan: A concise, well-structured summary of the complete plan. Include:
-                  - Project overview and goals
-                  - Technology stack decisions
-                  - Key architectural decisions
-                  - Core features and implementation approach
-                  - Major milestones or phases
-
-                  Keep it digestible (1-2 pages max) while accurately representing the full detailed plan.
-        """
-        return "The user has approved the plan."
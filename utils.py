@@ -1,76 +1,155 @@
+from collections.abc import Callable, Iterator
+from typing import Annotated, Any
+
+from pydantic import TypeAdapter, ValidationError
+from pydantic.fields import FieldInfo
+from pydantic_core import from_json
+
 from schemas import Plan
 
+HEADER = "# Project Specification\n\n"
+
+
+def _bullets(items: list) -> str:
+    return "".join(f"- {item}\n" for item in items)
+
+
+def _tables(tables: list) -> str:
+    md = ""
+    for table in tables:
+        md += f"### {table.name}\n"
+        for col in table.columns:
+            md += f"- **{col.name}**: {col.type}"
+            if col.constraints:
+                md += f" ({col.constraints})"
+            md += "\n"
+        md += "\n"
+    return md
+
+
+def _endpoints(endpoints: list) -> str:
+    return "".join(f"- `{e.method} {e.path}`\n" for e in endpoints) + "\n"
+
+
+def _interactions(interactions: list) -> str:
+    return "".join(f"### {i.feature}\n{_bullets(i.workflow)}\n" for i in interactions)
+
+
+def _implementation(tasks: list) -> str:
+    return "".join(
+        f"### {t.task_name}\n{_bullets(t.implementation_steps)}\n" for t in tasks
+    )
+
+
+# Plan fields in document order: title, body renderer, and whether an empty
+# value drops the section.
+SECTIONS: dict[str, tuple[str, Callable[[Any], str], bool]] = {
+    "overview": ("Overview", lambda text: f"{text}\n\n", False),
+    "technology_stack": ("Tech Stack", lambda text: f"{text}\n\n", False),
+    "prerequisites": ("Prerequisites", lambda items: _bullets(items) + "\n", False),
+    "core_features": ("Core Features", lambda items: _bullets(items) + "\n", False),
+    "database_schema": ("Database Schema", _tables, True),
+    "api_endpoints_summary": ("API Endpoints", _endpoints, True),
+    "ui_layout": ("UI Layout", lambda items: _bullets(items) + "\n", True),
+    "design_system": ("Design System", lambda items: _bullets(items) + "\n", True),
+    "key_interactions": ("Key Interactions", _interactions, False),
+    "implementation_steps": ("Implementation Steps", _implementation, False),
+    "success_criteria": ("Success Criteria", _bullets, False),
+}
+
+
+def _adapter(field: FieldInfo) -> TypeAdapter:
+    """Validates one Plan field on its own, with the field's constraints."""
+    assert field.annotation is not None
+    return TypeAdapter(Annotated[field.annotation, field])
+
+
+_FIELDS = {name: _adapter(field) for name, field in Plan.model_fields.items()}
+
+
+def render_section(field: str, value: Any) -> str:
+    """Markdown for one Plan field, or "" for an empty optional section."""
+    title, render, optional = SECTIONS[field]
+    if optional and not value:
+        return ""
+    return f"## {title}\n{render(value)}"
+
+
+def plan_sections(plan: Plan) -> Iterator[str]:
+    """Yield the markdown of a Plan one section at a time, header first."""
+    yield HEADER
+    for field in SECTIONS:
+        if section := render_section(field, getattr(plan, field)):
+            yield section
+
 
 def format_plan_to_markdown(plan: Plan) -> str:
     """Convert a Plan to markdown format."""
-    md = "# Project Specification\n\n"
-    md += f"## Overview\n{plan.overview}\n\n"
-    md += f"## Tech Stack\n{plan.technology_stack}\n\n"
-
-    # Prerequisites
-    md += "## Prerequisites\n"
-    for req in plan.prerequisites:
-        md += f"- {req}\n"
-    md += "\n"
-
-    # Core Features
-    md += "## Core Features\n"
-    for feat in plan.core_features:
-        md += f"- {feat}\n"
-    md += "\n"
-
-    # Database Schema
-    if plan.database_schema:
-        md += "## Database Schema\n"
-        for table in plan.database_schema:
-            md += f"### {table.name}\n"
-            for col in table.columns:
-                md += f"- **{col.name}**: {col.type}"
-                if col.constraints:
-                    md += f" ({col.constraints})"
-                md += "\n"
-            md += "\n"
+    return "".join(plan_sections(plan))
 
-    # API Endpoints
-    if plan.api_endpoints_summary:
-        md += "## API Endpoints\n"
-        for endpoint in plan.api_endpoints_summary:
-            md += f"- `{endpoint.method} {endpoint.path}`\n"
-        md += "\n"
 
-    # UI Layout
-    if plan.ui_layout:
-        md += "## UI Layout\n"
-        for layout in plan.ui_layout:
-            md += f"- {layout}\n"
-        md += "\n"
+class PlanStream:
+    """Renders a Plan section by section from the partial JSON of its output tool call.
 
-    # Design System
-    if plan.design_system:
-        md += "## Design System\n"
-        for design in plan.design_system:
-            md += f"- {design}\n"
-        md += "\n"
+    A top-level field is complete once the model has moved on to the next key. Each
+    field is validated on its own as soon as it completes, and sections are yielded
+    in document order: one waits until every section before it has been yielded or
+    was skipped by the model. Joined, the yielded sections equal
+    format_plan_to_markdown of the final Plan.
+    """
 
-    # Key Interactions
-    md += "## Key Interactions\n"
-    for interaction in plan.key_interactions:
-        md += f"### {interaction.feature}\n"
-        for step in interaction.workflow:
-            md += f"- {step}\n"
-        md += "\n"
+    def __init__(self):
+        self.started = False
+        self._next = 0
+        self._values: dict[str, Any] = {}
 
-    # Implementation Steps
-    md += "## Implementation Steps\n"
-    for impl in plan.implementation_steps:
-        md += f"### {impl.task_name}\n"
-        for step in impl.implementation_steps:
-            md += f"- {step}\n"
-        md += "\n"
+    def _complete(self, args: str, final: bool) -> tuple[dict[str, Any], set[str]]:
+        try:
+            data = from_json(args, allow_partial=True) if args else {}
+        except ValueError:
+            return {}, set()
+        if not isinstance(data, dict):
+            return {}, set()
+        keys = list(data)
+        values = {}
+        for key in keys if final else keys[:-1]:
+            if key in _FIELDS and key not in self._values:
+                try:
+                    values[key] = _FIELDS[key].validate_python(data[key])
+                except ValidationError:
+                    # Left for the validation of the whole Plan to report.
+                    continue
+        return values, set(keys)
 
-    # Success Criteria
-    md += "## Success Criteria\n"
-    for criteria in plan.success_criteria:
-        md += f"- {criteria}\n"
+    def feed(self, args: str, final: bool = False) -> Iterator[str]:
+        """Yield the sections completed since the last call.
 
-    return md
+        Args:
+            args: The output tool call's arguments received so far.
+            final: Whether args is complete; flushes every remaining section.
+        """
+        values, seen = self._complete(args, final)
+        self._values.update(values)
+        if not self.started and (self._values or final):
+            self.started = True
+            yield HEADER
+        fields = list(SECTIONS)
+        while self._next < len(fields):
+            field = fields[self._next]
+            info = Plan.model_fields[field]
+            if field in self._values:
+                section = render_section(field, self._values[field])
+            elif final:
+                section = "" if info.is_required() else render_section(field, None)
+            elif (
+                not info.is_required()
+                and field not in seen
+                and seen.intersection(fields[self._next + 1 :])
+            ):
+                # The model moved past this optional field without writing it.
+                section = ""
+            else:
+                return
+            self._next += 1
+            if section:
+                yield section